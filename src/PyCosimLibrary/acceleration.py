@@ -0,0 +1,127 @@
+from typing import List
+
+import numpy as np
+
+
+class Acceleration:
+    """
+    Computes the coupling values to feed in the next iteration of an iterative co-simulation step,
+        from the values fed in the current iteration (x) and the resulting outputs (g).
+    Both x and g are overwritten by the runner after the call, so they must be copied to be kept.
+    This class implements plain fixed point iteration: the outputs are fed as they are.
+    """
+
+    def reset(self):
+        """
+        Called at the beginning of every co-simulation step.
+        """
+        pass
+
+    def next_inputs(self, x: np.ndarray, g: np.ndarray) -> np.ndarray:
+        return g
+
+
+class AitkenRelaxation(Acceleration):
+    """
+    Fixed point iteration with dynamic Aitken under-relaxation:
+        x_{k+1} = x_k + w_k r_k, with r_k = g_k - x_k,
+        and w_k = -w_{k-1} (r_{k-1} . (r_k - r_{k-1})) / |r_k - r_{k-1}|^2.
+    """
+
+    def __init__(self, initial_relaxation: float = 0.5, max_relaxation: float = 1.0):
+        self.initial_relaxation = initial_relaxation
+        self.max_relaxation = max_relaxation
+        self.reset()
+
+    def reset(self):
+        self.relaxation = self.initial_relaxation
+        self.previous_residual = None
+
+    def next_inputs(self, x: np.ndarray, g: np.ndarray) -> np.ndarray:
+        residual = g - x
+        if self.previous_residual is not None:
+            delta = residual - self.previous_residual
+            norm = np.dot(delta, delta)
+            if norm > 0.0:
+                self.relaxation = -self.relaxation * np.dot(self.previous_residual, delta) / norm
+                self.relaxation = float(np.clip(self.relaxation, -self.max_relaxation, self.max_relaxation))
+        self.previous_residual = residual
+        return x + self.relaxation * residual
+
+
+class IQNILS(Acceleration):
+    """
+    Interface quasi-Newton with an approximation for the inverse of the Jacobian from a least-squares model (IQN-ILS).
+    Keeps the differences between the residuals (V) and the outputs (W) of the iterations of the step:
+        x_{k+1} = g_k + W c, with c minimizing |V c + r_k|.
+    The first iteration of each step is relaxed by initial_relaxation.
+    The columns of the last reuse steps are kept, which often speeds up the first iterations of the next step.
+    """
+
+    def __init__(self, initial_relaxation: float = 0.5, reuse: int = 0):
+        self.initial_relaxation = initial_relaxation
+        self.reuse = reuse
+        self.previous_steps: List[List[np.ndarray]] = []
+        self.V: List[np.ndarray] = []
+        self.W: List[np.ndarray] = []
+        self.previous_residual = None
+        self.previous_output = None
+
+    def reset(self):
+        if self.reuse > 0 and len(self.V) > 0:
+            self.previous_steps = (self.previous_steps + [[self.V, self.W]])[-self.reuse:]
+        self.V = []
+        self.W = []
+        self.previous_residual = None
+        self.previous_output = None
+
+    def next_inputs(self, x: np.ndarray, g: np.ndarray) -> np.ndarray:
+        residual = g - x
+        if self.previous_residual is not None:
+            self.V.append(residual - self.previous_residual)
+            self.W.append(g - self.previous_output)
+        self.previous_residual = residual
+        self.previous_output = g.copy()
+
+        V = self.V + [v for (vs, _) in self.previous_steps for v in vs]
+        W = self.W + [w for (_, ws) in self.previous_steps for w in ws]
+        if len(V) == 0:
+            return x + self.initial_relaxation * residual
+
+        c = np.linalg.lstsq(np.column_stack(V), -residual, rcond=None)[0]
+        return g + np.column_stack(W) @ c
+
+
+class AndersonAcceleration(Acceleration):
+    """
+    Anderson acceleration (type II) with a limited history of depth iterations:
+        x_{k+1} = x_k + b r_k - (dX + b dR) c, with c minimizing |dR c - r_k|,
+        where dX and dR hold the differences between consecutive inputs and residuals.
+    """
+
+    def __init__(self, depth: int = 5, mixing: float = 1.0):
+        self.depth = depth
+        self.mixing = mixing
+        self.reset()
+
+    def reset(self):
+        self.dX: List[np.ndarray] = []
+        self.dR: List[np.ndarray] = []
+        self.previous_x = None
+        self.previous_residual = None
+
+    def next_inputs(self, x: np.ndarray, g: np.ndarray) -> np.ndarray:
+        residual = g - x
+        if self.previous_residual is not None:
+            self.dX = (self.dX + [x - self.previous_x])[-self.depth:]
+            self.dR = (self.dR + [residual - self.previous_residual])[-self.depth:]
+        self.previous_x = x.copy()
+        self.previous_residual = residual
+
+        if len(self.dR) == 0:
+            return x + self.mixing * residual
+
+        dX = np.column_stack(self.dX)
+        dR = np.column_stack(self.dR)
+        c = np.linalg.lstsq(dR, residual, rcond=None)[0]
+        return x + self.mixing * residual - (dX + self.mixing * dR) @ c
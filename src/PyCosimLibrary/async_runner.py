@@ -0,0 +1,127 @@
+import asyncio
+from concurrent.futures import Executor
+from itertools import islice
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from PyCosimLibrary.results import CosimResults
+from PyCosimLibrary.runner import CosimRunner
+from PyCosimLibrary.scenario import CosimScenario
+
+Snapshot = Tuple[float, np.ndarray]
+
+
+class AsyncCosim:
+    """
+    Runs a co-simulation from an asyncio event loop, so that a single loop can drive many co-simulations.
+    The co-simulation (see CosimRunner.cosim_steps) runs in an executor, in batches of snapshots_per_batch snapshots,
+        and the event loop is free while a batch runs.
+    The batches of a run never overlap, so its FMUs are used by one thread at a time.
+    The snapshots (time and a copy of the row of the results) are streamed through an async iterator:
+        async for (time, row) in AsyncCosim(runner, scenario):
+    At most queue_size snapshots wait to be consumed: when the queue is full, the run pauses until the consumer
+        catches up (backpressure).
+    Calling cancel stops the run after the current batch, and terminates it (see CosimRunner.terminate_cosim).
+        The results keep the snapshots taken so far.
+    Cancelling the task that awaits run, or that waits for the next snapshot, cancels the run as well.
+        A consumer that may stop iterating before the end (by break, error or cancellation) should use the run
+        as an async context manager, which cancels it on exit:
+            async with cosim:
+                async for (time, row) in cosim:
+    The results are in self.results, once the run has started.
+    """
+
+    def __init__(self, runner: CosimRunner, scenario: CosimScenario, results: CosimResults = None,
+                 executor: Executor = None, snapshots_per_batch: int = 1, queue_size: int = 16):
+        """
+        :param executor: where the batches run. Defaults to the executor of the event loop.
+        """
+        self.runner = runner
+        self.scenario = scenario
+        self.results = results
+        self.executor = executor
+        self.snapshots_per_batch = max(1, snapshots_per_batch)
+        self.queue_size = queue_size
+        self.steps = None
+        self.queue: asyncio.Queue = None
+        self.task: asyncio.Task = None
+
+    def start(self):
+        self.runner.prepare_cosim(self.scenario)
+        self.results = self.runner.init_results(self.scenario, self.results)
+        self.steps = self.runner.cosim_steps(self.scenario, None, self.results)
+
+    def next_batch(self) -> List[Snapshot]:
+        return [(time, row.copy()) for (time, row) in islice(self.steps, self.snapshots_per_batch)]
+
+    async def offload(self, function: Callable):
+        future = asyncio.get_running_loop().run_in_executor(self.executor, function)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The batch cannot be interrupted: wait for it, so that the FMUs are never used by two threads.
+            await asyncio.wait([future])
+            raise
+
+    async def produce(self):
+        try:
+            await self.offload(self.start)
+            while True:
+                batch = await self.offload(self.next_batch)
+                for snapshot in batch:
+                    await self.queue.put(snapshot)
+                if len(batch) < self.snapshots_per_batch:
+                    break
+        except asyncio.CancelledError:
+            if self.steps is not None:
+                await self.offload(self.steps.close)
+            raise
+        except Exception:
+            await self.queue.put(None)
+            raise
+        await self.queue.put(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Snapshot:
+        if self.task is None:
+            self.queue = asyncio.Queue(self.queue_size)
+            self.task = asyncio.ensure_future(self.produce())
+        try:
+            snapshot = await self.queue.get()
+        except asyncio.CancelledError:
+            await self.cancel()
+            raise
+        if snapshot is None:
+            # Raises the error of the run, if any.
+            await self.task
+            raise StopAsyncIteration
+        return snapshot
+
+    async def run(self) -> CosimResults:
+        """
+        Runs the co-simulation to the end, discarding the streamed snapshots.
+        :return: the results.
+        """
+        async for _ in self:
+            pass
+        return self.results
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.cancel()
+
+    async def cancel(self):
+        """
+        Stops the run, and waits until it is terminated.
+        """
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
@@ -0,0 +1,155 @@
+"""
+Benchmarks of the master algorithms on synthetic scenarios (see synthetic.fmus).
+
+Usage:
+    python -m PyCosimLibrary.benchmark [--fmus 2 8] [--signals 1 16] [--steps 1000] [--output results.json]
+                                       [--compare baseline.json] [--threshold 0.2]
+
+Each case reports steps per second, time per doStep, time of output propagation and of snapshots,
+    and peak memory of the run. Results are written as json, so that they can be compared across releases:
+    with --compare, cases slower than the baseline by more than threshold are reported and the exit code is 1.
+"""
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+from PyCosimLibrary.gauss_seidel_runner import GaussSeidelRunner
+from PyCosimLibrary.jacobi_runner import JacobiRunner
+from PyCosimLibrary.jacobit_it_runner import JacobiIterativeRunner
+from PyCosimLibrary.runner import CosimRunner
+from PyCosimLibrary.synthetic.fmus import lag_chain
+
+RUNNERS: Dict[str, Callable[[], CosimRunner]] = {
+    "jacobi": JacobiRunner,
+    "gauss_seidel": GaussSeidelRunner,
+    "jacobi_iterative": lambda: JacobiIterativeRunner(10, 1e-6),
+}
+
+
+def time_calls(f: Callable, repetitions: int) -> float:
+    """
+    :return: mean time of calling f, in seconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        f()
+    return (time.perf_counter() - start) / repetitions
+
+
+def benchmark_case(runner_name: str, num_fmus: int, signals: int, ring: bool, steps: int,
+                   repetitions: int = 100) -> Dict:
+    step_size = 1e-3
+    build = lambda: lag_chain(num_fmus, signals, ring=ring, step_size=step_size, stop_time=steps * step_size,
+                              print_interval=10 * step_size)
+
+    # Whole run
+    runner = RUNNERS[runner_name]()
+    scenario = build()
+    start = time.perf_counter()
+    runner.run_cosim(scenario, None)
+    elapsed = time.perf_counter() - start
+
+    # Peak memory of a second run, since tracing slows it down.
+    runner = RUNNERS[runner_name]()
+    scenario = build()
+    tracemalloc.start()
+    runner.run_cosim(scenario, None)
+    (_, peak_memory) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Phases, on the scenario as left by the run.
+    f = scenario.fmus[0]
+    do_step = time_calls(lambda: f.doStep(0.0, step_size), repetitions)
+    propagate = time_calls(runner.plan.execute, repetitions)
+    results = runner.init_results(scenario)
+    snapshot = time_calls(lambda: runner.snapshot(0.0, scenario, results), repetitions)
+
+    return {
+        "runner": runner_name,
+        "fmus": num_fmus,
+        "signals": signals,
+        "connections": len(scenario.connections),
+        "outputs": sum(len(o.source_vr) for o in scenario.outputs),
+        "ring": ring,
+        "steps": steps,
+        "seconds": elapsed,
+        "steps_per_second": steps / elapsed,
+        "do_step_seconds": do_step,
+        "propagate_seconds": propagate,
+        "snapshot_seconds": snapshot,
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def case_key(case: Dict):
+    return (case["runner"], case["fmus"], case["signals"], case["ring"], case["steps"])
+
+
+def compare(cases: List[Dict], baseline: List[Dict], threshold: float) -> List[str]:
+    """
+    :return: a message for each case whose throughput is lower than the baseline by more than threshold.
+    """
+    baseline_cases = {case_key(c): c for c in baseline}
+    regressions = []
+    for case in cases:
+        reference = baseline_cases.get(case_key(case))
+        if reference is None:
+            continue
+        ratio = case["steps_per_second"] / reference["steps_per_second"]
+        if ratio < 1.0 - threshold:
+            regressions.append(f"{case_key(case)}: {case['steps_per_second']:.0f} steps/s, "
+                               f"baseline {reference['steps_per_second']:.0f} steps/s ({ratio:.0%})")
+    return regressions
+
+
+def run_benchmarks(fmus: List[int], signals: List[int], steps: int, runners: List[str] = None) -> List[Dict]:
+    cases = []
+    for runner_name in (runners if runners is not None else RUNNERS.keys()):
+        for num_fmus in fmus:
+            for num_signals in signals:
+                for ring in [False, True]:
+                    cases.append(benchmark_case(runner_name, num_fmus, num_signals, ring, steps))
+    return cases
+
+
+def print_table(cases: List[Dict]):
+    print(f"{'runner':<18}{'fmus':>6}{'signals':>9}{'ring':>6}{'steps/s':>11}"
+          f"{'doStep us':>11}{'propagate us':>14}{'snapshot us':>13}{'peak KiB':>10}")
+    for c in cases:
+        print(f"{c['runner']:<18}{c['fmus']:>6}{c['signals']:>9}{str(c['ring']):>6}{c['steps_per_second']:>11.0f}"
+              f"{c['do_step_seconds'] * 1e6:>11.1f}{c['propagate_seconds'] * 1e6:>14.1f}"
+              f"{c['snapshot_seconds'] * 1e6:>13.1f}{c['peak_memory_bytes'] / 1024:>10.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks of the co-simulation master algorithms.")
+    parser.add_argument("--fmus", type=int, nargs="+", default=[2, 8])
+    parser.add_argument("--signals", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--runners", nargs="+", choices=list(RUNNERS.keys()), default=None)
+    parser.add_argument("--output", help="File to write the results to, as json.")
+    parser.add_argument("--compare", help="Results of a previous benchmark, as json.")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    cases = run_benchmarks(args.fmus, args.signals, args.steps, args.runners)
+    print_table(cases)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"python": sys.version, "cases": cases}, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(cases, json.load(f)["cases"], args.threshold)
+        for r in regressions:
+            print("Regression:", r)
+        return 1 if len(regressions) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import os
+import pickle
+import time
+from typing import Dict
+
+import numpy as np
+from fmpy.fmi2 import FMU2Slave
+
+from PyCosimLibrary.scenario import CosimScenario
+
+
+class Checkpointer:
+    """
+    Periodically writes a checkpoint of a co-simulation run to a file, so that it can be resumed after a failure
+        with CosimRunner.resume_cosim.
+    A checkpoint holds the serialized state of every FMU, the number of steps taken, the state of the results,
+        and the state of the runner (see CosimRunner.checkpoint_state).
+    Checkpoints are written after a snapshot, once at least interval seconds (wall-clock) passed since the last one.
+    Each checkpoint replaces the previous one atomically, so a failure while writing keeps the previous checkpoint.
+    The snapshots of in-memory results are appended to a file next to the checkpoint ("<path>.rows"),
+        so that each checkpoint only writes the snapshots taken since the previous one.
+        The checkpoint records how many rows of that file belong to it.
+    """
+
+    def __init__(self, path: str, interval: float = 600.0):
+        self.path = path
+        self.interval = interval
+        self.last_checkpoint = None
+
+    def start(self):
+        self.last_checkpoint = time.monotonic()
+
+    def due(self) -> bool:
+        return time.monotonic() - self.last_checkpoint >= self.interval
+
+    @staticmethod
+    def save_fmu_state(f: FMU2Slave) -> bytes:
+        state = f.getFMUstate()
+        try:
+            return f.serializeFMUstate(state)
+        finally:
+            f.freeFMUstate(state)
+
+    @staticmethod
+    def load_fmu_state(f: FMU2Slave, serialized_state: bytes):
+        state = f.deSerializeFMUstate(serialized_state)
+        f.setFMUstate(state)
+        f.freeFMUstate(state)
+
+    @staticmethod
+    def rows_path(path: str) -> str:
+        return path + ".rows"
+
+    def append_rows(self, start: int, rows: np.ndarray):
+        """
+        Writes the rows after the first start rows of the rows file (dropping any row after those,
+            e.g., written before a failure, or by the run that a resumed run replaces).
+        """
+        rows_path = self.rows_path(self.path)
+        with open(rows_path, "r+b" if os.path.exists(rows_path) else "wb") as file:
+            file.truncate(start * rows.shape[1] * rows.itemsize)
+            file.seek(0, os.SEEK_END)
+            file.write(rows.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+
+    def write(self, scenario: CosimScenario, tick: int, results, runner_state: Dict = None):
+        """
+        Writes a checkpoint of the run, after tick steps.
+        :param runner_state: state kept by the runner between steps (see CosimRunner.checkpoint_state).
+        """
+        results_state = results.checkpoint()
+        rows = results_state.pop("rows", None)
+        if rows is not None:
+            self.append_rows(results_state["start"], rows)
+            results_state["size"] = results_state["start"] + rows.shape[0]
+            results_state["num_columns"] = rows.shape[1]
+        checkpoint = {
+            "tick": tick,
+            "step_size": scenario.step_size,
+            "fmus": {f.instanceName: self.save_fmu_state(f) for f in scenario.fmus},
+            "results": results_state,
+            "runner": runner_state,
+        }
+        staging = self.path + ".tmp"
+        with open(staging, "wb") as file:
+            pickle.dump(checkpoint, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(staging, self.path)
+        self.last_checkpoint = time.monotonic()
+
+    @staticmethod
+    def read(path: str) -> Dict:
+        """
+        Reads the checkpoint, with the rows of in-memory results (in checkpoint["results"]["data"]).
+        """
+        with open(path, "rb") as file:
+            checkpoint = pickle.load(file)
+        state = checkpoint["results"]
+        if "size" in state:
+            (size, num_columns) = (state["size"], state["num_columns"])
+            state["data"] = np.fromfile(Checkpointer.rows_path(path), dtype=np.float64,
+                                        count=size * num_columns).reshape(size, num_columns)
+        return checkpoint
+
+    @staticmethod
+    def restore(checkpoint: Dict, scenario: CosimScenario, results) -> int:
+        """
+        Sets the FMUs and results to the checkpoint.
+        :return: the number of steps taken at the checkpoint.
+        """
+        if checkpoint["step_size"] != scenario.step_size:
+            raise ValueError(f"The checkpoint was taken with step size {checkpoint['step_size']}, "
+                             f"but the scenario has step size {scenario.step_size}.")
+        fmus = {f.instanceName: f for f in scenario.fmus}
+        if set(fmus.keys()) != set(checkpoint["fmus"].keys()):
+            raise ValueError(f"The checkpoint has the FMUs {sorted(checkpoint['fmus'].keys())}, "
+                             f"but the scenario has {sorted(fmus.keys())}.")
+        for (name, serialized_state) in checkpoint["fmus"].items():
+            Checkpointer.load_fmu_state(fmus[name], serialized_state)
+        results.restore(checkpoint["results"])
+        return checkpoint["tick"]
@@ -34,14 +34,20 @@ class MSD1(VirtualFMU):
     def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
         n = 10
         h = communicationStepSize / n
+        # Work on local variables, instead of indexing the state in every substep.
+        s = self.state
+        (x, v, m, c, cf, fe) = (s[self.x], s[self.v], s[self.m], s[self.c], s[self.cf], s[self.fe])
         for i in range(n):
-            der_x = self.state[self.v]
-            der_v = (1.0 / self.state[self.m]) * (- self.state[self.c] * self.state[self.x]
-                                                  - self.state[self.cf] * self.state[self.v]
-                                                  + self.state[self.fe])
+            der_x = v
+            der_v = (1.0 / m) * (- c * x
+                                 - cf * v
+                                 + fe)
 
-            self.state[self.x] = self.state[self.x] + der_x * h
-            self.state[self.v] = self.state[self.v] + der_v * h
+            x = x + der_x * h
+            v = v + der_v * h
+
+        s[self.x] = x
+        s[self.v] = v
 
         return fmi2OK
 
@@ -89,16 +95,24 @@ class MSD2(VirtualFMU):
     def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
         n = 10
         h = communicationStepSize / n
+        # Work on local variables, instead of indexing the state in every substep.
+        s = self.state
+        (x, v, m, c, cf, ce, cef, fe, xe, ve) = (s[self.x], s[self.v], s[self.m], s[self.c], s[self.cf],
+                                                 s[self.ce], s[self.cef], s[self.fe], s[self.xe], s[self.ve])
         for i in range(n):
-            self.state[self.fe] = self.state[self.ce] * (self.state[self.x] - self.state[self.xe]) \
-                                  + self.state[self.cef] * (self.state[self.v] - self.state[self.ve])
+            fe = ce * (x - xe) \
+                 + cef * (v - ve)
+
+            der_x = v
+            der_v = (1.0 / m) * (- c * x
+                                 - cf * v
+                                 - fe)
 
-            der_x = self.state[self.v]
-            der_v = (1.0 / self.state[self.m]) * (- self.state[self.c] * self.state[self.x]
-                                                  - self.state[self.cf] * self.state[self.v]
-                                                  - self.state[self.fe])
+            x = x + der_x * h
+            v = v + der_v * h
 
-            self.state[self.x] = self.state[self.x] + der_x * h
-            self.state[self.v] = self.state[self.v] + der_v * h
+        s[self.fe] = fe
+        s[self.x] = x
+        s[self.v] = v
 
-        return fmi2OK
\ No newline at end of file
+        return fmi2OK
@@ -0,0 +1,133 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from PyCosimLibrary.runner import CosimRunner
+from PyCosimLibrary.scenario import CosimScenario
+
+# Parameters of an ensemble member: instance name -> (value references, values)
+MemberParameters = Dict[str, Tuple[List[int], List[float]]]
+
+
+def parameter_grid(axes: Dict[Tuple[str, int], List[float]]) -> List[MemberParameters]:
+    """
+    Builds the members of a full factorial sweep.
+    :param axes: the values to sweep, for each (instance name, value reference).
+    :return: one member per combination of values.
+    """
+    keys = list(axes.keys())
+    members = []
+    for values in itertools.product(*[axes[k] for k in keys]):
+        member: MemberParameters = {}
+        for ((instance, vr), value) in zip(keys, values):
+            (vrs, vals) = member.setdefault(instance, ([], []))
+            vrs.append(vr)
+            vals.append(value)
+        members.append(member)
+    return members
+
+
+class EnsembleResults:
+    """
+    Results of all members of an ensemble, stacked in one array (member x time x column).
+    Columns are the same as in CosimResults (column 0 holds the time).
+    Members that produced fewer snapshots than others (e.g., due to a stop condition) are padded with nan.
+    """
+    data: np.ndarray = None
+    columns: Dict[str, Dict[int, int]] = None
+    lengths: List[int] = None
+    members: List[MemberParameters] = None
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.data[:, :, 0]
+
+    def signal(self, instance: str, vr: int) -> np.ndarray:
+        """
+        :return: view with the signal of every member (member x time).
+        """
+        return self.data[:, :, self.columns[instance][vr]]
+
+
+class EnsembleWorker:
+    """
+    Builds the scenario and runner once, and runs any number of members with them.
+    Between members, the FMUs are reset with reset() instead of being instantiated again.
+    """
+
+    def __init__(self, scenario_factory: Callable[[], CosimScenario], runner_factory: Callable[[], CosimRunner]):
+        self.scenario = scenario_factory()
+        self.runner = runner_factory()
+        self.base_parameters = dict(self.scenario.real_parameters)
+        self.fmus = {f.instanceName: f for f in self.scenario.fmus}
+        self.used = False
+
+    def run(self, member: MemberParameters):
+        if self.used:
+            for f in self.scenario.fmus:
+                f.reset()
+        self.used = True
+
+        parameters = dict(self.base_parameters)
+        for (instance, (vrs, vals)) in member.items():
+            f = self.fmus[instance]
+            (base_vrs, base_vals) = parameters.get(f, ([], []))
+            parameters[f] = (list(base_vrs) + list(vrs), list(base_vals) + list(vals))
+        self.scenario.real_parameters = parameters
+
+        results = self.runner.run_cosim(self.scenario, None)
+        return results.columns, np.array(results.data[:results.size])
+
+
+_worker: EnsembleWorker = None
+
+
+def init_worker(scenario_factory, runner_factory):
+    global _worker
+    _worker = EnsembleWorker(scenario_factory, runner_factory)
+
+
+def run_member(member: MemberParameters):
+    return _worker.run(member)
+
+
+class EnsembleRunner:
+    """
+    Runs many variants (members) of the same scenario, each with different parameters, on a process pool.
+    Each worker process calls the factories once, and reuses the scenario for all the members it runs.
+    Factories must be picklable (e.g., module level functions), and should load FMUs through FMULoader
+        with a shared FMULoader.cache (set in the factory), so that the workers reuse the same extractions.
+    Parameters of the members are added to the scenario.real_parameters built by the factory.
+    With processes=0, the members are run in the calling process.
+    """
+
+    def __init__(self, scenario_factory: Callable[[], CosimScenario], runner_factory: Callable[[], CosimRunner],
+                 processes: int = None):
+        self.scenario_factory = scenario_factory
+        self.runner_factory = runner_factory
+        self.processes = processes
+
+    def run(self, members: List[MemberParameters]) -> EnsembleResults:
+        if self.processes == 0:
+            worker = EnsembleWorker(self.scenario_factory, self.runner_factory)
+            outputs = [worker.run(m) for m in members]
+        else:
+            processes = self.processes if self.processes is not None else os.cpu_count()
+            chunk_size = max(1, len(members) // (4 * processes))
+            with ProcessPoolExecutor(max_workers=processes, initializer=init_worker,
+                                     initargs=(self.scenario_factory, self.runner_factory)) as pool:
+                outputs = list(pool.map(run_member, members, chunksize=chunk_size))
+
+        results = EnsembleResults()
+        results.members = members
+        results.lengths = [data.shape[0] for (_, data) in outputs]
+        if len(outputs) == 0:
+            return results
+        results.columns = outputs[0][0]
+        results.data = np.full((len(outputs), max(results.lengths), outputs[0][1].shape[1]), np.nan)
+        for (i, (_, data)) in enumerate(outputs):
+            results.data[i, :data.shape[0]] = data
+        return results
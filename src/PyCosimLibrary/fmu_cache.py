@@ -0,0 +1,221 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+from fmpy import read_model_description
+from fmpy.model_description import ModelDescription
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# Without fcntl (on Windows), msvcrt only has exclusive locks on byte ranges of a file:
+#     each user locks one of LOCK_SLOTS bytes of the lock file, and the entry is removed only if all bytes can be locked.
+LOCK_SLOTS = 1024
+
+
+def lock_shared(lock_file):
+    """
+    Takes a shared lock on the open file, waiting while someone holds an exclusive lock on it.
+    """
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_SH)
+    elif msvcrt is not None:
+        while True:
+            for slot in range(LOCK_SLOTS):
+                lock_file.seek(slot)
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+                    return
+                except OSError:
+                    pass
+            time.sleep(0.01)
+
+
+def try_lock_exclusive(lock_file) -> bool:
+    """
+    Takes an exclusive lock on the open file, unless someone holds a lock on it.
+    :return: whether the lock was taken.
+    """
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, LOCK_SLOTS)
+    except OSError:
+        return False
+    return True
+
+
+class CacheEntry:
+    def __init__(self, key: str, dir: str, model_description: ModelDescription):
+        self.key = key
+        self.dir = dir
+        self.model_description = model_description
+        self.users = 0
+        self.lock_file = None  # Holds a shared lock on the entry while it is in use (see FMUCache.lock_entry).
+
+
+class FMUCache:
+    """
+    On-disk cache of extracted FMUs, keyed by the hash of the contents of the .fmu file.
+    Each entry is a directory holding the extracted FMU (in "fmu") and its parsed model description (pickled).
+    Entries are created in a temporary directory and renamed into place,
+        so that processes sharing the cache never see a partially extracted FMU.
+    Every user of an entry (in this or other processes) holds a shared lock on its lock file ("<key>.lock"),
+        which the operating system releases if the process dies.
+    When there are more than max_entries, the least recently used entries that nobody holds are removed.
+        This needs file locks (fcntl, or msvcrt on Windows): on other platforms, entries are never removed.
+    Within a process, loading the same FMU again (e.g., for another instance) shares the extraction
+        and the parsed model description.
+    """
+    MODEL_DESCRIPTION = "model_description.pickle"
+    FMU_DIR = "fmu"
+
+    def __init__(self, directory: str = None, max_entries: int = 32):
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(), "PyCosimLibrary-fmu-cache")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.entries: Dict[str, CacheEntry] = {}
+        self.hashes: Dict[Tuple[str, int, int], str] = {}
+        self.lock = threading.Lock()
+
+    def key(self, fmu_path: Path) -> str:
+        """
+        Hash of the contents of the file, remembered for as long as its size and modification time do not change.
+        """
+        stat = fmu_path.stat()
+        file_id = (str(fmu_path.resolve()), stat.st_size, stat.st_mtime_ns)
+        if file_id not in self.hashes:
+            digest = hashlib.sha256()
+            with open(fmu_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            self.hashes[file_id] = digest.hexdigest()
+        return self.hashes[file_id]
+
+    def acquire(self, fmu_path) -> CacheEntry:
+        """
+        Extracts the FMU into the cache, unless it is already there.
+        Every call must be matched by a call to release.
+        """
+        fmu_path = Path(fmu_path)
+        with self.lock:
+            key = self.key(fmu_path)
+            entry = self.entries.get(key)
+            if entry is None:
+                lock_file = self.lock_entry(key)
+                try:
+                    entry = self.open_entry(key, fmu_path)
+                except BaseException:
+                    lock_file.close()
+                    raise
+                entry.lock_file = lock_file
+                self.entries[key] = entry
+            elif not os.path.isdir(entry.dir):
+                # Removed by someone else than the cache.
+                entry.model_description = self.extract(key, fmu_path)
+            entry.users += 1
+        os.utime(self.directory / key)
+        self.evict()
+        return entry
+
+    def release(self, entry: CacheEntry):
+        with self.lock:
+            entry.users -= 1
+            if entry.users == 0:
+                del self.entries[entry.key]
+                # Closing the file releases the lock.
+                entry.lock_file.close()
+                entry.lock_file = None
+
+    def lock_entry(self, key: str):
+        """
+        Takes a shared lock on the entry, which keeps other processes from removing it.
+        It waits for a process that is removing the entry, which then has to be extracted again.
+        :return: the open lock file.
+        """
+        lock_file = open(self.directory / f"{key}.lock", "a+b")
+        try:
+            lock_shared(lock_file)
+        except BaseException:
+            lock_file.close()
+            raise
+        return lock_file
+
+    def open_entry(self, key: str, fmu_path: Path) -> CacheEntry:
+        entry_dir = self.directory / key
+        try:
+            model_description = self.load_model_description(key)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            model_description = self.extract(key, fmu_path)
+        return CacheEntry(key, str(entry_dir / self.FMU_DIR), model_description)
+
+    def load_model_description(self, key: str) -> ModelDescription:
+        with open(self.directory / key / self.MODEL_DESCRIPTION, "rb") as f:
+            return pickle.load(f)
+
+    def extract(self, key: str, fmu_path: Path) -> ModelDescription:
+        staging = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=self.directory)
+        try:
+            shutil.unpack_archive(str(fmu_path), os.path.join(staging, self.FMU_DIR), "zip")
+            model_description = read_model_description(os.path.join(staging, self.FMU_DIR))
+            with open(os.path.join(staging, self.MODEL_DESCRIPTION), "wb") as f:
+                pickle.dump(model_description, f)
+            os.rename(staging, self.directory / key)
+        except OSError:
+            # Another process created the entry first.
+            if not (self.directory / key / self.MODEL_DESCRIPTION).exists():
+                raise
+            model_description = self.load_model_description(key)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return model_description
+
+    def evict(self):
+        """
+        Removes the least recently used entries beyond max_entries, skipping the ones that someone holds.
+        An entry is locked exclusively and moved away before being deleted,
+            so that other processes either find it complete or not at all.
+        """
+        if fcntl is None and msvcrt is None:
+            return
+        candidates = []
+        for path in self.directory.iterdir():
+            if path.is_dir() and "." not in path.name:
+                try:
+                    candidates.append((path.stat().st_mtime, path))
+                except FileNotFoundError:
+                    pass
+        excess = len(candidates) - self.max_entries
+        for (_, path) in sorted(candidates):
+            if excess <= 0:
+                break
+            with self.lock:
+                if path.name in self.entries:
+                    continue
+            with open(self.directory / f"{path.name}.lock", "a+b") as lock_file:
+                if not try_lock_exclusive(lock_file):
+                    # In use by another process (or another cache of this process).
+                    continue
+                trash = path.with_name(f"{path.name}.{os.getpid()}.evicted")
+                try:
+                    os.rename(path, trash)
+                except OSError:
+                    continue
+                excess -= 1
+            shutil.rmtree(trash, ignore_errors=True)
@@ -1,20 +1,64 @@
-from fmpy.fmi2 import fmi2OK
+from typing import Dict, List
 
+from fmpy.fmi2 import FMU2Slave, fmi2OK
+
+from .propagation_plan import PropagationPlan
 from .runner import CosimRunner
 from .scenario import CosimScenario
+from .scheduler import Schedule, compute_schedule
 
 
 class GaussSeidelRunner(CosimRunner):
     """
     This class implements the gauss seidel co-simulation algorithm.
+    By default, the FMUs are stepped in the order computed from the connections (see scheduler.compute_schedule).
+    Set auto_order to False to step them in the order of scenario.fmus.
     """
+    fmu_plans: Dict[FMU2Slave, PropagationPlan] = None
+    later: Dict[FMU2Slave, List[FMU2Slave]] = None  # FMUs stepped after each FMU, in the same co-simulation step.
+    schedule: Schedule = None
+    order: List[FMU2Slave] = None
+
+    def __init__(self, auto_order: bool = True):
+        self.auto_order = auto_order
+
+    def compile_scenario(self, scenario: CosimScenario):
+        super().compile_scenario(scenario)
+        self.schedule = compute_schedule(scenario)
+        self.order = self.schedule.order if self.auto_order else scenario.fmus
+        # One plan per FMU, propagating its outputs right after it is stepped.
+        # The stop condition is read by the plan of its FMU.
+        probes = self.stop_probes(scenario)
+        self.fmu_plans = {f: PropagationPlan([c for c in scenario.connections if c.source_fmu == f],
+                                             [c for c in probes if c.source_fmu == f])
+                          for f in scenario.fmus}
+        if scenario.stop_condition is not None:
+            self.set_stop_probe(scenario, self.fmu_plans[scenario.stop_condition.source_fmu])
+        self.later = {f: self.order[i + 1:] for (i, f) in enumerate(self.order)}
+
+    def propagation_plans(self) -> List[PropagationPlan]:
+        return super().propagation_plans() + list(self.fmu_plans.values())
 
-    def propagate_outputs_fmu(self, scenario, f):
-        fmu_connections = filter(lambda c: c.source_fmu == f, scenario.connections)
-        self.propagate_outputs(fmu_connections)
+    def propagate_outputs_fmu(self, scenario, f, time: float = None, step_size: float = None):
+        """
+        Propagates the outputs of f, which has just stepped from time.
+        For connections with a reconstruction, the FMUs stepped after f take the same step as f,
+            so their inputs are reconstructed over it (knowing the outputs of f at its end),
+            and the FMUs stepped before f take the next step.
+        """
+        plan = self.fmu_plans[f]
+        if time is None or len(plan.reconstructions) == 0:
+            plan.execute()
+            return
+        plan.read()
+        plan.record(time + step_size)
+        later = self.later[f]
+        plan.write(later, time, step_size)
+        plan.write([g for g in self.order if g not in later], time + step_size, step_size)
 
-    def run_cosim_step(self, time, scenario: CosimScenario):
-        for f in scenario.fmus:
-            res = f.doStep(time, scenario.step_size)
+    def run_cosim_step(self, time, scenario: CosimScenario, step_size: float = None):
+        step_size = scenario.step_size if step_size is None else step_size
+        for f in self.order:
+            res = f.doStep(time, step_size)
             assert res == fmi2OK, "Step failed."
-            self.propagate_outputs_fmu(scenario, f)
\ No newline at end of file
+            self.propagate_outputs_fmu(scenario, f, time, step_size)
\ No newline at end of file
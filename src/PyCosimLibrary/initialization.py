@@ -0,0 +1,107 @@
+from typing import List
+
+import numpy as np
+from fmpy.fmi2 import FMU2Slave
+
+from PyCosimLibrary.propagation_plan import PropagationPlan
+from PyCosimLibrary.scenario import CosimScenario, VarType
+from PyCosimLibrary.scheduler import compute_schedule
+
+
+class FixedPointInitialization:
+    """
+    Computes consistent initial values of the couplings, in initialization mode.
+    The components of the connection graph (see scheduler.compute_schedule) are solved in topological order:
+        each component first gets the (final) outputs of the components before it,
+        and then, if it has a feedback loop, the real couplings inside it are iterated until
+        the coupling values x satisfy x = g(x), where g sets x as inputs and reads the outputs that result.
+    Methods:
+        "fixed_point": x = g(x).
+        "broyden": Broyden's (good) method on the residual g(x) - x, starting with the fixed point iteration.
+        "newton": Newton's method, with the jacobian of the residual estimated by finite differences.
+    Other types are propagated at each iteration, but do not take part in the convergence check.
+    This requires FMUs whose outputs follow their inputs in initialization mode.
+    """
+    METHODS = ["fixed_point", "broyden", "newton"]
+
+    def __init__(self, max_iterations: int = 100, tol: float = 1e-8, method: str = "fixed_point"):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown method {method}. Expected one of {self.METHODS}.")
+        self.max_iterations = max_iterations
+        self.tol = tol
+        self.method = method
+        self.iterations: List[int] = []  # Iterations taken by each loop, in the last initialization.
+
+    def initialize(self, scenario: CosimScenario):
+        schedule = compute_schedule(scenario)
+        loops = set(tuple(component) for component in schedule.loops)
+        self.iterations = []
+        for component in schedule.components:
+            members = set(component)
+            PropagationPlan([c for c in scenario.connections
+                             if c.target_fmu in members and c.source_fmu not in members]).execute()
+            if tuple(component) in loops:
+                plan = PropagationPlan([c for c in scenario.connections
+                                        if c.target_fmu in members and c.source_fmu in members])
+                self.iterations.append(self.solve(plan, component))
+
+    def converged(self, x: np.ndarray, g: np.ndarray) -> bool:
+        return np.all(np.abs(g - x) <= self.tol + self.tol * np.abs(g))
+
+    @staticmethod
+    def evaluate(plan: PropagationPlan, x: np.ndarray) -> np.ndarray:
+        """
+        :return: g(x), the coupling values that result from setting x as inputs.
+        """
+        plan.buffers[VarType.REAL][:] = x
+        plan.write()
+        plan.read()
+        return plan.buffers[VarType.REAL].copy()
+
+    def solve(self, plan: PropagationPlan, component: List[FMU2Slave]) -> int:
+        """
+        Iterates the couplings of the component until they converge.
+        :return: the number of iterations.
+        """
+        plan.read()
+        if VarType.REAL not in plan.buffers:
+            plan.write()
+            return 0
+        x = plan.buffers[VarType.REAL].copy()
+        g = self.evaluate(plan, x)
+        n = len(x)
+        inverse_jacobian = -np.eye(n)
+        iteration = 0
+        while not self.converged(x, g):
+            if iteration == self.max_iterations:
+                print(f"Warning: initialization of {[f.instanceName for f in component]} "
+                      f"not converged after {self.max_iterations} iterations.")
+                break
+            iteration += 1
+            residual = g - x
+            if self.method == "fixed_point":
+                new_x = g
+            elif self.method == "broyden":
+                new_x = x - inverse_jacobian @ residual
+            else:
+                jacobian = np.empty((n, n))
+                for i in range(n):
+                    h = 1e-7 * max(1.0, abs(x[i]))
+                    dx = x.copy()
+                    dx[i] += h
+                    jacobian[:, i] = (self.evaluate(plan, dx) - dx - residual) / h
+                new_x = x - np.linalg.solve(jacobian, residual)
+            new_g = self.evaluate(plan, new_x)
+            if self.method == "broyden":
+                dx = new_x - x
+                dr = (new_g - new_x) - residual
+                h_dr = inverse_jacobian @ dr
+                denominator = dx @ h_dr
+                if denominator != 0.0:
+                    inverse_jacobian += np.outer(dx - h_dr, dx @ inverse_jacobian) / denominator
+            (x, g) = (new_x, new_g)
+
+        # Leave the inputs consistent with the outputs.
+        plan.buffers[VarType.REAL][:] = g
+        plan.write()
+        return iteration
@@ -0,0 +1,175 @@
+import json
+import math
+import threading
+import time
+from typing import Dict, List, Callable, Tuple
+
+import numpy as np
+
+
+def unwrapped(function):
+    return function
+
+
+class Timed:
+    """
+    Replaces a method of an object, recording the duration of every call.
+    When pickled (e.g., an FMU sent to a worker process), it turns back into the original method.
+    """
+
+    def __init__(self, instrumentation, name: str, function: Callable):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            self.instrumentation.add_duration(self.name, start, time.perf_counter() - start)
+
+    def __reduce__(self):
+        return unwrapped, (self.function,)
+
+
+class Histogram:
+    """
+    Distribution of the values recorded under one name, in constant memory:
+        a count per logarithmic bin (bins_per_decade bins per power of 10, between 10**low and 10**high),
+        plus the exact count, total and maximum.
+    Percentiles are estimated from the bins, within half a bin (about 6% with 20 bins per decade).
+    Values up to 10**low (including 0) fall in the first bin, and values above 10**high in the last one.
+    """
+    low: int = -9
+    high: int = 4
+    bins_per_decade: int = 20
+
+    def __init__(self):
+        self.bins = np.zeros((self.high - self.low) * self.bins_per_decade + 2, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.maximum = -math.inf
+
+    def add(self, value: float):
+        if value <= 0.0:
+            i = 0
+        else:
+            i = min(max(0, int((math.log10(value) - self.low) * self.bins_per_decade) + 1), len(self.bins) - 1)
+        self.bins[i] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: between 0 and 100.
+        :return: the geometric center of the bin of the q-th percentile, or the maximum if it is smaller.
+        """
+        i = int(np.searchsorted(np.cumsum(self.bins), q / 100.0 * self.count))
+        if i == 0:
+            return min(10.0 ** self.low, self.maximum)
+        center = 10.0 ** (self.low + (i - 0.5) / self.bins_per_decade)
+        return min(center, self.maximum)
+
+
+class Instrumentation:
+    """
+    Collects the durations of the phases of a co-simulation run, and of the doStep of each FMU.
+    To use it, set runner.instrumentation before calling run_cosim.
+    During the run, the measured methods are replaced by timed versions (on the runner, plans, and FMUs),
+        and restored at the end, so that runners without instrumentation pay nothing.
+    Runners can also record other values (e.g., iterations per step), with record and count.
+    Each name keeps a Histogram, so memory does not grow with the length of the run.
+    With trace, every timed call is also kept, to export as a chrome trace (chrome://tracing or perfetto).
+    """
+    RUNNER_PHASES = ["propagate_initial_outputs", "run_cosim_step", "propagate_outputs_fmu", "snapshot"]
+    PLAN_PHASES = ["execute", "read", "write"]
+
+    def __init__(self, trace: bool = False):
+        self.trace = trace
+        self.histograms: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self.events: List[Tuple[str, float, float, int]] = []
+        self.origin = time.perf_counter()
+        self.wrapped: List[Tuple[object, str]] = []
+        self.timed_names = set()
+
+    def add_duration(self, name: str, start: float, duration: float):
+        self.record(name, duration)
+        if self.trace:
+            self.events.append((name, start, duration, threading.get_ident()))
+
+    def record(self, name: str, value: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(value)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def wrap(self, obj, method: str, name: str):
+        if method in obj.__dict__ or not hasattr(obj, method):
+            return
+        setattr(obj, method, Timed(self, name, getattr(obj, method)))
+        self.wrapped.append((obj, method))
+        self.timed_names.add(name)
+
+    def attach(self, runner, scenario):
+        """
+        Replaces the measured methods of the runner, its propagation plans, and the FMUs of the scenario.
+        """
+        for phase in self.RUNNER_PHASES:
+            self.wrap(runner, phase, phase)
+        if runner.plan is not None:
+            for phase in self.PLAN_PHASES:
+                self.wrap(runner.plan, phase, f"plan.{phase}")
+        for (f, plan) in getattr(runner, "fmu_plans", {}).items():
+            self.wrap(plan, "execute", f"plan.execute[{f.instanceName}]")
+        for f in scenario.fmus:
+            self.wrap(f, "doStep", f"doStep[{f.instanceName}]")
+            self.wrap(f, "setFMUstate", f"setFMUstate[{f.instanceName}]")
+
+    def detach(self):
+        for (obj, method) in self.wrapped:
+            del obj.__dict__[method]
+        self.wrapped = []
+
+    def summary(self) -> List[Dict]:
+        """
+        Statistics of each recorded name: number of calls, total, mean, percentiles (estimated) and maximum.
+        """
+        rows = []
+        for (name, h) in self.histograms.items():
+            rows.append({"name": name, "calls": h.count, "total": h.total, "mean": h.total / h.count,
+                         "p50": h.percentile(50), "p90": h.percentile(90), "p99": h.percentile(99),
+                         "max": h.maximum})
+        return rows
+
+    def summary_table(self) -> str:
+        """
+        Summary as text. Durations are in microseconds, other values (e.g., iterations) as recorded.
+        """
+        lines = [f"{'name':<32}{'calls':>9}{'total':>14}{'mean':>12}{'p50':>12}{'p90':>12}{'p99':>12}{'max':>12}"]
+        for row in self.summary():
+            scale = 1e6 if row["name"] in self.timed_names else 1.0
+            lines.append(f"{row['name']:<32}{row['calls']:>9}" +
+                         "".join(f"{row[k] * scale:>{14 if k == 'total' else 12}.1f}"
+                                 for k in ["total", "mean", "p50", "p90", "p99", "max"]))
+        for (name, n) in self.counters.items():
+            lines.append(f"{name:<32}{n:>9}")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> Dict:
+        """
+        The recorded calls in the chrome trace event format (requires trace).
+        """
+        events = [{"name": name, "ph": "X", "ts": (start - self.origin) * 1e6, "dur": duration * 1e6,
+                   "pid": 0, "tid": tid} for (name, start, duration, tid) in self.events]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
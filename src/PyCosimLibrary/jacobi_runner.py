@@ -8,8 +8,9 @@ class JacobiRunner(CosimRunner):
     """
     This class implements the jacobi co-simulation algorithm.
     """
-    def run_cosim_step(self, time, scenario: CosimScenario):
+    def run_cosim_step(self, time, scenario: CosimScenario, step_size: float = None):
+        step_size = scenario.step_size if step_size is None else step_size
         for f in scenario.fmus:
-            res = f.doStep(time, scenario.step_size)
+            res = f.doStep(time, step_size)
             assert res == fmi2OK, "Step failed."
-        self.propagate_outputs(scenario.connections)
+        self.plan.execute(time + step_size, step_size)
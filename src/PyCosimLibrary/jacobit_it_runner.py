@@ -1,83 +1,111 @@
-from typing import List
+from typing import List, Dict
 
+from fmpy.fmi2 import FMU2Slave
+
+from PyCosimLibrary.acceleration import Acceleration
 from PyCosimLibrary.runner import CosimRunner
 from PyCosimLibrary.scenario import CosimScenario, VarType
 import numpy as np
 
 
 class JacobiIterativeRunner(CosimRunner):
-    def __init__(self, max_iterations: int, tol: float):
+    """
+    This class implements the iterative jacobi co-simulation algorithm.
+    Each co-simulation step is repeated, feeding the outputs of the previous iteration,
+        until the outputs match the inputs that produced them.
+    The state of the FMUs is recorded once per co-simulation step, and restored before each repetition.
+    With selective_rollback, only the FMUs whose inputs changed are restored and stepped again,
+        since the others would produce the same outputs.
+    The coupling values are held in the buffers of the propagation plan, one per type.
+    Only the real and integer couplings are iterated to convergence (integers must match exactly),
+        and the acceleration (see the acceleration module) computes the real values fed in the next iteration.
+    Boolean and string couplings are propagated with the values of the last iteration.
+    """
+    states: Dict[FMU2Slave, object] = None
+
+    def __init__(self, max_iterations: int, tol: float, selective_rollback: bool = False,
+                 acceleration: Acceleration = None):
         self.max_iterations = max_iterations
         self.tol = tol
+        self.selective_rollback = selective_rollback
+        self.acceleration = acceleration if acceleration is not None else Acceleration()
+
+    def compile_scenario(self, scenario: CosimScenario):
+        self.reject_reconstructions(scenario)
+        super().compile_scenario(scenario)
+        self.states = {}
+
+    def save_states(self, fmus: List[FMU2Slave]):
+        for f in fmus:
+            self.states[f] = self.save_state(f, self.states.get(f))
+
+    def changed_inputs(self, fmus: List[FMU2Slave], previous: Dict[VarType, np.ndarray]) -> List[FMU2Slave]:
+        """
+        FMUs whose inputs are different in the next iteration.
+        :param previous: the values fed in the last iteration, of the iterated types.
+        """
+        changed = {t: values != self.plan.buffers[t] for (t, values) in previous.items() if t in self.plan.buffers}
+        targets = set(fmu for (fmu, t, _, idx) in self.plan.writes if t in changed and changed[t][idx].any())
+        return [f for f in fmus if f in targets]
+
+    def has_converged(self, previous_outputs: np.ndarray, new_outputs: np.ndarray):
+        return np.all(np.abs(previous_outputs - new_outputs) <= self.tol + self.tol * np.abs(new_outputs))
+
+    def run_cosim_step(self, time, scenario: CosimScenario, step_size: float = None):
+        step_size = scenario.step_size if step_size is None else step_size
+
+        # Record state
+        self.save_states(scenario.fmus)
+        self.acceleration.reset()
 
-    def run_cosim_step(self, time, scenario: CosimScenario):
+        # The outputs at the beginning of the step are fed in the first iteration.
+        self.plan.read()
+        new_outputs = self.plan.buffers.get(VarType.REAL, np.zeros(0))
+        new_integers = self.plan.buffers.get(VarType.INTEGER, np.zeros(0, dtype=np.int32))
+        previous_outputs = new_outputs.copy()
+        previous_integers = new_integers.copy()
+
+        stepped_fmus = scenario.fmus
         has_converged = False
-        previous_outputs: List[List[float]] = None
-        new_outputs: List[List[float]] = []
         iteration_count = 0
         while not has_converged:
-            # Record state
-            old_states = [(f, f.getFMUstate()) for f in scenario.fmus]
-
             # Feed the outputs recorded in the previous iteration
-            no_output_records = previous_outputs is None
-            output_index = 0
-            for c in scenario.connections:
-                if c.target_fmu is not None:
-                    if c.value_type == VarType.REAL:
-                        previous_output_value = None
-                        if no_output_records:
-                            new_output_value = c.source_fmu.getReal(c.source_vr)
-                            previous_output_value = new_output_value
-                        else:
-                            previous_output_value = previous_outputs[output_index]
-                        output_index += 1
-                        c.target_fmu.setReal(c.target_vr, previous_output_value)
-                    else:
-                        # TODO: find a way to support the multiple types elegantly.
-                        raise NotImplementedError()
+            self.plan.write(stepped_fmus)
 
             # Run cosim step
-            for f in scenario.fmus:
-                f.doStep(time, scenario.step_size)
-
-            # Record new outputs, and check for convergence
-            output_index = 0
-            has_converged = True
-            for c in scenario.connections:
-                if c.target_fmu is not None:
-                    if c.value_type == VarType.REAL:
-                        # Gets the new output value, but forwards the previous output value.
-                        # This way, we make sure that every FMU keeps getting updated outputs at every iteration.
-                        # The propagation of outputs to inputs is slower this way,
-                        #   but the alternative is to select a few strategic connections to do this,
-                        #   which is harder to implement.
-                        new_output_value = c.source_fmu.getReal(c.source_vr)
-                        new_outputs.append(new_output_value)
-                        if no_output_records:
-                            has_converged = False
-                        else:
-                            previous_output_value = previous_outputs[output_index]
-                            assert len(previous_output_value) == len(new_output_value), "Output sizes must be the same"
-                            if has_converged:
-                                for (po, no) in zip(previous_output_value, new_output_value):
-                                    if (not np.isclose(po, no, rtol=self.tol,
-                                                       atol=self.tol)):
-                                        has_converged = False
-                        output_index += 1
-                    else:
-                        # TODO: find a way to support the multiple types elegantly.
-                        raise NotImplementedError()
-
-            previous_outputs = new_outputs
-            new_outputs = []
+            for f in stepped_fmus:
+                f.doStep(time, step_size)
+
+            # Record new outputs, and check for convergence.
+            self.plan.read()
+            has_converged = self.has_converged(previous_outputs, new_outputs) and \
+                np.array_equal(previous_integers, new_integers)
 
             # Check if convergence has been achieved, or the max number of iterations has been reached.
             iteration_count += 1
-            has_converged = has_converged or iteration_count > self.max_iterations
-            if not has_converged:
-                # Rollback and Repeat if necessary
-                for (f, s) in old_states:
-                    f.setFMUstate(s)
-            elif iteration_count > self.max_iterations:
+            if not has_converged and iteration_count > self.max_iterations:
                 print(f"Warning: not converged after {self.max_iterations} iterations.")
+                if self.instrumentation is not None:
+                    self.instrumentation.count("not_converged")
+                break
+
+            if not has_converged:
+                # Rollback and Repeat
+                new_outputs[:] = self.acceleration.next_inputs(previous_outputs, new_outputs)
+                stepped_fmus = self.changed_inputs(scenario.fmus, {VarType.REAL: previous_outputs,
+                                                                   VarType.INTEGER: previous_integers}) \
+                    if self.selective_rollback else scenario.fmus
+                for f in stepped_fmus:
+                    f.setFMUstate(self.states[f])
+                previous_outputs[:] = new_outputs
+                previous_integers[:] = new_integers
+                if self.instrumentation is not None:
+                    self.instrumentation.count("rollbacks", len(stepped_fmus))
+
+        if self.instrumentation is not None:
+            self.instrumentation.record("iterations", iteration_count)
+
+    def terminate_cosim(self, scenario: CosimScenario):
+        for (f, s) in self.states.items():
+            f.freeFMUstate(s)
+        self.states = {}
@@ -1,27 +1,36 @@
 from PyCosimLibrary.autoinit import AutoInit
+from PyCosimLibrary.fmu_cache import FMUCache, CacheEntry
+from PyCosimLibrary.scenario import VariableIndex
 from fmpy import read_model_description, extract
 from fmpy.fmi2 import FMU2Slave
-from fmpy.model_description import ScalarVariable
 from pathlib import Path
-from typing import Dict
 import shutil
+import tempfile
 
 
 class LoadedFMU(AutoInit):
     fmu: FMU2Slave = None
     dir: str = None
-    vars: Dict[str, ScalarVariable] = None
+    vars: VariableIndex = None
     cleanup: bool = None
+    cache_entry: CacheEntry = None
 
 
 class FMULoader:
+    """
+    Loads FMUs, extracting them to a temporary directory that is deleted on unload.
+    If cache is set, FMUs are extracted to the cache instead, and loading the same FMU again reuses the extraction.
+        FMUs that can only be instantiated once per process get a private copy of the extraction instead,
+        so that each instance loads its own copy of the shared library.
+    """
+    cache: FMUCache = None
 
     @staticmethod
-    def get_vars(model_description):
-        vrs = {}
-        for variable in model_description.modelVariables:
-            vrs[variable.name] = variable
-        return vrs
+    def get_vars(model_description) -> VariableIndex:
+        """
+        Index of the variables of the FMU, by name. Pass it in CosimScenario.variables to refer to variables by name.
+        """
+        return VariableIndex(model_description.modelVariables)
 
     @staticmethod
     def load(fmu_path, instance_name, logger):
@@ -30,25 +39,42 @@ class FMULoader:
 
         is_compressed = fmu_path.is_file() and fmu_path.name.endswith('.fmu')
 
-        if(is_compressed):
-            unzipdir = extract(fmu_path)
+        cache_entry = None
+        if(is_compressed and FMULoader.cache is not None):
+            cache_entry = FMULoader.cache.acquire(fmu_path)
+            unzipdir = cache_entry.dir
+            desc = cache_entry.model_description
+            if(desc.coSimulation.canBeInstantiatedOnlyOncePerProcess):
+                try:
+                    unzipdir = tempfile.mkdtemp(prefix="fmpy_")
+                    shutil.copytree(cache_entry.dir, unzipdir, dirs_exist_ok=True)
+                finally:
+                    FMULoader.cache.release(cache_entry)
+                cache_entry = None
         else:
-            unzipdir = str(fmu_path)
+            if(is_compressed):
+                unzipdir = extract(fmu_path)
+            else:
+                unzipdir = str(fmu_path)
+            desc = read_model_description(unzipdir)
 
-        desc = read_model_description(unzipdir)
         vars = FMULoader.get_vars(desc)
         fmu = FMU2Slave(guid=desc.guid,
                         unzipDirectory=unzipdir,
                         modelIdentifier=desc.coSimulation.modelIdentifier,
                         instanceName=instance_name,
                         fmiCallLogger=logger)
-        return LoadedFMU(fmu=fmu, dir=unzipdir, vars=vars,cleanup = is_compressed)
+        return LoadedFMU(fmu=fmu, dir=unzipdir, vars=vars, cleanup=is_compressed and cache_entry is None,
+                         cache_entry=cache_entry)
 
     @staticmethod
     def unload(loaded_fmu: LoadedFMU):
 
         loaded_fmu.fmu.freeInstance()
 
+        if(loaded_fmu.cache_entry is not None):
+            FMULoader.cache.release(loaded_fmu.cache_entry)
+
         if(loaded_fmu.cleanup):
             try:
                 shutil.rmtree(loaded_fmu.dir)
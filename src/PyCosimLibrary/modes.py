@@ -0,0 +1,85 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# A mode change: the snapshot (row of the results) where it was detected, the column of the signal, and the new mode.
+EVENT_DTYPE = np.dtype([("row", np.int64), ("column", np.int32), ("value", np.float64)])
+
+
+class ModeTracker:
+    """
+    Detects the abstract modes of the discontinuous outputs, as the snapshots are taken.
+    A signal enters a new mode when it differs from its current mode by more than its quantization tolerance.
+    All the tracked columns of a snapshot are compared at once, and only the changes are recorded, as events.
+    The first snapshot records the initial mode of every signal.
+    """
+    chunk_size: int = 1024
+
+    def __init__(self, columns: List[int], tolerances: List[float]):
+        """
+        :param columns: the columns of the results that hold the discontinuous outputs.
+        :param tolerances: the quantization tolerance of each column.
+        """
+        self.columns = np.array(columns, dtype=np.intp)
+        self.tolerances = np.array(tolerances, dtype=np.float64)
+        self.modes = np.zeros(len(columns))
+        self.events = np.empty(self.chunk_size, dtype=EVENT_DTYPE)
+        self.size = 0
+        self.rows = 0
+        self._by_column: Dict[int, np.ndarray] = {}
+        self._by_column_size = -1
+
+    def update(self, row: np.ndarray):
+        """
+        Records the mode changes in the snapshot.
+        :param row: the snapshot, as written in the results.
+        """
+        values = row[self.columns]
+        if self.rows == 0:
+            changed = np.ones(len(values), dtype=np.bool_)
+        else:
+            changed = np.abs(values - self.modes) > self.tolerances + self.tolerances * np.abs(self.modes)
+        n = np.count_nonzero(changed)
+        if n > 0:
+            if self.size + n > len(self.events):
+                events = np.empty(max(2 * len(self.events), self.size + n), dtype=EVENT_DTYPE)
+                events[:self.size] = self.events[:self.size]
+                self.events = events
+            new_events = self.events[self.size:self.size + n]
+            new_events["row"] = self.rows
+            new_events["column"] = self.columns[changed]
+            new_events["value"] = values[changed]
+            self.size += n
+            self.modes[changed] = values[changed]
+        self.rows += 1
+
+    def column_events(self, column: int) -> np.ndarray:
+        """
+        :return: the events of the column, in order.
+        """
+        if self._by_column_size != self.size:
+            events = self.events[:self.size]
+            self._by_column = {int(c): events[events["column"] == c] for c in self.columns}
+            self._by_column_size = self.size
+        return self._by_column[column]
+
+    def mode_at(self, column: int, timestamps: np.ndarray, time: float) -> float:
+        """
+        :param timestamps: the time of each snapshot.
+        :return: the mode of the column at time (the last mode that started at or before time).
+        """
+        events = self.column_events(column)
+        i = np.searchsorted(timestamps[events["row"]], time, side="right") - 1
+        if i < 0:
+            raise ValueError(f"No mode recorded at time {time}.")
+        return events["value"][i]
+
+    def durations(self, column: int, timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param timestamps: the time of each snapshot.
+        :return: the sequence of modes of the column, and how long each lasted (the last one, until the last snapshot).
+        """
+        events = self.column_events(column)
+        starts = timestamps[events["row"]]
+        ends = np.append(starts[1:], timestamps[self.rows - 1]) if len(starts) > 0 else starts
+        return events["value"], ends - starts
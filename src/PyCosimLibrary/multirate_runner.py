@@ -0,0 +1,140 @@
+from typing import Dict, List
+
+from fmpy.fmi2 import FMU2Slave, fmi2OK
+
+from PyCosimLibrary.propagation_plan import PropagationPlan
+from PyCosimLibrary.reconstruction import SignalHistory
+from PyCosimLibrary.runner import CosimRunner
+from PyCosimLibrary.scenario import CosimScenario, VarType
+from PyCosimLibrary.scheduler import compute_schedule
+
+
+class MultirateRunner(CosimRunner):
+    """
+    This class implements a multirate co-simulation algorithm, where each FMU has its own step size.
+    Step sizes must be integer multiples of scenario.step_size (the base tick), which is the default step size.
+    Every base tick, only the FMUs at one of their communication points are stepped, with their own step size.
+    The real outputs of each FMU are kept in a SignalHistory at its communication points,
+        and the inputs of an FMU are reconstructed from the histories of its sources when it is stepped,
+        with the given reconstruction ("hold", "extrapolate" or "interpolate").
+    An FMU that took a long step already knows its outputs at the end of the step,
+        so the faster FMUs stepped in the meantime can interpolate them.
+    Other types (bool, integer, string) always carry the latest values of their sources.
+    With jacobi propagation, the inputs of an FMU are reconstructed at the start of its step.
+    With gauss_seidel, FMUs are stepped in the order of the schedule (see scheduler.compute_schedule),
+        and their inputs are reconstructed at the end of their step, from the FMUs stepped before them.
+    The print interval must be a multiple of every step size, so that the snapshots find all FMUs at the same time.
+    The last step of each FMU is shortened, so that it ends at stop_time.
+    Checkpoints keep the histories, so a resumed run continues from the same reconstructions.
+    """
+    RECONSTRUCTIONS = ["hold", "extrapolate", "interpolate"]
+
+    fmu_plans: Dict[FMU2Slave, PropagationPlan] = None
+    histories: Dict[FMU2Slave, SignalHistory] = None
+    ratios: Dict[FMU2Slave, int] = None
+    sources: Dict[FMU2Slave, List[FMU2Slave]] = None
+    order: List[FMU2Slave] = None
+    last_tick: int = None  # Base tick of stop_time, or None if the run ends with the stop condition.
+
+    def __init__(self, step_sizes: Dict[FMU2Slave, float], gauss_seidel: bool = False,
+                 reconstruction: str = "hold"):
+        if reconstruction not in self.RECONSTRUCTIONS:
+            raise ValueError(f"Unknown reconstruction {reconstruction}. Expected one of {self.RECONSTRUCTIONS}.")
+        self.step_sizes = step_sizes
+        self.gauss_seidel = gauss_seidel
+        self.reconstruction = reconstruction
+
+    def ratio(self, scenario: CosimScenario, f: FMU2Slave) -> int:
+        """
+        Number of base ticks per step of f.
+        """
+        step_size = self.step_sizes.get(f, scenario.step_size)
+        ratio = int(round(step_size / scenario.step_size))
+        if ratio < 1 or abs(ratio * scenario.step_size - step_size) > 1e-9 * step_size:
+            raise ValueError(f"Invalid Scenario. Step size {step_size} of {f.instanceName} "
+                             f"is not a multiple of the base step size {scenario.step_size}.")
+        ticks_per_print = max(1, int(round(scenario.print_interval / scenario.step_size)))
+        if ticks_per_print % ratio != 0:
+            raise ValueError(f"Invalid Scenario. The print interval {scenario.print_interval} "
+                             f"is not a multiple of the step size {step_size} of {f.instanceName}.")
+        return ratio
+
+    def compile_scenario(self, scenario: CosimScenario):
+        if self.step_controller is not None:
+            raise NotImplementedError("The multirate runner does not support adaptive step sizes.")
+        self.reject_reconstructions(scenario)
+        super().compile_scenario(scenario)
+        self.ratios = {f: self.ratio(scenario, f) for f in scenario.fmus}
+        self.order = compute_schedule(scenario).order if self.gauss_seidel else scenario.fmus
+        self.last_tick = self.end_tick(scenario)
+
+        # One plan per source FMU, so that each FMU can be fed from the history of each of its sources.
+        probes = self.stop_probes(scenario)
+        self.fmu_plans = {f: PropagationPlan([c for c in scenario.connections if c.source_fmu == f],
+                                             [c for c in probes if c.source_fmu == f])
+                          for f in scenario.fmus}
+        if scenario.stop_condition is not None:
+            self.set_stop_probe(scenario, self.fmu_plans[scenario.stop_condition.source_fmu])
+        self.histories = {f: SignalHistory(len(plan.buffers.get(VarType.REAL, [])))
+                          for (f, plan) in self.fmu_plans.items()}
+        self.sources = {f: [] for f in scenario.fmus}
+        for c in scenario.connections:
+            if c.target_fmu is not None and c.source_fmu not in self.sources[c.target_fmu]:
+                self.sources[c.target_fmu].append(c.source_fmu)
+
+    def record_outputs(self, f: FMU2Slave, tick: int):
+        plan = self.fmu_plans[f]
+        plan.read()
+        self.histories[f].push(tick, plan.buffers.get(VarType.REAL, []))
+
+    def set_inputs(self, f: FMU2Slave, tick: int):
+        for source in self.sources[f]:
+            plan = self.fmu_plans[source]
+            if VarType.REAL in plan.buffers:
+                plan.buffers[VarType.REAL][:] = self.histories[source].reconstruct(tick, self.reconstruction)
+            plan.write([f])
+
+    def propagation_plans(self) -> List[PropagationPlan]:
+        return super().propagation_plans() + list(self.fmu_plans.values())
+
+    def checkpoint_state(self) -> Dict:
+        state = super().checkpoint_state()
+        state["ratios"] = {f.instanceName: ratio for (f, ratio) in self.ratios.items()}
+        state["histories"] = {f.instanceName: history.checkpoint() for (f, history) in self.histories.items()}
+        return state
+
+    def restore_state(self, state: Dict):
+        ratios = {f.instanceName: ratio for (f, ratio) in self.ratios.items()}
+        if state["ratios"] != ratios:
+            raise ValueError(f"The checkpoint was taken with the step ratios {state['ratios']}, "
+                             f"but the runner has {ratios}.")
+        super().restore_state(state)
+        for (f, history) in self.histories.items():
+            history.restore(state["histories"][f.instanceName])
+
+    def propagate_initial_outputs(self, scenario: CosimScenario):
+        super().propagate_initial_outputs(scenario)
+        for f in scenario.fmus:
+            self.histories[f].clear()
+            self.record_outputs(f, 0)
+
+    def run_cosim_step(self, time, scenario: CosimScenario, step_size: float = None):
+        tick = int(round(time / scenario.step_size))
+        stepped = [f for f in self.order if tick % self.ratios[f] == 0]
+        # Number of base ticks of the step of each FMU, shortened to end at stop_time.
+        ticks = {f: self.ratios[f] if self.last_tick is None else min(self.ratios[f], self.last_tick - tick)
+                 for f in stepped}
+        if self.gauss_seidel:
+            for f in stepped:
+                self.set_inputs(f, tick + ticks[f])
+                res = f.doStep(time, ticks[f] * scenario.step_size)
+                assert res == fmi2OK, f"Step failed for {f.instanceName}."
+                self.record_outputs(f, tick + ticks[f])
+        else:
+            for f in stepped:
+                self.set_inputs(f, tick)
+            for f in stepped:
+                res = f.doStep(time, ticks[f] * scenario.step_size)
+                assert res == fmi2OK, f"Step failed for {f.instanceName}."
+            for f in stepped:
+                self.record_outputs(f, tick + ticks[f])
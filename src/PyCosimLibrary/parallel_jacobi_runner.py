@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, Executor, wait
+
+from fmpy.fmi2 import fmi2OK
+
+from PyCosimLibrary.jacobi_runner import JacobiRunner
+from PyCosimLibrary.scenario import CosimScenario
+
+
+class ParallelJacobiRunner(JacobiRunner):
+    """
+    This class implements the jacobi co-simulation algorithm, stepping all FMUs concurrently.
+    The FMUs are stepped in a thread pool, which only runs them in parallel when their doStep releases the GIL:
+        compiled FMUs release it while running native code.
+    FMUs written in python (e.g., VirtualFMUs) should be wrapped in a RemoteFMU, which keeps each of them
+        in its own worker process: the thread stepping the proxy waits for the worker, releasing the GIL.
+    The pool is created on the first step and kept until shutdown is called.
+    """
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers
+        self.thread_pool: Executor = None
+
+    def submit(self, f, time, step_size):
+        if self.thread_pool is None:
+            self.thread_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self.thread_pool.submit(f.doStep, time, step_size)
+
+    def run_cosim_step(self, time, scenario: CosimScenario, step_size: float = None):
+        step_size = scenario.step_size if step_size is None else step_size
+        futures = [self.submit(f, time, step_size) for f in scenario.fmus]
+
+        # Barrier: all FMUs must finish their step before any output is propagated.
+        wait(futures)
+
+        # Errors are reported in the order of the FMUs, regardless of which step finished first.
+        for (f, future) in zip(scenario.fmus, futures):
+            res = future.result()
+            assert res == fmi2OK, f"Step failed for {f.instanceName}."
+
+        self.plan.execute(time + step_size, step_size)
+
+    def shutdown(self):
+        """
+        Stops the worker pool.
+        """
+        if self.thread_pool is not None:
+            self.thread_pool.shutdown()
+            self.thread_pool = None
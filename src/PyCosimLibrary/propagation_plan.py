@@ -0,0 +1,259 @@
+from ctypes import POINTER
+from typing import List, Dict, Tuple
+
+import numpy as np
+from fmpy.fmi2 import FMU2Slave, fmi2ValueReference, fmi2Real, fmi2Boolean, fmi2Integer
+
+from PyCosimLibrary.reconstruction import SignalHistory
+from PyCosimLibrary.scenario import Connection, VarType, Reconstruction
+
+GETTERS = {
+    VarType.REAL: "getReal",
+    VarType.BOOL: "getBoolean",
+    VarType.INTEGER: "getInteger",
+    VarType.STRING: "getString",
+}
+
+SETTERS = {
+    VarType.REAL: "setReal",
+    VarType.BOOL: "setBoolean",
+    VarType.INTEGER: "setInteger",
+    VarType.STRING: "setString",
+}
+
+DTYPES = {
+    VarType.REAL: np.float64,
+    VarType.BOOL: np.bool_,
+    VarType.INTEGER: np.int32,  # fmi2Integer
+    VarType.STRING: object,
+}
+
+# FMI functions called directly on compiled FMUs (see RawTransfer), and the C type of their values.
+RAW_GETTERS = {
+    VarType.REAL: "fmi2GetReal",
+    VarType.BOOL: "fmi2GetBoolean",
+    VarType.INTEGER: "fmi2GetInteger",
+}
+
+RAW_SETTERS = {
+    VarType.REAL: "fmi2SetReal",
+    VarType.BOOL: "fmi2SetBoolean",
+    VarType.INTEGER: "fmi2SetInteger",
+}
+
+RAW_CTYPES = {
+    VarType.REAL: fmi2Real,
+    VarType.BOOL: fmi2Boolean,  # A C int, while the buffer holds np.bool_
+    VarType.INTEGER: fmi2Integer,
+}
+
+
+def as_slice(indices: List[int]):
+    """
+    Returns a slice equivalent to indices, if they are contiguous, so that indexing does not copy.
+    """
+    if len(indices) > 0 and indices == list(range(indices[0], indices[0] + len(indices))):
+        return slice(indices[0], indices[0] + len(indices))
+    return np.array(indices, dtype=np.intp)
+
+
+def is_compiled(fmu: FMU2Slave) -> bool:
+    """
+    Whether the fmu is a loaded shared library, whose FMI functions can be called directly.
+    """
+    return getattr(fmu, "component", None) is not None
+
+
+class RawTransfer:
+    """
+    Transfer of values between a compiled FMU and a buffer, with a direct call to its FMI get or set function,
+        which avoids the ctypes arrays and lists that getReal/setReal build in each call.
+    The value references are kept in a ctypes array, and the values are passed as a pointer into the buffer,
+        or into a staging ctypes array (seen through a numpy view) if they are not contiguous in the buffer,
+        or are booleans (C ints in FMI).
+    The buffer must not be reallocated (only assigned to in place) while the transfer is in use.
+    """
+
+    def __init__(self, fmu: FMU2Slave, value_type: VarType, vrs: List[int], buffer: np.ndarray, idx, write: bool):
+        self.fmu = fmu
+        self.function = getattr(fmu, (RAW_SETTERS if write else RAW_GETTERS)[value_type])
+        self.component = fmu.component
+        self.size = len(vrs)
+        self.vrs = (fmi2ValueReference * self.size)(*vrs)
+        self.buffer = buffer
+        self.idx = idx
+        self.staged = not isinstance(idx, slice) or value_type == VarType.BOOL
+        if self.staged:
+            self.staging = (RAW_CTYPES[value_type] * self.size)()
+            self.values = np.ctypeslib.as_array(self.staging)
+        else:
+            self.values = buffer[idx]
+        self.pointer = self.values.ctypes.data_as(POINTER(RAW_CTYPES[value_type]))
+
+    def get(self):
+        self.function(self.component, self.vrs, self.size, self.pointer)
+        if self.staged:
+            self.buffer[self.idx] = self.values
+
+    def set(self):
+        if self.staged:
+            self.values[:] = self.buffer[self.idx]
+        self.function(self.component, self.vrs, self.size, self.pointer)
+
+
+class PropagationPlan:
+    """
+    Precomputed propagation of a list of connections, for use in the co-simulation loop.
+    All value references read from the same source FMU are read with a single call,
+        and all value references written to the same target FMU are written with a single call (per type).
+    The values read are kept in one buffer per type, and each write picks its values from that buffer.
+    All reads happen before any write, so the plan implements the jacobi propagation of the connections.
+    Probes are connections whose source values are only read (e.g., the stop condition),
+        and are merged with the reads of the connections. Their values are found in the buffers with index.
+    Connections with a Reconstruction are written on their own, with their values extrapolated from a history
+        of the values read (see record), when the time of the step is given to write.
+    The reads and writes of compiled FMUs (other than strings) go straight between the buffers and the FMU,
+        with a RawTransfer each.
+    """
+    buffers: Dict[VarType, np.ndarray] = None
+    reads: List[Tuple[FMU2Slave, VarType, List[int], slice]] = None
+    writes: List[Tuple[FMU2Slave, VarType, List[int], object]] = None
+    reconstructions: List[Tuple[FMU2Slave, List[int], object, Reconstruction, SignalHistory]] = None
+
+    read_index: Dict[Tuple[FMU2Slave, VarType], Dict[int, int]] = None
+
+    def __init__(self, connections: List[Connection], probes: List[Connection] = None):
+        # Source value references read from each (fmu, type), and source read by each target value reference.
+        read_vrs: Dict[Tuple[FMU2Slave, VarType], Dict[int, int]] = {}
+        write_vrs: Dict[Tuple[FMU2Slave, VarType], Dict[int, Tuple[FMU2Slave, int]]] = {}
+
+        reconstructed: List[Connection] = []
+
+        for c in connections:
+            if c.target_fmu is None:
+                continue
+            if c.value_type not in GETTERS:
+                raise NotImplementedError(f"Unsupported type {c.value_type} in connection {c}.")
+            source_vrs = read_vrs.setdefault((c.source_fmu, c.value_type), {})
+            if c.reconstruction is not None:
+                if c.value_type != VarType.REAL or c.reconstruction.method not in Reconstruction.METHODS:
+                    raise ValueError(f"Invalid reconstruction {c.reconstruction.method} in connection {c}.")
+                reconstructed.append(c)
+                for src in c.source_vr:
+                    source_vrs[src] = None
+                continue
+            target_vrs = write_vrs.setdefault((c.target_fmu, c.value_type), {})
+            for (src, trg) in zip(c.source_vr, c.target_vr):
+                source_vrs[src] = None
+                target_vrs[trg] = (c.source_fmu, src)
+
+        for c in (probes if probes is not None else []):
+            source_vrs = read_vrs.setdefault((c.source_fmu, c.value_type), {})
+            for src in c.source_vr:
+                source_vrs[src] = None
+
+        # Give each (fmu, type) a contiguous range of its type's buffer, so that it is read into a slice.
+        sizes: Dict[VarType, int] = {}
+        self.reads = []
+        for ((fmu, value_type), vrs) in read_vrs.items():
+            start = sizes.get(value_type, 0)
+            for (i, vr) in enumerate(vrs.keys()):
+                vrs[vr] = start + i
+            sizes[value_type] = start + len(vrs)
+            self.reads.append((fmu, value_type, list(vrs.keys()), slice(start, start + len(vrs))))
+
+        self.read_index = read_vrs
+        self.buffers = {t: np.zeros(n, dtype=DTYPES[t]) for (t, n) in sizes.items()}
+
+        self.writes = []
+        for ((fmu, value_type), vrs) in write_vrs.items():
+            indices = [read_vrs[(src_fmu, value_type)][src] for (src_fmu, src) in vrs.values()]
+            self.writes.append((fmu, value_type, list(vrs.keys()), as_slice(indices)))
+
+        self.reconstructions = []
+        for c in reconstructed:
+            indices = [read_vrs[(c.source_fmu, VarType.REAL)][src] for src in c.source_vr]
+            self.reconstructions.append((c.target_fmu, list(c.target_vr), as_slice(indices), c.reconstruction,
+                                         SignalHistory(len(indices), c.reconstruction.order + 1)))
+
+        # Bound methods, to avoid looking them up in the co-simulation loop.
+        self._reads = [(getattr(fmu, GETTERS[t]), vrs, self.buffers[t], s) for (fmu, t, vrs, s) in self.reads
+                       if not (is_compiled(fmu) and t in RAW_GETTERS)]
+        self._writes = [(fmu, getattr(fmu, SETTERS[t]), vrs, self.buffers[t], idx)
+                        for (fmu, t, vrs, idx) in self.writes if not (is_compiled(fmu) and t in RAW_SETTERS)]
+        self._raw_reads = [RawTransfer(fmu, t, vrs, self.buffers[t], s, False) for (fmu, t, vrs, s) in self.reads
+                           if is_compiled(fmu) and t in RAW_GETTERS]
+        self._raw_writes = [RawTransfer(fmu, t, vrs, self.buffers[t], idx, True)
+                            for (fmu, t, vrs, idx) in self.writes if is_compiled(fmu) and t in RAW_SETTERS]
+
+    def index(self, fmu: FMU2Slave, value_type: VarType, vr: int) -> int:
+        """
+        Index of the value read from the vr of the fmu, in the buffer of value_type.
+        """
+        return self.read_index[(fmu, value_type)][vr]
+
+    def read(self):
+        """
+        Reads the source value references of the connections into the buffers.
+        """
+        for (getter, vrs, buffer, s) in self._reads:
+            buffer[s] = getter(vrs)
+        for transfer in self._raw_reads:
+            transfer.get()
+
+    def checkpoint(self) -> List[Dict]:
+        """
+        :return: the histories of the connections with a reconstruction, to be restored with restore.
+        """
+        return [history.checkpoint() for (_, _, _, _, history) in self.reconstructions]
+
+    def restore(self, state: List[Dict]):
+        for ((_, _, _, _, history), history_state) in zip(self.reconstructions, state):
+            history.restore(history_state)
+
+    def record(self, time: float):
+        """
+        Adds the values in the buffers to the history of the connections with a reconstruction.
+        :param time: the time of the values.
+        """
+        for (_, _, idx, _, history) in self.reconstructions:
+            history.push(time, self.buffers[VarType.REAL][idx])
+
+    def write(self, targets=None, time: float = None, step_size: float = None):
+        """
+        Writes the values in the buffers into the target value references of the connections.
+        :param targets: if given, only the inputs of these FMUs are written.
+        :param time: start of the step the targets are about to take, to extrapolate the connections with a
+            reconstruction (from their last recorded values, which may be past the start of the step).
+            Without it, these get the values in the buffers as well.
+        :param step_size: size of the step the targets are about to take.
+        """
+        for (fmu, setter, vrs, buffer, idx) in self._writes:
+            if targets is None or fmu in targets:
+                setter(vrs, buffer[idx].tolist())
+        for transfer in self._raw_writes:
+            if targets is None or transfer.fmu in targets:
+                transfer.set()
+        for (fmu, vrs, idx, reconstruction, history) in self.reconstructions:
+            if targets is None or fmu in targets:
+                if time is None or history.count == 0:
+                    fmu.setReal(vrs, self.buffers[VarType.REAL][idx].tolist())
+                elif reconstruction.method == "extrapolate":
+                    fmu.setReal(vrs, history.extrapolate(time + step_size / 2, reconstruction.order, False).tolist())
+                else:
+                    derivatives = history.derivatives(time, reconstruction.order, False)
+                    fmu.setReal(vrs, derivatives[0].tolist())
+                    for k in range(1, len(derivatives)):
+                        fmu.setRealInputDerivatives(vrs, [k] * len(vrs), derivatives[k].tolist())
+
+    def execute(self, time: float = None, step_size: float = None):
+        """
+        Propagates the values of the sources to the targets.
+        :param time: the current time, which is the start of the next step of the targets.
+            If given, the values are recorded, and the connections with a reconstruction are extrapolated.
+        :param step_size: size of the next step of the targets.
+        """
+        self.read()
+        if time is not None:
+            self.record(time)
+        self.write(None, time, step_size)
@@ -0,0 +1,124 @@
+from math import factorial
+from typing import Dict, List
+
+import numpy as np
+
+
+class SignalHistory:
+    """
+    Ring buffer with the most recent samples (time, values) of a group of signals,
+        used to reconstruct their values between samples.
+    Samples must be pushed in increasing time order.
+    Samples later than the reconstructed time (e.g., of an FMU that already stepped ahead) are only used to interpolate.
+    """
+
+    def __init__(self, size: int, capacity: int = 3):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, size))
+        self.count = 0
+        self.next = 0
+
+    def push(self, time: float, values: np.ndarray):
+        if self.count > 0 and self.times[(self.next - 1) % self.capacity] >= time:
+            # Sample of the same time again: it replaces the previous one.
+            self.next = (self.next - 1) % self.capacity
+            self.count -= 1
+        self.times[self.next] = time
+        self.values[self.next] = values
+        self.next = (self.next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+        self.count = 0
+        self.next = 0
+
+    def checkpoint(self) -> Dict:
+        return {"times": self.times.copy(), "values": self.values.copy(), "count": self.count, "next": self.next}
+
+    def restore(self, state: Dict):
+        self.times[:] = state["times"]
+        self.values[:] = state["values"]
+        self.count = state["count"]
+        self.next = state["next"]
+
+    def ordered(self) -> np.ndarray:
+        """
+        :return: the positions of the samples in the buffers, from the oldest to the newest.
+        """
+        return (self.next - self.count + np.arange(self.count)) % self.capacity
+
+    def known(self, time: float):
+        """
+        :return: the positions of the samples up to time (from the oldest), and of the first sample after it, or None.
+        """
+        order = self.ordered()
+        n = int(np.searchsorted(self.times[order], time, side="right"))
+        if n == 0:
+            # Nothing known up to time: the oldest sample is the best guess.
+            n = 1
+        return order[:n], (order[n] if n < len(order) else None)
+
+    def hold(self, time: float) -> np.ndarray:
+        """
+        :return: the values of the last sample up to time.
+        """
+        (past, _) = self.known(time)
+        return self.values[past[-1]]
+
+    def points(self, time: float, order: int, causal: bool) -> np.ndarray:
+        """
+        :return: the positions of the last order + 1 samples (up to time, if causal), from the oldest.
+        """
+        (past, _) = self.known(time) if causal else (self.ordered(), None)
+        return past[-(order + 1):]
+
+    def extrapolate(self, time: float, order: int = 1, causal: bool = True) -> np.ndarray:
+        """
+        :return: the values at time of the polynomial of the given order through the last samples up to time
+            (or the last samples, if not causal). If there are not enough samples, the order is reduced.
+        """
+        points = self.points(time, order, causal)
+        ts = self.times[points]
+        result = np.zeros(self.values.shape[1])
+        for (j, p) in enumerate(points):
+            # Lagrange basis polynomial of sample j, evaluated at time.
+            weight = 1.0
+            for (m, tm) in enumerate(ts):
+                if m != j:
+                    weight *= (time - tm) / (ts[j] - tm)
+            result += weight * self.values[p]
+        return result
+
+    def derivatives(self, time: float, order: int = 1, causal: bool = True) -> List[np.ndarray]:
+        """
+        :return: the values at time, and their derivatives up to order, of the polynomial of the given order
+            through the last samples up to time (or the last samples, if not causal).
+            If there are not enough samples, the order of the polynomial is reduced (and higher derivatives are 0).
+        """
+        points = self.points(time, order, causal)
+        coefficients = np.polyfit(self.times[points] - time, self.values[points], len(points) - 1)[::-1]
+        return [factorial(k) * coefficients[k] if k < len(coefficients) else np.zeros(self.values.shape[1])
+                for k in range(order + 1)]
+
+    def interpolate(self, time: float) -> np.ndarray:
+        """
+        :return: the values at time, interpolated linearly between the samples around it,
+            or the values of the last sample if there is none after time.
+        """
+        (past, after) = self.known(time)
+        before = past[-1]
+        if after is None or self.times[before] >= time:
+            return self.values[before]
+        alpha = (time - self.times[before]) / (self.times[after] - self.times[before])
+        return (1.0 - alpha) * self.values[before] + alpha * self.values[after]
+
+    def reconstruct(self, time: float, method: str, order: int = 1) -> np.ndarray:
+        """
+        :param method: "hold", "extrapolate" or "interpolate".
+        """
+        if method == "hold":
+            return self.hold(time)
+        if method == "extrapolate":
+            return self.extrapolate(time, order)
+        return self.interpolate(time)
@@ -0,0 +1,94 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from PyCosimLibrary.scenario import RecordingPolicy
+
+AGGREGATES = ["min", "max", "mean"]
+
+
+class OutputRecorder:
+    """
+    Records the values of an output connection according to its RecordingPolicy.
+    Samples are stored in their own table (sample x column), with the time in column 0,
+        and a column per value reference (and per aggregate, if the policy has aggregates).
+    """
+    chunk_size: int = 256
+
+    def __init__(self, policy: RecordingPolicy, vrs: List[int]):
+        self.decimation = max(1, policy.decimation)
+        self.deadband = policy.deadband
+        self.aggregates = policy.aggregates if policy.aggregates is not None else []
+        for a in self.aggregates:
+            if a not in AGGREGATES:
+                raise ValueError(f"Unknown aggregate {a}. Expected one of {AGGREGATES}.")
+
+        stats = self.aggregates if len(self.aggregates) > 0 else ["value"]
+        n = len(vrs)
+        self.columns: Dict[Tuple[int, str], int] = {(vr, stat): 1 + i * n + j
+                                                    for (i, stat) in enumerate(stats) for (j, vr) in enumerate(vrs)}
+        self.data = np.empty((self.chunk_size, 1 + len(stats) * n), dtype=np.float64)
+        self.size = 0
+
+        self.window = 0
+        self.minimum = np.full(n, np.inf)
+        self.maximum = np.full(n, -np.inf)
+        self.total = np.zeros(n)
+        self.last: np.ndarray = None
+        self.time: float = None  # Time of the last snapshot of the current window.
+        self.values: np.ndarray = None  # Values of the last snapshot of the current window, without aggregates.
+
+    def update(self, time: float, values):
+        """
+        Adds the values of a snapshot to the current window, and records a sample when the window is complete.
+        """
+        self.window += 1
+        if len(self.aggregates) > 0:
+            values = np.asarray(values, dtype=np.float64)
+            np.minimum(self.minimum, values, out=self.minimum)
+            np.maximum(self.maximum, values, out=self.maximum)
+            self.total += values
+        if self.window < self.decimation:
+            self.time = time
+            if len(self.aggregates) == 0:
+                self.values = np.array(values, dtype=np.float64)
+            return
+        self.record(time, values)
+
+    def flush(self):
+        """
+        Records the current window, if it has any snapshots, as a sample at the time of its last snapshot.
+        Called at the end of the run, so that the last snapshots are not lost when their window is incomplete.
+        """
+        if self.window > 0:
+            self.record(self.time, self.values)
+
+    def record(self, time: float, values):
+        if len(self.aggregates) > 0:
+            sample = np.concatenate([self.minimum if a == "min" else self.maximum if a == "max"
+                                     else self.total / self.window for a in self.aggregates])
+            self.minimum.fill(np.inf)
+            self.maximum.fill(-np.inf)
+            self.total.fill(0.0)
+        else:
+            sample = np.asarray(values, dtype=np.float64)
+        self.window = 0
+        self.values = None
+
+        if self.deadband is not None and self.last is not None and np.all(np.abs(sample - self.last) <= self.deadband):
+            return
+        if self.size == self.data.shape[0]:
+            data = np.empty((2 * self.size, self.data.shape[1]), dtype=np.float64)
+            data[:self.size] = self.data
+            self.data = data
+        self.data[self.size, 0] = time
+        self.data[self.size, 1:] = sample
+        self.last = self.data[self.size, 1:]
+        self.size += 1
+
+    def signal(self, vr: int, stat: str = "value") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param stat: "value", or one of the aggregates of the policy.
+        :return: views with the times of the samples and the values of vr.
+        """
+        return self.data[:self.size, 0], self.data[:self.size, self.columns[(vr, stat)]]
@@ -0,0 +1,343 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Dict, Tuple, List
+
+import numpy as np
+from fmpy.fmi2 import FMU2Slave, fmi2True
+
+from PyCosimLibrary.loader import FMULoader, LoadedFMU
+
+# Operations that run through the shared memory block, signalled with semaphores, by their command code.
+# Any other operation is pickled through the pipe (the SLOW command).
+SLOW = 0
+DO_STEP = 1
+GET_OPS = {"getReal": 2, "getInteger": 3, "getBoolean": 4}
+SET_OPS = {"setReal": 5, "setInteger": 6, "setBoolean": 7}
+OP_NAMES = {code: op for (op, code) in list(GET_OPS.items()) + list(SET_OPS.items())}
+CASTS = {GET_OPS["getReal"]: float, GET_OPS["getInteger"]: int, GET_OPS["getBoolean"]: bool}
+
+# Layout of the shared memory block: header (int64), arguments (float64), values, and prefetched values.
+(OP, KEY, STATUS, RESULT) = range(4)
+HEADER_SIZE = 8
+ARGS_SIZE = 4
+OK = 0
+ERROR = 1
+
+
+class SharedBlock:
+    """
+    Views on the shared memory block of a RemoteFMU.
+    """
+
+    def __init__(self, shm: SharedMemory, buffer_size: int):
+        self.header = np.ndarray((HEADER_SIZE,), dtype=np.int64, buffer=shm.buf)
+        self.args = np.ndarray((ARGS_SIZE,), dtype=np.float64, buffer=shm.buf, offset=8 * HEADER_SIZE)
+        self.values = np.ndarray((buffer_size,), dtype=np.float64, buffer=shm.buf,
+                                 offset=8 * (HEADER_SIZE + ARGS_SIZE))
+        self.prefetched = np.ndarray((buffer_size,), dtype=np.float64, buffer=shm.buf,
+                                     offset=8 * (HEADER_SIZE + ARGS_SIZE + buffer_size))
+
+    @staticmethod
+    def nbytes(buffer_size: int) -> int:
+        return 8 * (HEADER_SIZE + ARGS_SIZE + 2 * buffer_size)
+
+
+def load_fmu(fmu_path, instance_name):
+    """
+    Factory of FMUs loaded from a file, to be used with RemoteFMU.
+    """
+    return FMULoader.load(fmu_path, instance_name, None)
+
+
+def serve(factory: Callable, conn, requested, answered, shm_name: str, buffer_size: int):
+    """
+    Main loop of the worker process hosting an FMU.
+    Each request is signalled with requested, and holds its command code in the header of the shared block.
+    Shared block commands are answered with a status in the header, signalled with answered
+        (an exception is sent through conn if the status is ERROR).
+    SLOW commands receive a tuple (operation, arguments) from conn, and are answered with ("ok", result)
+        or ("error", exception) through conn.
+    """
+    shm = SharedMemory(name=shm_name)
+    block = SharedBlock(shm, buffer_size)
+    header = block.header
+
+    hosted = factory()
+    fmu = hosted.fmu if isinstance(hosted, LoadedFMU) else hosted
+
+    vrs: Dict[int, List[int]] = {}
+    prefetch: List[Tuple[Callable, List[int], int]] = []
+    states: Dict[int, object] = {}
+    next_state = 0
+
+    running = True
+    while running:
+        requested.acquire()
+        code = int(header[OP])
+        if code != SLOW:
+            try:
+                if code == DO_STEP:
+                    header[RESULT] = fmu.doStep(float(block.args[0]), float(block.args[1]), bool(block.args[2]))
+                    # Reads the outputs that the master reads after each step, so that it does not ask for them.
+                    for (getter, prefetch_vrs, offset) in prefetch:
+                        block.prefetched[offset:offset + len(prefetch_vrs)] = getter(prefetch_vrs)
+                elif code in CASTS:
+                    key_vrs = vrs[int(header[KEY])]
+                    block.values[:len(key_vrs)] = getattr(fmu, OP_NAMES[code])(key_vrs)
+                else:
+                    key_vrs = vrs[int(header[KEY])]
+                    n = len(key_vrs)
+                    fmu_values = block.values[:n].tolist() if code == SET_OPS["setReal"] \
+                        else block.values[:n].astype(int).tolist()
+                    getattr(fmu, OP_NAMES[code])(key_vrs, fmu_values)
+                header[STATUS] = OK
+            except Exception as e:
+                header[STATUS] = ERROR
+                conn.send(("error", e))
+            answered.release()
+            continue
+
+        (op, args) = conn.recv()
+        try:
+            result = None
+            if op == "register":
+                (key, key_vrs) = args
+                vrs[key] = key_vrs
+            elif op == "prefetch":
+                prefetch = [(getattr(fmu, OP_NAMES[code]), vrs[key], offset) for (code, key, offset) in args[0]]
+            elif op == "getFMUstate":
+                next_state += 1
+                states[next_state] = fmu.getFMUstate()
+                result = next_state
+            elif op == "setFMUstate":
+                fmu.setFMUstate(states[args[0]])
+            elif op == "freeFMUstate":
+                fmu.freeFMUstate(states.pop(args[0]))
+            elif op == "serializeFMUstate":
+                result = fmu.serializeFMUstate(states[args[0]])
+            elif op == "deSerializeFMUstate":
+                next_state += 1
+                states[next_state] = fmu.deSerializeFMUstate(args[0])
+                result = next_state
+            elif op == "freeInstance":
+                if isinstance(hosted, LoadedFMU):
+                    FMULoader.unload(hosted)
+                else:
+                    fmu.freeInstance()
+                running = False
+            else:
+                result = getattr(fmu, op)(*args)
+            conn.send(("ok", result))
+        except Exception as e:
+            conn.send(("error", e))
+
+    del block, header
+    shm.close()
+
+
+class RemoteFMU(FMU2Slave):
+    """
+    Proxy to an FMU hosted in a worker process.
+    A crash of the hosted FMU only kills the worker process, and the FMUs in different processes can run in parallel
+        (e.g., with the ParallelJacobiRunner, since waiting for the worker releases the GIL).
+    doStep and getReal/setReal/getInteger/... go through a shared memory block: the command, a key for the
+        value references, and the values are written in the block, and the worker is woken up with a semaphore.
+        Only the first use of some value references, the FMU states, strings and other rare operations
+        are pickled through a pipe.
+    The outputs read between a doStep and the next set are remembered, and the worker reads them right after
+        the next doStep, so that reading them after the step needs no round trip to the worker.
+    FMU states stay in the worker process, and are referred to by an integer handle.
+    The factory must be picklable (e.g., a class, or functools.partial(load_fmu, path, name)),
+        and returns either an FMU2Slave or a LoadedFMU, which is unloaded with the proxy.
+    """
+
+    def __init__(self, instanceName: str, factory: Callable, buffer_size: int = 4096):
+        self.instanceName = instanceName
+        self.buffer_size = buffer_size
+        self._vr_keys: Dict[Tuple[int, ...], int] = {}
+        self._shm = SharedMemory(create=True, size=SharedBlock.nbytes(buffer_size))
+        self._block = SharedBlock(self._shm, buffer_size)
+        # Gets since the last doStep, before any set: (code, key, size).
+        self._reads_after_step: List[Tuple[int, int, int]] = []
+        self._recording = True
+        self._prefetch: List[Tuple[int, int, int]] = []
+        self._prefetch_offsets: Dict[Tuple[int, int], int] = {}
+        self._prefetched: Dict[Tuple[int, int], int] = {}  # Offsets of the prefetched values, while valid.
+        self._requested = multiprocessing.Semaphore(0)
+        self._answered = multiprocessing.Semaphore(0)
+        (self._conn, worker_conn) = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=serve,
+                                                args=(factory, worker_conn, self._requested, self._answered,
+                                                      self._shm.name, buffer_size),
+                                                daemon=True)
+        self._process.start()
+        # So that recv fails when the worker dies.
+        worker_conn.close()
+
+    def _died(self):
+        return RuntimeError(f"The process hosting {self.instanceName} has died.")
+
+    def _request(self, op, *args):
+        self._prefetched = {}
+        self._block.header[OP] = SLOW
+        self._conn.send((op, args))
+        self._requested.release()
+        try:
+            (status, result) = self._conn.recv()
+        except EOFError:
+            raise self._died()
+        if status == "error":
+            raise result
+        return result
+
+    def _command(self, code: int, key: int = 0):
+        header = self._block.header
+        header[OP] = code
+        header[KEY] = key
+        self._requested.release()
+        while not self._answered.acquire(timeout=1.0):
+            if not self._process.is_alive():
+                raise self._died()
+        if header[STATUS] == ERROR:
+            (_, e) = self._conn.recv()
+            raise e
+
+    def _vr_key(self, vr) -> int:
+        """
+        Returns the key of the value references, registering them in the worker on their first use.
+        """
+        vr = tuple(vr)
+        key = self._vr_keys.get(vr)
+        if key is not None:
+            return key
+        if len(vr) > self.buffer_size:
+            raise ValueError(f"Cannot transfer {len(vr)} values with a buffer of size {self.buffer_size}.")
+        key = len(self._vr_keys)
+        self._request("register", key, list(vr))
+        self._vr_keys[vr] = key
+        return key
+
+    def _get(self, op, vr):
+        code = GET_OPS[op]
+        key = self._vr_key(vr)
+        n = len(vr)
+        if self._recording and (code, key, n) not in self._reads_after_step:
+            self._reads_after_step.append((code, key, n))
+        offset = self._prefetched.get((code, key))
+        if offset is not None:
+            values = self._block.prefetched[offset:offset + n]
+        else:
+            self._command(code, key)
+            values = self._block.values[:n]
+        cast = CASTS[code]
+        return [cast(v) for v in values.tolist()]
+
+    def _set(self, op, vr, value):
+        key = self._vr_key(vr)
+        self._prefetched = {}
+        self._recording = False
+        self._block.values[:len(vr)] = value
+        self._command(SET_OPS[op], key)
+
+    def _update_prefetch(self):
+        """
+        Prefetches the outputs read after the previous step, as many as fit in the buffer.
+        """
+        reads = self._reads_after_step
+        if reads != self._prefetch:
+            offsets = {}
+            offset = 0
+            for (code, key, n) in reads:
+                if offset + n > self.buffer_size:
+                    break
+                offsets[(code, key)] = offset
+                offset += n
+            self._request("prefetch", [(code, key, offset) for ((code, key), offset) in offsets.items()])
+            (self._prefetch, self._prefetch_offsets) = (list(reads), offsets)
+        self._reads_after_step = []
+        self._recording = True
+
+    def instantiate(self, visible=False, callbacks=None, loggingOn=False):
+        return self._request("instantiate", visible, None, loggingOn)
+
+    def setupExperiment(self, tolerance=None, startTime=0.0, stopTime=None):
+        return self._request("setupExperiment", tolerance, startTime, stopTime)
+
+    def enterInitializationMode(self):
+        return self._request("enterInitializationMode")
+
+    def exitInitializationMode(self):
+        return self._request("exitInitializationMode")
+
+    def terminate(self):
+        return self._request("terminate")
+
+    def reset(self):
+        return self._request("reset")
+
+    def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
+        self._update_prefetch()
+        args = self._block.args
+        args[0] = currentCommunicationPoint
+        args[1] = communicationStepSize
+        args[2] = 1.0 if noSetFMUStatePriorToCurrentPoint else 0.0
+        self._command(DO_STEP)
+        self._prefetched = self._prefetch_offsets
+        return int(self._block.header[RESULT])
+
+    def getReal(self, vr):
+        return self._get("getReal", vr)
+
+    def getInteger(self, vr):
+        return self._get("getInteger", vr)
+
+    def getBoolean(self, vr):
+        return self._get("getBoolean", vr)
+
+    def getString(self, vr):
+        return self._request("getString", list(vr))
+
+    def setReal(self, vr, value):
+        self._set("setReal", vr, value)
+
+    def setInteger(self, vr, value):
+        self._set("setInteger", vr, value)
+
+    def setBoolean(self, vr, value):
+        self._set("setBoolean", vr, value)
+
+    def setString(self, vr, value):
+        self._request("setString", list(vr), list(value))
+
+    def setRealInputDerivatives(self, vr, order, value):
+        self._request("setRealInputDerivatives", list(vr), list(order), list(value))
+
+    def getFMUstate(self):
+        return self._request("getFMUstate")
+
+    def setFMUstate(self, state):
+        self._request("setFMUstate", state)
+
+    def freeFMUstate(self, state):
+        self._request("freeFMUstate", state)
+
+    def serializeFMUstate(self, state):
+        return self._request("serializeFMUstate", state)
+
+    def deSerializeFMUstate(self, serializedState, state=None):
+        return self._request("deSerializeFMUstate", serializedState)
+
+    def freeInstance(self):
+        """
+        Frees the hosted FMU and stops the worker process.
+        """
+        if self._process is None:
+            return
+        if self._process.is_alive():
+            self._request("freeInstance")
+        self._process.join()
+        self._process = None
+        self._conn.close()
+        del self._block
+        self._shm.close()
+        self._shm.unlink()
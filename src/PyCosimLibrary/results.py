@@ -1,7 +1,172 @@
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from PyCosimLibrary.modes import ModeTracker
+from PyCosimLibrary.recording import OutputRecorder
 
 
 class CosimResults:
-    out_signals: Dict[str, Dict[int, List[float]]] # Stores all out_signals in a continuous timeline (consistent with timestamps)
-    timestamps: List[float]
-    abstract_modes: Dict[str, Dict[int, List[float]]] # Stores the sequences of modes (not consistent with timeline)
+    """
+    Stores the results of a co-simulation in a single preallocated table (time x signal).
+    Column 0 holds the timestamps, and every other column holds one output signal.
+    The table grows in chunks when the number of snapshots is not known in advance.
+    The out_signals and timestamps attributes are views on the table, so no data is copied when reading them.
+    """
+    data: np.ndarray = None # Stores all snapshots, one row per snapshot (consistent with timestamps)
+    size: int = 0 # Number of rows of data that are filled in.
+    columns: Dict[str, Dict[int, int]] = None # Maps each instance name and value reference to its column in data.
+    output_columns: List[slice] = None # Columns of each output connection of the scenario, in the same order.
+    output_recorders: List[OutputRecorder] = None # Recorder of each output connection with a recording policy, or None.
+    recorders: Dict[str, Dict[int, OutputRecorder]] = None # Recorder of each recorded value reference, per instance.
+    names: Dict[str, int] = None # Maps "instance.variable" to its column, for the variables with a known name.
+    modes: ModeTracker = None # Detects the abstract modes of the discontinuous outputs, if there are any.
+    chunk_size: int = 1024 # Minimum number of rows added when the table is full.
+    checkpointed: int = 0 # Number of rows included in the previous checkpoints.
+
+    _views: Dict[str, Dict[int, np.ndarray]] = None
+    _views_size: int = -1
+
+    def allocate(self, columns: Dict[str, Dict[int, int]], capacity: int, names: Dict[str, int] = None):
+        """
+        Creates the table.
+        :param columns: the column of each value reference, per instance. Column 0 is reserved for time.
+        :param capacity: the number of rows to preallocate.
+        :param names: the column of each "instance.variable", for the variables with a known name.
+        :return:
+        """
+        self.columns = columns
+        self.names = names if names is not None else {}
+        num_columns = 1 + sum(len(vrs) for vrs in columns.values())
+        self.data = np.empty((max(capacity, 1), num_columns), dtype=np.float64)
+        self.size = 0
+        self.checkpointed = 0
+        self._views = None
+        self._views_size = -1
+
+    def filled(self) -> np.ndarray:
+        """
+        :return: view with the rows of the snapshots taken so far.
+        """
+        return self.data[:self.size]
+
+    def grow(self):
+        capacity = self.data.shape[0]
+        new_data = np.empty((capacity + max(self.chunk_size, capacity), self.data.shape[1]), dtype=np.float64)
+        new_data[:self.size] = self.data[:self.size]
+        self.data = new_data
+        self._views_size = -1
+
+    def new_row(self, time: float) -> np.ndarray:
+        """
+        Reserves a row for a new snapshot.
+        :param time: the time of the snapshot.
+        :return: the row, to be filled in with the output values.
+        """
+        if self.size == self.data.shape[0]:
+            self.grow()
+        row = self.data[self.size]
+        row[0] = time
+        self.size += 1
+        return row
+
+    def close(self):
+        """
+        Called when the co-simulation finishes. Sinks that write to disk flush their remaining rows here.
+        The recorders record their incomplete windows.
+        :return:
+        """
+        for recorder in self.output_recorders or []:
+            if recorder is not None:
+                recorder.flush()
+
+    def recorded(self, instance: str, vr: int, stat: str = "value") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Samples of an output with a recording policy.
+        :param stat: "value", or one of the aggregates of the policy.
+        :return: the times of the samples and the values.
+        """
+        return self.recorders[instance][vr].signal(vr, stat)
+
+    @property
+    def abstract_modes(self) -> Dict[str, Dict[int, List[float]]]:
+        """
+        The sequence of modes of each discontinuous output (see mode_durations for when they happened).
+        """
+        modes = {instance: {} for instance in self.columns.keys()}
+        if self.modes is not None:
+            for (instance, vrs) in self.columns.items():
+                for (vr, col) in vrs.items():
+                    if col in self.modes.columns:
+                        modes[instance][vr] = self.modes.column_events(col)["value"].tolist()
+        return modes
+
+    def mode_at(self, instance: str, vr: int, time: float) -> float:
+        """
+        :return: the abstract mode of a discontinuous output at time.
+        """
+        return self.modes.mode_at(self.columns[instance][vr], self.timestamps, time)
+
+    def mode_durations(self, instance: str, vr: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the sequence of abstract modes of a discontinuous output, and how long each lasted.
+        """
+        return self.modes.durations(self.columns[instance][vr], self.timestamps)
+
+    def signal(self, name: str) -> np.ndarray:
+        """
+        :param name: "instance.variable".
+        :return: view with the values of the variable (consistent with timestamps).
+        """
+        return self.filled()[:, self.names[name]]
+
+    def checkpoint(self) -> Dict:
+        """
+        State of the results, from which restore continues a resumed co-simulation.
+        Only the rows added since the previous checkpoint are included ("rows", starting at row "start"):
+            the Checkpointer appends them to the rows it saved before, and gives restore all of them.
+        """
+        state = self.recorders_state()
+        state["start"] = self.checkpointed
+        state["rows"] = self.data[self.checkpointed:self.size]
+        self.checkpointed = self.size
+        return state
+
+    def recorders_state(self) -> Dict:
+        """
+        State of the mode tracker and the recorders, which are kept in memory by every sink.
+        """
+        return {"modes": self.modes, "output_recorders": self.output_recorders, "recorders": self.recorders}
+
+    def restore_recorders(self, state: Dict):
+        (self.modes, self.output_recorders, self.recorders) = \
+            (state["modes"], state["output_recorders"], state["recorders"])
+
+    def restore(self, state: Dict):
+        """
+        Replaces the snapshots taken so far with the ones in state (after allocate).
+        """
+        self.restore_recorders(state)
+        data = state["data"]
+        while self.data.shape[0] < len(data):
+            self.grow()
+        self.data[:len(data)] = data
+        self.size = len(data)
+        self.checkpointed = self.size
+        self._views_size = -1
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.filled()[:, 0]
+
+    @property
+    def out_signals(self) -> Dict[str, Dict[int, np.ndarray]]:
+        """
+        Stores all out_signals in a continuous timeline (consistent with timestamps).
+        """
+        if self._views_size != self.size:
+            filled = self.filled()
+            self._views = {instance: {vr: filled[:, col] for (vr, col) in vrs.items()}
+                           for (instance, vrs) in self.columns.items()}
+            self._views_size = self.size
+        return self._views
@@ -1,9 +1,18 @@
-from typing import List, Callable
+from ctypes import byref
+from typing import List, Callable, Dict
 import numpy as np
 from fmpy.fmi2 import FMU2Slave
 
+from PyCosimLibrary.checkpoint import Checkpointer
+from PyCosimLibrary.initialization import FixedPointInitialization
+from PyCosimLibrary.instrumentation import Instrumentation
+from PyCosimLibrary.modes import ModeTracker
+from PyCosimLibrary.propagation_plan import PropagationPlan, GETTERS, SETTERS, as_slice
+from PyCosimLibrary.recording import OutputRecorder
 from PyCosimLibrary.results import CosimResults
 from PyCosimLibrary.scenario import CosimScenario, VarType, SignalType, Connection
+from PyCosimLibrary.step_control import AdaptiveStepController
+from PyCosimLibrary.virtual_fmus import ArrayVirtualFMU
 
 
 class CosimRunner:
@@ -14,93 +23,216 @@ class CosimRunner:
     The outputs are handled by some other objects as well.
     The concrete co-simulation step is implemented by subclasses.
     """
+    plan: PropagationPlan = None
+    stop_plan: PropagationPlan = None  # Plan whose buffers hold the value of the stop condition.
+    stop_index: int = None
+    output_plan: PropagationPlan = None  # Plan that reads the outputs of the scenario, for the snapshots.
+    output_indices: List[object] = None  # Indices of the values of each output in the buffers of output_plan.
+    step_controller: AdaptiveStepController = None  # If set, the step size is adapted during the co-simulation.
+    instrumentation: Instrumentation = None  # If set, the phases of the co-simulation are timed.
+    initialization: FixedPointInitialization = None  # If set, solves the initial values of the couplings.
+    checkpointer: Checkpointer = None  # If set, checkpoints are written during the co-simulation (see resume_cosim).
+
+    def compile_scenario(self, scenario: CosimScenario):
+        """
+        Precomputes whatever the co-simulation step needs from the scenario, before the co-simulation loop starts.
+        Subclasses can extend it to compile their own propagation plans.
+        :param scenario:
+        :return:
+        """
+        self.plan = PropagationPlan(scenario.connections, self.stop_probes(scenario))
+        self.set_stop_probe(scenario, self.plan)
+        self.output_plan = PropagationPlan([], scenario.outputs)
+        self.output_indices = [as_slice([self.output_plan.index(ov.source_fmu, ov.value_type, vr)
+                                         for vr in ov.source_vr]) for ov in scenario.outputs]
+
+    def stop_probes(self, scenario: CosimScenario) -> List[Connection]:
+        """
+        Probes to add to a propagation plan so that it reads the stop condition.
+        """
+        if scenario.stop_condition is None:
+            return []
+        return [Connection(value_type=VarType.REAL, source_fmu=scenario.stop_condition.source_fmu,
+                           source_vr=scenario.stop_condition.source_vr[:1])]
+
+    def set_stop_probe(self, scenario: CosimScenario, plan: PropagationPlan):
+        """
+        Sets the plan that reads the stop condition, which must be executed after the stop condition FMU is stepped.
+        """
+        if scenario.stop_condition is not None:
+            self.stop_plan = plan
+            self.stop_index = plan.index(scenario.stop_condition.source_fmu, VarType.REAL,
+                                         scenario.stop_condition.source_vr[0])
+        else:
+            self.stop_plan = None
+
+    def propagation_plans(self) -> List[PropagationPlan]:
+        """
+        The propagation plans compiled by the runner, whose state is kept in the checkpoints.
+        Subclasses with their own plans extend it.
+        """
+        return [self.plan]
+
+    def checkpoint_state(self) -> Dict:
+        """
+        State kept by the runner between co-simulation steps, for the checkpoints (see Checkpointer).
+        Subclasses with more state extend it, and restore_state.
+        """
+        return {"plans": [plan.checkpoint() for plan in self.propagation_plans()]}
+
+    def restore_state(self, state: Dict):
+        for (plan, plan_state) in zip(self.propagation_plans(), state["plans"]):
+            plan.restore(plan_state)
+
+    def reject_reconstructions(self, scenario: CosimScenario):
+        """
+        For runners that do not extrapolate the inputs, which would silently ignore the reconstructions.
+        """
+        for c in scenario.connections:
+            if c.reconstruction is not None:
+                raise ValueError(f"Invalid Scenario. {type(self).__name__} does not support the reconstruction "
+                                 f"of connection {c}.")
 
     def propagate_initial_outputs(self, scenario: CosimScenario):
         """
         To be subclassed by specialized methods.
-        Default implementation is normal output propagation.
+        Default implementation is normal output propagation, or the iteration of self.initialization if it is set.
         :param scenario:
         :return:
         """
-        self.propagate_outputs(scenario.connections)
+        if self.initialization is not None:
+            self.initialization.initialize(scenario)
+        else:
+            self.propagate_outputs(scenario.connections)
 
     def propagate_outputs(self, connections: List[Connection]):
         """
         For now, we use the order of the connections as an indicator for the order of output propagation.
         This means the user is responsible for providing this information.
+        This walks the connections one by one, so the co-simulation step uses the compiled self.plan instead.
         """
         for c in connections:
             if c.target_fmu is not None:
-                if c.value_type == VarType.REAL:
-                    c.target_fmu.setReal(c.target_vr, c.source_fmu.getReal(c.source_vr))
-                else:
-                    c.target_fmu.setBoolean(c.target_vr, c.source_fmu.getBoolean(c.source_vr))
+                getattr(c.target_fmu, SETTERS[c.value_type])(c.target_vr, self.get_fmu_vars(c.source_fmu, c.source_vr,
+                                                                                            c.value_type))
 
     def init_results(self, scenario: CosimScenario, results=None):
         if results is None:
             results = CosimResults()
 
-        results.timestamps = []
-
         # Output signals store the outputs of the FMU at the end of the cosim step.
-        results.out_signals = {}
-
-        results.abstract_modes = {}
-
+        # Each output value reference gets a column in the results table. Column 0 holds the time.
+        columns = {}
+        names = {}
+        results.output_columns = []
+        # Outputs with a recording policy are not stored in the table, but by their own recorder.
+        results.output_recorders = []
+        results.recorders = {}
+        mode_columns = []
+        mode_tolerances = []
+
+        next_column = 1
         for ov in scenario.outputs:
+            if ov.value_type == VarType.STRING:
+                raise ValueError(f"Invalid Scenario. String outputs cannot be recorded: {ov}")
+            if ov.recording is not None:
+                recorder = OutputRecorder(ov.recording, ov.source_vr)
+                recorders = results.recorders.setdefault(ov.source_fmu.instanceName, {})
+                for vr in ov.source_vr:
+                    assert vr not in recorders.keys() and vr not in columns.get(ov.source_fmu.instanceName, {}), \
+                        "Using duplicate connections for output is not allowed."
+                    recorders[vr] = recorder
+                results.output_columns.append(None)
+                results.output_recorders.append(recorder)
+                continue
+            results.output_recorders.append(None)
             # Store the output signals
-            if ov.source_fmu.instanceName not in results.out_signals.keys():
-                assert ov.source_fmu.instanceName not in results.abstract_modes.keys(), \
-                    "Using duplicate connections for output is not allowed."
-                results.out_signals[ov.source_fmu.instanceName] = {}
-                results.abstract_modes[ov.source_fmu.instanceName] = {}
+            if ov.source_fmu.instanceName not in columns.keys():
+                columns[ov.source_fmu.instanceName] = {}
             for vr in ov.source_vr:
-                assert vr not in results.out_signals[ov.source_fmu.instanceName].keys(), \
+                assert vr not in columns[ov.source_fmu.instanceName].keys() and \
+                       vr not in results.recorders.get(ov.source_fmu.instanceName, {}), \
                     "Using duplicate connections for output is not allowed."
-                results.out_signals[ov.source_fmu.instanceName][vr] = []
-            # Init the modes (only for discontinuous out_signals)
+                columns[ov.source_fmu.instanceName][vr] = next_column
+                name = scenario.variables[ov.source_fmu].name(ov.value_type, vr) \
+                    if ov.source_fmu in scenario.variables else None
+                if name is not None:
+                    names[f"{ov.source_fmu.instanceName}.{name}"] = next_column
+                next_column += 1
+            results.output_columns.append(slice(next_column - len(ov.source_vr), next_column))
+            # Track the modes (only for discontinuous out_signals)
             if ov.signal_type == SignalType.DISCONTINUOUS:
-                for vr in ov.source_vr:
-                    assert vr not in results.abstract_modes[ov.source_fmu.instanceName].keys(), \
-                        "Duplicate abstract mode found."
-                    results.abstract_modes[ov.source_fmu.instanceName][vr] = []
+                mode_columns.extend(range(next_column - len(ov.source_vr), next_column))
+                mode_tolerances.extend([ov.quantization_tol] * len(ov.source_vr))
+
+        results.allocate(columns, self.expected_snapshots(scenario), names)
+        results.modes = ModeTracker(mode_columns, mode_tolerances) if len(mode_columns) > 0 else None
 
         return results
 
-    def get_fmu_vars(self, fmu: FMU2Slave, vrs: List[int], type: VarType):
-        if type == VarType.REAL:
-            values = fmu.getReal(vrs)
-        else:
-            values = fmu.getBoolean(vrs)
-        return values
+    def expected_snapshots(self, scenario: CosimScenario):
+        """
+        Number of snapshots taken by a run of the scenario, or an initial guess if it is controlled by a stop condition.
+        """
+        if scenario.stop_condition is None and scenario.stop_time > 0.0:
+            return int(round(scenario.stop_time / scenario.print_interval)) + 2
+        return CosimResults.chunk_size
 
-    def snapshot(self, time: float, scenario: CosimScenario, results: CosimResults):
-        results.timestamps.append(time)
-        for ov in scenario.outputs:
+    def save_state(self, f: FMU2Slave, state=None):
+        """
+        Records the state of the FMU.
+        If a previously recorded state is given, it is overwritten:
+            compiled FMUs reuse its memory (as allowed by fmi2GetFMUstate), and other FMUs release it.
+        :param f:
+        :param state: previously recorded state of f, or None.
+        :return: the recorded state.
+        """
+        if state is None:
+            return f.getFMUstate()
+        if getattr(f, "component", None) is not None:
+            f.fmi2GetFMUstate(f.component, byref(state))
+            return state
+        f.freeFMUstate(state)
+        return f.getFMUstate()
 
-            # Get values from FMU and place them in the corresponding signal streams
-            values = self.get_fmu_vars(ov.source_fmu, ov.source_vr, ov.value_type)
+    def get_fmu_vars(self, fmu: FMU2Slave, vrs: List[int], type: VarType):
+        return getattr(fmu, GETTERS[type])(vrs)
+
+    def snapshot(self, time: float, scenario: CosimScenario, results: CosimResults) -> np.ndarray:
+        row = results.new_row(time)
+        plan = self.output_plan
+        plan.read()
+        for (ov, columns, recorder, idx) in zip(scenario.outputs, results.output_columns, results.output_recorders,
+                                                self.output_indices):
 
+            # Get values from the buffers of the output plan and place them in the corresponding columns of the row.
             # Each item with index i in values corresponds to the value of item with index i in ov.source_vr
-            for i in range(len(values)):
-                value_append = values[i]
-                vr: int = ov.source_vr[i]
-                signal = results.out_signals[ov.source_fmu.instanceName][vr]
-                signal.append(value_append)
+            values = plan.buffers[ov.value_type][idx]
+            if recorder is None:
+                row[columns] = values
+            else:
+                recorder.update(time, values)
 
-            # Aggregate modes
-            if ov.signal_type == SignalType.DISCONTINUOUS:
-                # If last known mode has changed (modulo quantization_tol), then it's a new mode.
-                for i in range(len(values)):
-                    current_mode = values[i]
-                    vr: int = ov.source_vr[i]
-                    abstract_modes = results.abstract_modes[ov.source_fmu.instanceName][vr]
-                    if len(abstract_modes) == 0:
-                        abstract_modes.append(current_mode)
-                    else:
-                        last_mode = abstract_modes[-1]
-                        if not np.isclose(current_mode, last_mode, rtol=ov.quantization_tol, atol=ov.quantization_tol):
-                            abstract_modes.append(current_mode)
+        # Aggregate modes: a discontinuous output enters a new mode when it changes by more than its quantization_tol.
+        if results.modes is not None:
+            results.modes.update(row)
+
+        return row
+
+    def end_tick(self, scenario: CosimScenario):
+        """
+        Number of steps of size scenario.step_size until stop_time, or None if the run ends with the stop condition.
+        """
+        if scenario.stop_condition is not None:
+            return None
+        assert scenario.stop_time > 0.0
+        return int(np.floor(scenario.stop_time / scenario.step_size + 1e-3))
+
+    def stop_threshold(self, scenario: CosimScenario):
+        """
+        The co-simulation continues while the stop condition is above this value.
+        """
+        return scenario.step_size * 1e-3
 
     def should_continue(self, scenario, time):
         end_connection = scenario.stop_condition
@@ -110,16 +242,16 @@ class CosimRunner:
                    np.isclose(time + scenario.step_size, scenario.stop_time, rtol=scenario.step_size * 1e-03,
                               atol=scenario.step_size * 1e-03)
 
-        last_value = end_connection.source_fmu.getReal(end_connection.source_vr)[0]
-        return last_value > 0.0 and not \
-            np.isclose(last_value, 0.0, rtol=scenario.step_size * 1e-3, atol=scenario.step_size * 1e-3)
+        last_value = self.stop_plan.buffers[VarType.REAL][self.stop_index]
+        return last_value > self.stop_threshold(scenario)
 
-    def run_cosim_step(self, time, scenario: CosimScenario):
+    def run_cosim_step(self, time, scenario: CosimScenario, step_size: float = None):
         """
         To be overriden.
         Implements the cosim step algorithm.
         :param time:
         :param scenario:
+        :param step_size: size of the step, if different from scenario.step_size.
         :return:
         """
         raise NotImplementedError("This method needs to be overriden.")
@@ -130,6 +262,12 @@ class CosimRunner:
         if len(scenario.fmus) != len(set_fmus):
             raise ValueError("Invalid Scenario. Duplicate fmus found: {}".format(scenario.fmus))
 
+        # Rule: the propagation plans and the results hold one value per variable, so FMUs with lanes cannot be run.
+        for f in scenario.fmus:
+            if isinstance(f, ArrayVirtualFMU) and f.lanes > 1:
+                raise ValueError(f"Invalid Scenario. {f.instanceName} has {f.lanes} lanes, "
+                                 f"but only FMUs with one lane can be co-simulated.")
+
         # Rule: every connection must refer to an FMU that exists in the list of FMUs.
         for connection in scenario.connections:
             if connection.source_fmu not in set_fmus:
@@ -149,47 +287,192 @@ class CosimRunner:
         """
         pass
 
-    def run_cosim(self, scenario: CosimScenario, status: Callable):
+    def fixed_steps(self, scenario: CosimScenario, status: Callable, results: CosimResults, start_tick: int = 0):
+        """
+        Co-simulation loop with constant step size.
+        Time is computed from the number of steps taken (ticks), so it does not drift,
+            and the end of the run and the snapshots are found by comparing integers.
+        :param start_tick: number of steps already taken, when resuming from a checkpoint.
+        :return: a generator that yields the time and the row of each snapshot, once it is taken.
+        """
+        step_size = scenario.step_size
+        ticks_per_print = max(1, int(round(scenario.print_interval / step_size)))
+        end_tick = self.end_tick(scenario)
+        if end_tick is None:
+            stop_values = self.stop_plan.buffers[VarType.REAL]
+            stop_index = self.stop_index
+            stop_threshold = self.stop_threshold(scenario)
+
+        tick = start_tick
+        next_print_tick = (tick // ticks_per_print + 1) * ticks_per_print
+        checkpointer = self.checkpointer
+        if checkpointer is not None:
+            checkpointer.start()
+
+        # Take output snapshot for time 0
+        if tick == 0:
+            yield 0.0, self.snapshot(0.0, scenario, results)
+        while (tick < end_tick) if end_tick is not None else (stop_values[stop_index] > stop_threshold):
+            self.run_cosim_step(tick * step_size, scenario)
+
+            tick += 1
+            if tick == next_print_tick:
+                time = tick * step_size
+                if status is not None:
+                    status(time)
+                row = self.snapshot(time, scenario, results)
+                next_print_tick += ticks_per_print
+                if checkpointer is not None and checkpointer.due():
+                    checkpointer.write(scenario, tick, results, self.checkpoint_state())
+                yield time, row
+
+    def adaptive_steps(self, scenario: CosimScenario, status: Callable, results: CosimResults):
+        """
+        Co-simulation loop with the step size chosen by self.step_controller.
+        Steps are shortened so that they end exactly at the snapshot times.
+        Rejected steps are rolled back with setFMUstate and repeated with a smaller step.
+        :return: a generator that yields the time and the row of each snapshot, once it is taken.
+        """
+        controller = self.step_controller
+        step_size = controller.setup(scenario)
+        states: Dict[FMU2Slave, object] = {}
+
+        time = 0.0
+        print_index = 1
+        next_print = scenario.print_interval
+
+        self.plan.read()
+        history = [(time, self.plan.buffers.get(VarType.REAL, np.zeros(0)).copy())]
+
+        try:
+            # Take output snapshot for time 0
+            yield time, self.snapshot(time, scenario, results)
+            while self.should_continue(scenario, time):
+                h = min(step_size, next_print - time)
+                if scenario.stop_condition is None:
+                    h = min(h, scenario.stop_time - time)
+                for f in scenario.fmus:
+                    states[f] = self.save_state(f, states.get(f))
+
+                self.run_cosim_step(time, scenario, h)
+
+                self.plan.read()
+                values = self.plan.buffers.get(VarType.REAL, np.zeros(0))
+                error = controller.error(history, time + h, values)
+                if error > 1.0 and controller.can_reject(h):
+                    for f in scenario.fmus:
+                        f.setFMUstate(states[f])
+                    step_size = controller.next_step(h, error)
+                    continue
+                # Steps shortened to end at a snapshot time (or at the stop time) keep the proposed step size.
+                if h >= step_size:
+                    step_size = controller.next_step(h, error)
+
+                if np.isclose(time + h, next_print, rtol=1e-9, atol=scenario.step_size * 1e-3):
+                    # Avoid drift in the snapshot times.
+                    time = next_print
+                    print_index += 1
+                    next_print = print_index * scenario.print_interval
+                    if status is not None:
+                        status(time)
+                    yield time, self.snapshot(time, scenario, results)
+                else:
+                    time += h
+                history = [history[-1], (time, values.copy())]
+        finally:
+            for (f, s) in states.items():
+                f.freeFMUstate(s)
+
+    def run_cosim(self, scenario: CosimScenario, status: Callable, results: CosimResults = None):
+        """
+        Runs the co-simulation.
+        :param scenario:
+        :param status: called with the current time at every snapshot.
+        :param results: where the snapshots are written to. Defaults to an in-memory CosimResults.
+        :return: the results.
+        """
+
+        return self.start_cosim(scenario, status, results, None)
+
+    def resume_cosim(self, scenario: CosimScenario, status: Callable, checkpoint_path: str,
+                     results: CosimResults = None):
+        """
+        Continues a co-simulation from the checkpoint written by a previous run (see Checkpointer).
+        The scenario must be built as for the original run: the FMUs are initialized as usual,
+            and then set to their state at the checkpoint.
+        :param results: where the snapshots are written to. StreamingResults must be given the original path,
+            and continue after the rows written when the checkpoint was taken.
+        :return: the results, including the snapshots taken before the checkpoint.
+        """
+        return self.start_cosim(scenario, status, results, Checkpointer.read(checkpoint_path))
 
+    def start_cosim(self, scenario: CosimScenario, status: Callable, results: CosimResults, checkpoint):
+        self.prepare_cosim(scenario, checkpoint)
+        results = self.init_results(scenario, results)
+        for _ in self.cosim_steps(scenario, status, results, checkpoint):
+            pass
+        return results
+
+    def prepare_cosim(self, scenario: CosimScenario, checkpoint=None):
+        """
+        Validates and compiles the scenario, before the results are initialized and the co-simulation steps start.
+        """
         self.valid_scenario(scenario)
 
-        # Init results
-        results = self.init_results(scenario)
+        if self.step_controller is not None and (self.checkpointer is not None or checkpoint is not None):
+            raise NotImplementedError("Checkpoints are only supported with fixed step sizes.")
 
-        for f in scenario.fmus:
-            f.setupExperiment(None, 0.0, scenario.stop_time if scenario.stop_time > 0.0 else 0.0)
+        self.compile_scenario(scenario)
 
-        for f, (vrs, vals) in scenario.real_parameters.items():
-            f.setReal(vrs, vals)
+    def cosim_steps(self, scenario: CosimScenario, status: Callable, results: CosimResults, checkpoint=None):
+        """
+        Runs the co-simulation of a scenario that has been prepared (see prepare_cosim), into initialized results.
+        Nothing runs until the generator is iterated, and the co-simulation advances one snapshot per item,
+            so that the caller can pause it, or interleave it with other work.
+        If the generator is closed before the end (e.g., the run is cancelled), the run is terminated as usual,
+            and the results keep the snapshots taken so far.
+        :param checkpoint: if given, the run continues from it.
+        :return: a generator that yields the time and the row of each snapshot, once it is taken.
+        """
+        if self.instrumentation is not None:
+            self.instrumentation.attach(self, scenario)
+        try:
+            for f in scenario.fmus:
+                f.setupExperiment(None, 0.0, scenario.stop_time if scenario.stop_time > 0.0 else 0.0)
 
-        for f in scenario.fmus:
-            f.enterInitializationMode()
+            for f, (vrs, vals) in scenario.real_parameters.items():
+                f.setReal(vrs, vals)
 
-        # TODO Support fixed point iteration initialization
-        self.propagate_initial_outputs(scenario)
+            for f in scenario.fmus:
+                f.enterInitializationMode()
 
-        for f in scenario.fmus:
-            f.exitInitializationMode()
+            self.propagate_initial_outputs(scenario)
 
-        time = 0.0
-        print_frequency = int(scenario.print_interval / scenario.step_size)
-        print_counter = print_frequency
+            for f in scenario.fmus:
+                f.exitInitializationMode()
 
-        # Take output snapshot for time 0
-        self.snapshot(time, scenario, results)
-        should_continue = self.should_continue(scenario, time)
-        while should_continue:
-            self.run_cosim_step(time, scenario)
-
-            print_counter -= 1
-            time += scenario.step_size
-            should_continue = self.should_continue(scenario, time)
-            if print_counter == 0:
-                if status is not None:
-                    status(time)
-                self.snapshot(time, scenario, results)
-                print_counter = print_frequency
+            start_tick = 0
+            if checkpoint is not None:
+                start_tick = Checkpointer.restore(checkpoint, scenario, results)
+                if checkpoint.get("runner") is not None:
+                    self.restore_state(checkpoint["runner"])
 
-        self.terminate_cosim(scenario)
+            if self.stop_plan is not None:
+                self.stop_plan.read()
 
-        return results
+            try:
+                if self.step_controller is None:
+                    yield from self.fixed_steps(scenario, status, results, start_tick)
+                else:
+                    yield from self.adaptive_steps(scenario, status, results)
+            except GeneratorExit:
+                self.terminate_cosim(scenario)
+                raise
+            else:
+                self.terminate_cosim(scenario)
+            finally:
+                # Also after an error, so that sinks that write to disk keep every snapshot taken.
+                results.close()
+        finally:
+            if self.instrumentation is not None:
+                self.instrumentation.detach()
@@ -1,25 +1,111 @@
 from enum import Enum,auto
-from typing import List, Dict, Callable, Tuple
+from typing import List, Dict, Callable, Tuple, Union
 from fmpy.fmi2 import FMU2Slave
+from fmpy.model_description import ScalarVariable
 from PyCosimLibrary.autoinit import AutoInit
 
 
 class VarType(Enum):
     REAL = auto()
     BOOL = auto()
+    INTEGER = auto()
+    STRING = auto()
 
 class SignalType(Enum):
     CONTINUOUS = auto()
     DISCONTINUOUS = auto()
 
+class VariableIndex(dict):
+    """
+    Maps the names of the variables of an FMU to their ScalarVariable, and each (type, value reference) to its name.
+    Built by FMULoader.get_vars from the model description, or with add for FMUs without one (e.g., virtual FMUs).
+    """
+    TYPE_NAMES = {VarType.REAL: "Real", VarType.BOOL: "Boolean", VarType.INTEGER: "Integer", VarType.STRING: "String"}
+
+    def __init__(self, variables: List[ScalarVariable] = ()):
+        super().__init__()
+        self.names: Dict[Tuple[str, int], str] = {}
+        for v in variables:
+            self.add_variable(v)
+
+    def add_variable(self, variable: ScalarVariable):
+        self[variable.name] = variable
+        self.names.setdefault((variable.type, variable.valueReference), variable.name)
+
+    def add(self, name: str, vr: int, value_type: VarType, causality: str = "local"):
+        self.add_variable(ScalarVariable(name=name, valueReference=vr, type=self.TYPE_NAMES[value_type],
+                                         causality=causality))
+
+    def name(self, value_type: VarType, vr: int) -> str:
+        """
+        :return: the name of the variable, or None if it is not in the index.
+        """
+        return self.names.get((self.TYPE_NAMES[value_type], vr))
+
+    def resolve(self, instance_name: str, refs: List[Union[int, str]], value_type: VarType,
+                causalities: Tuple[str, ...] = None) -> List[int]:
+        """
+        Replaces the variable names in refs by their value references. Value references are kept as they are.
+        :param instance_name: used in the error messages.
+        :param causalities: the causalities allowed for the named variables, or None to allow any.
+        :return: the value references.
+        """
+        vrs = []
+        for ref in refs:
+            if not isinstance(ref, str):
+                vrs.append(ref)
+                continue
+            variable = self.get(ref)
+            if variable is None:
+                raise ValueError(f"Invalid Scenario. Variable {instance_name}.{ref} not found.")
+            if variable.type != self.TYPE_NAMES[value_type]:
+                raise ValueError(f"Invalid Scenario. Variable {instance_name}.{ref} has type {variable.type}, "
+                                 f"expected {self.TYPE_NAMES[value_type]}.")
+            if causalities is not None and variable.causality not in causalities:
+                raise ValueError(f"Invalid Scenario. Variable {instance_name}.{ref} has causality "
+                                 f"{variable.causality}, expected one of {causalities}.")
+            vrs.append(variable.valueReference)
+        return vrs
+
+
+class RecordingPolicy(AutoInit):
+    """
+    How an output is recorded, relative to the snapshots taken every print_interval.
+    The snapshots are grouped in windows of decimation snapshots, and each window produces at most one sample,
+        with the values at the end of the window, or their aggregates over the window (e.g., ["min", "max", "mean"]).
+    With deadband, a sample is only recorded if some value changed by more than deadband since the last recorded one.
+    Abstract modes are not tracked for outputs with a recording policy.
+    """
+    decimation: int = 1
+    deadband: float = None
+    aggregates: List[str] = None
+
+
+class Reconstruction(AutoInit):
+    """
+    How the target inputs of a connection of reals are computed from the recent outputs of its source,
+        when the runner gives the time of the step (see PropagationPlan.write).
+    With "extrapolate", the polynomial of the given order through the last outputs is evaluated at the middle of the
+        step, so that the constant input is the average of the extrapolated signal over the step.
+    With "derivatives", the input is set to the value at the start of the step, and the derivatives of the polynomial
+        are set with setRealInputDerivatives, so that the FMU extrapolates it (the FMU must canInterpolateInputs).
+    """
+    METHODS = ["extrapolate", "derivatives"]
+
+    method: str = "extrapolate"
+    order: int = 1
+
+
 class Connection(AutoInit):
     value_type: VarType = None
     signal_type: SignalType = None
     quantization_tol: float = 1e-3 # Determines the different modes considered.
     source_fmu: FMU2Slave = None
     target_fmu: FMU2Slave = None
-    source_vr: List[int] = None
+    source_vr: List[int] = None  # Value references, or variable names if the scenario has a VariableIndex of the FMU.
     target_vr: List[int] = None
+    reconstruction: Reconstruction = None  # If set, the inputs are extrapolated from the history of the outputs.
+    recording: RecordingPolicy = None  # For outputs. If set, the output is recorded separately (see CosimResults.recorded).
     
     def __init__(self, **args):
         super(Connection, self).__init__(**args)
@@ -50,11 +136,16 @@ class CosimScenario(AutoInit):
     record_inputs: bool = False
     outputs: List[OutputConnection] = None
     real_parameters: Dict[FMU2Slave, Tuple[List[int], List[float]]] = {}
+    variables: Dict[FMU2Slave, VariableIndex] = None  # Used to resolve the variable names in connections and parameters.
     fmu_connections: Dict[str, Dict[int, Connection]]
 
     def __init__(self, **args):
         super().__init__(**args)
 
+        if self.variables is None:
+            self.variables = {}
+        self.resolve_names()
+
         # Build fmu connections
         self.fmu_connections = {}
         for c in self.outputs:
@@ -64,3 +155,26 @@ class CosimScenario(AutoInit):
                 if (vr in self.fmu_connections[c.source_fmu.instanceName].keys()):
                     raise ValueError(f"Connection found with duplicate value reference {vr}: {c}")
                 self.fmu_connections[c.source_fmu.instanceName][vr] = c
+
+    def resolve_refs(self, fmu: FMU2Slave, refs: List[Union[int, str]], value_type: VarType,
+                     causalities: Tuple[str, ...] = None) -> List[int]:
+        if all(not isinstance(ref, str) for ref in refs):
+            return refs
+        if fmu not in self.variables:
+            raise ValueError(f"Invalid Scenario. Variables of {fmu.instanceName} are referred to by name, "
+                             f"but the scenario has no index of its variables.")
+        return self.variables[fmu].resolve(fmu.instanceName, refs, value_type, causalities)
+
+    def resolve_names(self):
+        """
+        Replaces the variable names in connections, outputs, stop condition and parameters by value references,
+            so that the co-simulation only deals with value references.
+        """
+        for c in self.connections:
+            c.source_vr = self.resolve_refs(c.source_fmu, c.source_vr, c.value_type, ("output",))
+            if c.target_fmu is not None:
+                c.target_vr = self.resolve_refs(c.target_fmu, c.target_vr, c.value_type, ("input",))
+        for c in self.outputs + ([self.stop_condition] if self.stop_condition is not None else []):
+            c.source_vr = self.resolve_refs(c.source_fmu, c.source_vr, c.value_type)
+        self.real_parameters = {f: (self.resolve_refs(f, vrs, VarType.REAL, ("parameter", "input")), vals)
+                                for (f, (vrs, vals)) in self.real_parameters.items()}
@@ -0,0 +1,150 @@
+import heapq
+import itertools
+from typing import List, Dict
+
+from fmpy.fmi2 import FMU2Slave
+
+from PyCosimLibrary.autoinit import AutoInit
+from PyCosimLibrary.scenario import CosimScenario, Connection
+
+
+class Schedule(AutoInit):
+    """
+    Stepping order of the FMUs of a scenario, computed from its connections.
+    """
+    order: List[FMU2Slave] = None  # Order in which the FMUs should be stepped (and their outputs propagated).
+    components: List[List[FMU2Slave]] = None  # Strongly connected components, in topological order.
+    loops: List[List[FMU2Slave]] = None  # Components with a feedback loop, that need iteration to be solved exactly.
+    delayed_connections: List[Connection] = None  # Connections whose target is stepped before their source.
+
+
+def dependency_graph(fmus: List[FMU2Slave], connections: List[Connection]) -> Dict[FMU2Slave, List[FMU2Slave]]:
+    """
+    Maps each FMU to the FMUs that take its outputs as inputs.
+    """
+    graph = {f: [] for f in fmus}
+    for c in connections:
+        if c.target_fmu is not None and c.target_fmu not in graph[c.source_fmu]:
+            graph[c.source_fmu].append(c.target_fmu)
+    return graph
+
+
+def strongly_connected_components(graph: Dict[FMU2Slave, List[FMU2Slave]]) -> List[List[FMU2Slave]]:
+    """
+    Tarjan's algorithm, without recursion.
+    :return: the strongly connected components of the graph, in topological order.
+    """
+    index: Dict[FMU2Slave, int] = {}
+    low: Dict[FMU2Slave, int] = {}
+    on_stack = set()
+    stack = []
+    components = []
+
+    for root in graph.keys():
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(graph[root]))]
+        while work:
+            (node, successors) = work[-1]
+            successor = next(successors, None)
+            if successor is None:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+            elif successor not in index:
+                index[successor] = low[successor] = len(index)
+                stack.append(successor)
+                on_stack.add(successor)
+                work.append((successor, iter(graph[successor])))
+            elif successor in on_stack:
+                low[node] = min(low[node], index[successor])
+
+    # Tarjan finds the components in reverse topological order.
+    components.reverse()
+    return components
+
+
+def topological_order(components: List[List[FMU2Slave]], graph: Dict[FMU2Slave, List[FMU2Slave]],
+                      position: Dict[FMU2Slave, int]) -> List[List[FMU2Slave]]:
+    """
+    Sorts the components topologically, picking the component with the lowest position first when there is a choice.
+    """
+    component_of = {f: i for (i, component) in enumerate(components) for f in component}
+    successors = [set() for _ in components]
+    in_degree = [0] * len(components)
+    for (f, targets) in graph.items():
+        for t in targets:
+            (i, j) = (component_of[f], component_of[t])
+            if i != j and j not in successors[i]:
+                successors[i].add(j)
+                in_degree[j] += 1
+
+    ready = [(min(position[f] for f in components[i]), i) for i in range(len(components)) if in_degree[i] == 0]
+    heapq.heapify(ready)
+    result = []
+    while ready:
+        (_, i) = heapq.heappop(ready)
+        result.append(components[i])
+        for j in successors[i]:
+            in_degree[j] -= 1
+            if in_degree[j] == 0:
+                heapq.heappush(ready, (min(position[f] for f in components[j]), j))
+    return result
+
+
+def order_component(component: List[FMU2Slave], connections: List[Connection], max_permutations_size=7):
+    """
+    Orders the FMUs in a strongly connected component so that the fewest coupling values are delayed.
+    A value is delayed when its target FMU is stepped before its source FMU.
+    Small components are solved exactly, larger ones keep the given order.
+    """
+    if len(component) > max_permutations_size:
+        return component
+
+    members = set(component)
+    weights = [(c.source_fmu, c.target_fmu, len(c.source_vr)) for c in connections
+               if c.source_fmu in members and c.target_fmu in members and c.source_fmu != c.target_fmu]
+
+    def delayed(order):
+        position = {f: i for (i, f) in enumerate(order)}
+        return sum(w for (src, trg, w) in weights if position[trg] < position[src])
+
+    # Permutations are generated in lexicographic order of the given order, so ties keep the given order.
+    return list(min(itertools.permutations(component), key=delayed))
+
+
+def compute_schedule(scenario: CosimScenario) -> Schedule:
+    """
+    Computes the stepping order of the FMUs in the scenario:
+        components of the connection graph are stepped in topological order,
+        so that outputs are always propagated before the FMUs that need them are stepped.
+    Ties are broken by the order of scenario.fmus.
+    """
+    graph = dependency_graph(scenario.fmus, scenario.connections)
+    position = {f: i for (i, f) in enumerate(scenario.fmus)}
+    components = topological_order(strongly_connected_components(graph), graph, position)
+    components = [order_component(sorted(component, key=lambda f: position[f]), scenario.connections)
+                  for component in components]
+    order = [f for component in components for f in component]
+
+    order_position = {f: i for (i, f) in enumerate(order)}
+    delayed_connections = [c for c in scenario.connections if c.target_fmu is not None
+                           and order_position[c.target_fmu] <= order_position[c.source_fmu]]
+
+    loops = [component for component in components
+             if len(component) > 1 or component[0] in graph[component[0]]]
+
+    return Schedule(order=order, components=components, loops=loops, delayed_connections=delayed_connections)
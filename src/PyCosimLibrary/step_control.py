@@ -0,0 +1,65 @@
+import numpy as np
+
+from PyCosimLibrary.autoinit import AutoInit
+
+
+class AdaptiveStepController(AutoInit):
+    """
+    Controls the size of the co-simulation step from an estimate of the coupling error.
+    After a step from t to t+h, the coupling values at t+h are compared with their extrapolation
+        from the values at the previous communication points (linear if two are known, constant otherwise).
+    The difference, scaled by tol, estimates the error of feeding the FMUs with values held constant during the step.
+    Steps with error above 1 are rejected and repeated with a smaller step (unless they are already min_step).
+    """
+    min_step: float = None  # Defaults to scenario.step_size.
+    max_step: float = None  # Defaults to scenario.print_interval.
+    initial_step: float = None  # Defaults to min_step.
+    tol: float = 1e-4  # Relative and absolute tolerance of the coupling values.
+    safety: float = 0.9
+    max_growth: float = 2.0
+    max_shrink: float = 0.2
+
+    _min_step: float = None
+    _max_step: float = None
+
+    def __init__(self, **args):
+        super().__init__(**args)
+
+    def setup(self, scenario):
+        """
+        Resolves the default step bounds for the scenario.
+        :return: the size of the first step.
+        """
+        self._min_step = self.min_step if self.min_step is not None else scenario.step_size
+        self._max_step = self.max_step if self.max_step is not None else scenario.print_interval
+        return self.initial_step if self.initial_step is not None else self._min_step
+
+    def error(self, history, time: float, values: np.ndarray) -> float:
+        """
+        Estimates the error of the step ending at time.
+        :param history: list of (time, values) at the previous communication points, the most recent last.
+        :param time: end of the step.
+        :param values: the coupling values at time.
+        :return: the scaled error, which should be at most 1.
+        """
+        if len(values) == 0:
+            return 0.0
+        (t1, v1) = history[-1]
+        predicted = v1
+        if len(history) > 1:
+            (t0, v0) = history[-2]
+            predicted = v1 + (v1 - v0) * ((time - t1) / (t1 - t0))
+        return float(np.max(np.abs(values - predicted) / (self.tol + self.tol * np.abs(values))))
+
+    def next_step(self, step: float, error: float) -> float:
+        """
+        Size of the next step (or of the repeated step, if this one is rejected), between min_step and max_step.
+        """
+        if error == 0.0:
+            factor = self.max_growth
+        else:
+            factor = min(self.max_growth, max(self.max_shrink, self.safety * error ** -0.5))
+        return min(self._max_step, max(self._min_step, step * factor))
+
+    def can_reject(self, step: float) -> bool:
+        return step > self._min_step * (1.0 + 1e-9)
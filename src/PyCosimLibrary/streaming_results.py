@@ -0,0 +1,137 @@
+import json
+import os
+from typing import Dict
+
+import numpy as np
+
+from PyCosimLibrary.results import CosimResults
+
+
+class StreamingResults(CosimResults):
+    """
+    Results sink that streams the snapshots to a binary file instead of keeping them in memory.
+    Rows are buffered and appended to the file every buffer_rows snapshots,
+        so memory stays constant regardless of the length of the co-simulation.
+    The file holds the raw float64 rows, and a json file next to it holds the column index.
+    When the co-simulation finishes, the file is memory-mapped, and out_signals and timestamps become views on it.
+    During the co-simulation, size counts every snapshot taken (written or buffered), and reading the signals
+        flushes the buffered rows and maps the file as it is.
+    Since the file only grows by complete rows, and the buffered rows are flushed when a run fails,
+        the results of a crashed run can still be opened.
+    Outputs with a recording policy are not streamed: their recorders keep their (fewer) samples in memory.
+    """
+    path: str = None
+    buffer_rows: int = 1024
+    rows_written: int = 0
+    num_columns: int = None
+
+    _file = None
+    _buffered: int = 0
+    _mapped: np.ndarray = None  # The file, once memory-mapped: self.data is the buffer of rows until then.
+
+    def __init__(self, path: str, buffer_rows: int = 1024):
+        self.path = path
+        self.buffer_rows = buffer_rows
+
+    @staticmethod
+    def metadata_path(path: str):
+        return path + ".json"
+
+    def allocate(self, columns: Dict[str, Dict[int, int]], capacity: int, names: Dict[str, int] = None):
+        super().allocate(columns, self.buffer_rows, names)
+        self.num_columns = self.data.shape[1]
+        with open(self.metadata_path(self.path), "w") as f:
+            json.dump({
+                "num_columns": self.num_columns,
+                "columns": {instance: {str(vr): col for (vr, col) in vrs.items()}
+                            for (instance, vrs) in columns.items()},
+                "names": self.names
+            }, f)
+        self._file = None
+        self._buffered = 0
+        self._mapped = None
+        self.rows_written = 0
+
+    def new_row(self, time: float) -> np.ndarray:
+        if self._buffered == self.buffer_rows:
+            self.flush()
+        row = self.data[self._buffered]
+        row[0] = time
+        self._buffered += 1
+        self.size += 1
+        return row
+
+    def flush(self):
+        """
+        Appends the buffered rows to the file.
+        """
+        if self._file is None:
+            # Opened on the first flush, so that a resumed run (see restore) keeps the rows already written.
+            self._file = open(self.path, "ab" if self.rows_written > 0 else "wb")
+        self._file.write(self.data[:self._buffered].tobytes())
+        self._file.flush()
+        self.rows_written += self._buffered
+        self._buffered = 0
+
+    def close(self):
+        super().close()
+        self.flush()
+        self._file.close()
+        self._file = None
+        self.map()
+
+    def filled(self) -> np.ndarray:
+        if self._mapped is None or self._mapped.shape[0] != self.size:
+            if self._buffered > 0:
+                self.flush()
+            self._mapped = self.mapped_rows()
+        return self._mapped
+
+    def checkpoint(self) -> Dict:
+        self.flush()
+        state = self.recorders_state()
+        state["rows_written"] = self.rows_written
+        return state
+
+    def restore(self, state: Dict):
+        """
+        Continues writing after the rows that were written when the checkpoint was taken.
+        """
+        self.restore_recorders(state)
+        self.rows_written = state["rows_written"]
+        self.size = self.rows_written
+        self._mapped = None
+        self._views_size = -1
+        os.truncate(self.path, self.rows_written * 8 * self.num_columns)
+
+    def map(self):
+        """
+        Memory maps the file, so that the results can be read without loading them into memory.
+        """
+        self.data = self.mapped_rows()
+        self._mapped = self.data
+        self.size = self.rows_written
+        self._views_size = -1
+
+    def mapped_rows(self) -> np.ndarray:
+        if self.rows_written == 0:
+            return np.empty((0, self.num_columns), dtype=np.float64)
+        return np.memmap(self.path, dtype=np.float64, mode="r", shape=(self.rows_written, self.num_columns))
+
+    @staticmethod
+    def open(path: str):
+        """
+        Opens the results previously written to path, e.g., by a crashed co-simulation.
+        :param path:
+        :return: the results, memory mapped.
+        """
+        with open(StreamingResults.metadata_path(path)) as f:
+            metadata = json.load(f)
+        results = StreamingResults(path)
+        results.columns = {instance: {int(vr): col for (vr, col) in vrs.items()}
+                           for (instance, vrs) in metadata["columns"].items()}
+        results.names = metadata.get("names", {})
+        results.num_columns = metadata["num_columns"]
+        results.rows_written = os.path.getsize(path) // (8 * results.num_columns)
+        results.map()
+        return results
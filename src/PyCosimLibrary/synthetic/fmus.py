@@ -0,0 +1,119 @@
+from typing import List
+
+from fmpy.fmi2 import fmi2True, fmi2OK
+
+from PyCosimLibrary.scenario import Connection, OutputConnection, CosimScenario, VarType, SignalType, VariableIndex
+from PyCosimLibrary.virtual_fmus import VirtualFMU
+
+
+class Lag(VirtualFMU):
+    """
+    Synthetic FMU with n inputs and n outputs, where each output follows its input with a first order lag:
+        der(y[i]) = (gain * u[i] - y[i]) / tau
+    The cost of doStep grows linearly with n.
+    """
+
+    def __init__(self, instanceName, n: int, gain: float = 0.9, tau: float = 0.1):
+        self.n = n
+        self.u: List[int] = list(range(0, n))
+        self.y: List[int] = list(range(n, 2 * n))
+        self.gain = 2 * n
+        self.tau = 2 * n + 1
+        self.initial_gain = gain
+        self.initial_tau = tau
+        super().__init__(instanceName, 2 * n + 2)
+
+    def variables(self) -> VariableIndex:
+        """
+        Names of the variables: u[i] and y[i], gain and tau.
+        """
+        index = VariableIndex()
+        for (i, (u, y)) in enumerate(zip(self.u, self.y)):
+            index.add(f"u[{i}]", u, VarType.REAL, "input")
+            index.add(f"y[{i}]", y, VarType.REAL, "output")
+        index.add("gain", self.gain, VarType.REAL, "parameter")
+        index.add("tau", self.tau, VarType.REAL, "parameter")
+        return index
+
+    def reset(self):
+        super().reset()
+        self.state[self.gain] = self.initial_gain
+        self.state[self.tau] = self.initial_tau
+        for i in self.y:
+            self.state[i] = 1.0
+
+    def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
+        substeps = 10
+        h = communicationStepSize / substeps
+        s = self.state
+        (gain, tau) = (s[self.gain], s[self.tau])
+        for (ui, yi) in zip(self.u, self.y):
+            (u, y) = (s[ui], s[yi])
+            for i in range(substeps):
+                y = y + h * (gain * u - y) / tau
+            s[yi] = y
+        return fmi2OK
+
+
+class Gain(VirtualFMU):
+    """
+    Synthetic algebraic FMU, whose output follows its inputs at any time (including initialization mode):
+        y = k * sum(u) + b
+    """
+
+    def __init__(self, instanceName, inputs: int = 1, k: float = 1.0, b: float = 0.0):
+        self.u: List[int] = list(range(0, inputs))
+        self.y = inputs
+        self.k = inputs + 1
+        self.b = inputs + 2
+        self.initial_k = k
+        self.initial_b = b
+        super().__init__(instanceName, inputs + 3)
+
+    def reset(self):
+        super().reset()
+        self.state[self.k] = self.initial_k
+        self.state[self.b] = self.initial_b
+        self.update()
+
+    def update(self):
+        s = self.state
+        s[self.y] = s[self.k] * sum(s[i] for i in self.u) + s[self.b]
+
+    def setReal(self, vr, value):
+        super().setReal(vr, value)
+        self.update()
+
+
+def lag_chain(num_fmus: int, signals: int, ring: bool = False, step_size: float = 1e-3, stop_time: float = 1.0,
+              print_interval: float = 1e-2) -> CosimScenario:
+    """
+    Builds a scenario with num_fmus Lag FMUs, each feeding its signals outputs into the next one.
+    With ring, the last FMU feeds the first one, closing a loop.
+    All outputs are recorded.
+    """
+    fmus = [Lag(f"lag{i}", signals) for i in range(num_fmus)]
+    for f in fmus:
+        f.instantiate()
+
+    pairs = list(zip(fmus[:-1], fmus[1:]))
+    if ring and num_fmus > 1:
+        pairs.append((fmus[-1], fmus[0]))
+    connections = [Connection(value_type=VarType.REAL,
+                              signal_type=SignalType.CONTINUOUS,
+                              source_fmu=src,
+                              target_fmu=trg,
+                              source_vr=src.y,
+                              target_vr=trg.u) for (src, trg) in pairs]
+    outputs = [OutputConnection(value_type=VarType.REAL,
+                                signal_type=SignalType.CONTINUOUS,
+                                source_fmu=f,
+                                source_vr=f.y) for f in fmus]
+
+    return CosimScenario(fmus=fmus,
+                         connections=connections,
+                         step_size=step_size,
+                         print_interval=print_interval,
+                         stop_time=stop_time,
+                         outputs=outputs,
+                         variables={f: f.variables() for f in fmus})
@@ -1,11 +1,14 @@
+import pickle
 from typing import List
 
+import numpy as np
 from fmpy.fmi2 import FMU2Slave, fmi2OK, fmi2True
 
 
 class VirtualFMU(FMU2Slave):
     """
     Utility class to override the FMI2 C methods.
+    All variables are held in state: booleans as 0.0/1.0, and strings as they are.
     """
     state: List[float] = None
     state_size: int = 0
@@ -24,6 +27,9 @@ class VirtualFMU(FMU2Slave):
     def terminate(self):
         pass
 
+    def freeInstance(self):
+        pass
+
     def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
         return fmi2OK
 
@@ -45,8 +51,10 @@ class VirtualFMU(FMU2Slave):
         return [int(n) for n in values]
 
     def getBoolean(self, vr):
-        values = self.getReal(vr)
-        return [v > 0.5 for v in values]
+        return [self.state[v] > 0.5 for v in vr]
+
+    def getString(self, vr):
+        return [self.state[v] for v in vr]
 
     def setReal(self, vr, value):
         for i in range(len(value)):
@@ -56,10 +64,83 @@ class VirtualFMU(FMU2Slave):
         self.setReal(vr, value)
 
     def setBoolean(self, vr, value):
-        self.setReal(vr, [(1.0 if b else 0.0) for b in value])
+        for (v, b) in zip(vr, value):
+            self.state[v] = 1.0 if b else 0.0
+
+    def setString(self, vr, value):
+        self.setReal(vr, value)
 
     def getFMUstate(self):
         return self.state.copy()
 
     def setFMUstate(self, state):
         self.state = state.copy()
+
+    def freeFMUstate(self, state):
+        pass
+
+    def serializeFMUstate(self, state):
+        return pickle.dumps(state)
+
+    def deSerializeFMUstate(self, serializedState, state=None):
+        return pickle.loads(serializedState)
+
+
+class ArrayVirtualFMU(VirtualFMU):
+    """
+    Virtual FMU with the state stored in a NumPy array, so that get/set use fancy indexing,
+        and states are recorded by copying into buffers that are reused once freed.
+    With lanes > 1, the FMU holds that many independent instances, as the rows of a 2-D state (lane x variable).
+    Then, get methods return an array with one row per lane, set methods broadcast the values over the lanes,
+        and doStep should advance all lanes at once (e.g., using self.state[..., vr]).
+    FMUs with lanes are stepped directly (e.g., to advance an ensemble of surrogate models with one doStep call):
+        the runners reject them, since their propagation plans and results hold one value per variable.
+    """
+    state: np.ndarray = None
+    lanes: int = 1
+
+    def __init__(self, instanceName: str, state_size: int, lanes: int = 1):
+        self.lanes = lanes
+        self.free_states: List[np.ndarray] = []
+        super().__init__(instanceName, state_size)
+
+    def reset(self):
+        self.state = np.zeros(self.state_size if self.lanes == 1 else (self.lanes, self.state_size))
+
+    def _values(self, values: np.ndarray):
+        return values.tolist() if self.lanes == 1 else values
+
+    def getReal(self, vr):
+        return self._values(self.state[..., vr])
+
+    def getInteger(self, vr):
+        return self._values(self.state[..., vr].astype(int))
+
+    def getBoolean(self, vr):
+        return self._values(self.state[..., vr] > 0.5)
+
+    def setReal(self, vr, value):
+        self.state[..., vr] = value
+
+    def setInteger(self, vr, value):
+        self.state[..., vr] = value
+
+    def setBoolean(self, vr, value):
+        self.state[..., vr] = value
+
+    def getString(self, vr):
+        raise NotImplementedError("ArrayVirtualFMU only holds numeric variables.")
+
+    def setString(self, vr, value):
+        raise NotImplementedError("ArrayVirtualFMU only holds numeric variables.")
+
+    def getFMUstate(self):
+        state = self.free_states.pop() if len(self.free_states) > 0 else np.empty_like(self.state)
+        np.copyto(state, self.state)
+        return state
+
+    def setFMUstate(self, state):
+        np.copyto(self.state, state)
+
+    def freeFMUstate(self, state):
+        self.free_states.append(state)
@@ -1,45 +1,153 @@
+import asyncio
+import functools
+import os
+import pickle
+import tempfile
 import unittest
+import zipfile
+from pathlib import Path
 
+import numpy as np
+
+from PyCosimLibrary.acceleration import Acceleration, AitkenRelaxation, IQNILS, AndersonAcceleration
+from PyCosimLibrary.async_runner import AsyncCosim
+from PyCosimLibrary.benchmark import run_benchmarks, compare
+from PyCosimLibrary.checkpoint import Checkpointer
+from PyCosimLibrary.ensemble import EnsembleRunner, parameter_grid
+from PyCosimLibrary.fmu_cache import FMUCache
 from PyCosimLibrary.gauss_seidel_runner import GaussSeidelRunner
+from PyCosimLibrary.initialization import FixedPointInitialization
+from PyCosimLibrary.instrumentation import Instrumentation, Histogram
 from PyCosimLibrary.jacobi_runner import JacobiRunner
 from PyCosimLibrary.jacobit_it_runner import JacobiIterativeRunner
-from PyCosimLibrary.scenario import Connection, VarType, SignalType, OutputConnection, CosimScenario
+from PyCosimLibrary.modes import ModeTracker
+from PyCosimLibrary.multirate_runner import MultirateRunner
+from PyCosimLibrary.parallel_jacobi_runner import ParallelJacobiRunner
+from PyCosimLibrary.remote_fmu import CASTS, RemoteFMU
+from PyCosimLibrary.propagation_plan import PropagationPlan
+from PyCosimLibrary.results import CosimResults
+from PyCosimLibrary.streaming_results import StreamingResults
+from PyCosimLibrary.scheduler import compute_schedule
+from PyCosimLibrary.virtual_fmus import VirtualFMU, ArrayVirtualFMU
+from PyCosimLibrary.step_control import AdaptiveStepController
+from PyCosimLibrary.reconstruction import SignalHistory
+from PyCosimLibrary.scenario import Connection, VarType, SignalType, OutputConnection, CosimScenario, \
+    RecordingPolicy, Reconstruction
+from PyCosimLibrary.synthetic.fmus import Lag, Gain, lag_chain
 from PyCosimLibrary.double_msd.fmus import *
 
 
+class Decay(ArrayVirtualFMU):
+    def __init__(self, instanceName, lanes=1):
+        (self.x, self.k) = (0, 1)
+        super().__init__(instanceName, 2, lanes)
+
+    def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
+        self.state[..., self.x] *= np.exp(-self.state[..., self.k] * communicationStepSize)
+        return fmi2OK
+
+
+class Counter(VirtualFMU):
+    def __init__(self, instanceName):
+        (self.count, self.even, self.label, self.count_in, self.even_in, self.label_in) = range(6)
+        super().__init__(instanceName, 6)
+
+    def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
+        count = int(self.state[self.count]) + 1
+        self.setInteger([self.count], [count])
+        self.setBoolean([self.even], [count % 2 == 0])
+        self.setString([self.label], [f"step {count}"])
+        return fmi2OK
+
+
+class CompiledCounter(Counter):
+    """
+    Counter with the raw FMI functions of a compiled FMU, which take ctypes arrays.
+    """
+
+    def __init__(self, instanceName):
+        super().__init__(instanceName)
+        self.component = 1
+        self.raw_calls = 0
+
+    def raw_get(self, c, vr, nvr, value):
+        self.raw_calls += 1
+        for i in range(nvr):
+            value[i] = type(value[i])(self.state[vr[i]])
+
+    def raw_set(self, c, vr, nvr, value):
+        self.raw_calls += 1
+        for i in range(nvr):
+            self.state[vr[i]] = float(value[i])
+
+    fmi2GetReal = fmi2GetInteger = fmi2GetBoolean = raw_get
+    fmi2SetReal = fmi2SetInteger = fmi2SetBoolean = raw_set
+
+
+class Sine(VirtualFMU):
+    def __init__(self, instanceName):
+        self.y = 0
+        super().__init__(instanceName, 1)
+
+    def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
+        self.state[self.y] = np.sin(currentCommunicationPoint + communicationStepSize)
+        return fmi2OK
+
+
+class Integrator(VirtualFMU):
+    def __init__(self, instanceName):
+        (self.x, self.u, self.du) = (0, 1, 2)
+        super().__init__(instanceName, 3)
+
+    def setRealInputDerivatives(self, vr, order, value):
+        for (v, k, d) in zip(vr, order, value):
+            assert (v, k) == (self.u, 1)
+            self.state[self.du] = d
+
+    def doStep(self, currentCommunicationPoint, communicationStepSize, noSetFMUStatePriorToCurrentPoint=fmi2True):
+        h = communicationStepSize
+        self.state[self.x] += self.state[self.u] * h + self.state[self.du] * h * h / 2
+        return fmi2OK
+
+
+def double_msd_scenario():
+    return CosimTestSuite().build_double_msd_scenario(1.0, 1.0)
+
+
 class CosimTestSuite(unittest.TestCase):
     """Basic test cases."""
 
-    def build_double_msd_scenario(self, ce, cef):
+    def build_double_msd_scenario(self, ce, cef, fmus=None):
         msd1 = MSD1("msd1")
-        msd1.instantiate()
         msd2 = MSD2("msd2")
-        msd2.instantiate()
+        (msd1_fmu, msd2_fmu) = fmus if fmus is not None else (msd1, msd2)
+        msd1_fmu.instantiate()
+        msd2_fmu.instantiate()
 
         msd1_out = Connection(value_type=VarType.REAL,
                               signal_type=SignalType.CONTINUOUS,
-                              source_fmu=msd1,
-                              target_fmu=msd2,
+                              source_fmu=msd1_fmu,
+                              target_fmu=msd2_fmu,
                               source_vr=[msd1.x, msd1.v],
                               target_vr=[msd2.xe, msd2.ve])
         msd1_in = Connection(value_type=VarType.REAL,
                              signal_type=SignalType.CONTINUOUS,
-                             source_fmu=msd2,
-                             target_fmu=msd1,
+                             source_fmu=msd2_fmu,
+                             target_fmu=msd1_fmu,
                              source_vr=[msd2.fe],
                              target_vr=[msd1.fe])
         msd2_out = OutputConnection(value_type=VarType.REAL,
                                     signal_type=SignalType.CONTINUOUS,
-                                    source_fmu=msd2,
+                                    source_fmu=msd2_fmu,
                                     source_vr=[msd2.x, msd2.v])
 
         connections = [msd1_out, msd1_in]
         out_connections = [msd1_out, msd1_in, msd2_out]
         parameters = {
-            msd2: ([msd2.ce, msd2.cef], [ce, cef])
+            msd2_fmu: ([msd2.ce, msd2.cef], [ce, cef])
         }
         scenario = CosimScenario(
-            fmus=[msd1, msd2],
+            fmus=[msd1_fmu, msd2_fmu],
             connections=connections,
             step_size=0.01,
             print_interval=0.1,
@@ -64,6 +172,50 @@ class CosimTestSuite(unittest.TestCase):
         self.assertTrue(results.timestamps[-1] > 6.0)
         self.assertTrue(results.out_signals[msd1.instanceName][msd1.x][-1] > -1.0)
 
+    def test_run_dmsd_jacobiIt_selective_rollback(self):
+        reference = JacobiIterativeRunner(100, 1e-4).run_cosim(self.build_double_msd_scenario(1.0, 1.0), None)
+
+        runner = JacobiIterativeRunner(100, 1e-4, selective_rollback=True)
+        results = runner.run_cosim(self.build_double_msd_scenario(1.0, 1.0), None)
+
+        self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+        self.assertEqual(runner.states, {})
+
+    def test_acceleration_linear_fixed_point(self):
+        A = np.array([[0.0, 0.95], [-0.9, 0.3]])
+        b = np.array([1.0, 2.0])
+        solution = np.linalg.solve(np.eye(2) - A, b)
+
+        def iterations(acceleration):
+            acceleration.reset()
+            x = np.zeros(2)
+            for k in range(1000):
+                g = A @ x + b
+                if np.allclose(g, x, rtol=0.0, atol=1e-8):
+                    return k
+                x = acceleration.next_inputs(x, g)
+            return k
+
+        plain = iterations(Acceleration())
+        for acceleration in [AitkenRelaxation(), IQNILS(), AndersonAcceleration()]:
+            self.assertLess(iterations(acceleration), plain)
+
+        x = np.zeros(2)
+        acceleration = IQNILS()
+        for k in range(10):
+            x = acceleration.next_inputs(x, A @ x + b)
+        self.assertTrue(np.allclose(x, solution))
+
+    def test_run_dmsd_jacobiIt_accelerated(self):
+        reference = JacobiIterativeRunner(100, 1e-8).run_cosim(self.build_double_msd_scenario(1.0, 1.0), None)
+        msd1 = MSD1("msd1")
+
+        for acceleration in [AitkenRelaxation(), IQNILS(reuse=2), AndersonAcceleration()]:
+            results = JacobiIterativeRunner(100, 1e-8, acceleration=acceleration).run_cosim(
+                self.build_double_msd_scenario(1.0, 1.0), None)
+            self.assertTrue(np.allclose(results.out_signals["msd1"][msd1.x], reference.out_signals["msd1"][msd1.x],
+                                        atol=1e-6))
+
     def test_run_jacobi(self):
         scenario = self.build_double_msd_scenario(1.0, 1.0)
 
@@ -80,6 +232,36 @@ class CosimTestSuite(unittest.TestCase):
         self.assertTrue(results.timestamps[-1] > 6.0)
         self.assertTrue(results.out_signals[msd1.instanceName][msd1.x][-1] > -1.0)
 
+    def test_run_jacobi_adaptive(self):
+        scenario = self.build_double_msd_scenario(1.0, 1.0)
+        scenario.step_size = 0.001
+        fine = JacobiRunner().run_cosim(scenario, None)
+
+        steps = []
+        runner = JacobiRunner()
+        runner.step_controller = AdaptiveStepController(tol=1e-2)
+        run_cosim_step = runner.run_cosim_step
+        runner.run_cosim_step = lambda time, sc, h=None: steps.append(h) or run_cosim_step(time, sc, h)
+        scenario = self.build_double_msd_scenario(1.0, 1.0)
+        scenario.step_size = 0.001
+        results = runner.run_cosim(scenario, None)
+
+        msd1 = MSD1("msd1")
+        self.assertTrue(np.allclose(results.timestamps, fine.timestamps))
+        self.assertEqual(results.timestamps[-1], 7.0)
+        self.assertTrue(np.allclose(results.out_signals["msd1"][msd1.x], fine.out_signals["msd1"][msd1.x], atol=2e-2))
+        self.assertLess(len(steps), 7000)
+
+    def test_run_stop_condition(self):
+        for runner in [JacobiRunner(), GaussSeidelRunner(), JacobiIterativeRunner(100, 1e-4)]:
+            scenario = self.build_double_msd_scenario(1.0, 1.0)
+            msd1 = scenario.fmus[0]
+            scenario.stop_condition = OutputConnection(value_type=VarType.REAL, source_fmu=msd1, source_vr=[msd1.x])
+            results = runner.run_cosim(scenario, None)
+
+            self.assertTrue(1.0 < results.timestamps[-1] < 3.0)
+            self.assertLess(msd1.getReal([msd1.x])[0], 1e-5)
+
     def test_run_gauss_seidal(self):
         scenario = self.build_double_msd_scenario(1.0, 1.0)
 
@@ -96,6 +278,694 @@ class CosimTestSuite(unittest.TestCase):
         self.assertTrue(results.timestamps[-1] > 6.0)
         self.assertTrue(results.out_signals[msd1.instanceName][msd1.x][-1] > -1.0)
 
+    def test_results_columnar_views(self):
+        scenario = self.build_double_msd_scenario(1.0, 1.0)
+
+        results = JacobiRunner().run_cosim(scenario, lambda t: None)
+
+        msd1 = next(f for f in scenario.fmus if f.instanceName == "msd1")
+
+        signal = results.out_signals[msd1.instanceName][msd1.x]
+        self.assertEqual(len(signal), len(results.timestamps))
+        self.assertTrue(np.shares_memory(signal, results.data))
+        self.assertAlmostEqual(results.timestamps[-1], 7.0)
+
+    def test_results_grow(self):
+        results = CosimResults()
+        results.chunk_size = 4
+        results.allocate({"a": {0: 1}}, 2)
+        for i in range(10):
+            results.new_row(float(i))[1] = 2.0 * i
+
+        self.assertEqual(len(results.timestamps), 10)
+        self.assertEqual(list(results.out_signals["a"][0]), [2.0 * i for i in range(10)])
+
+    def test_streaming_results(self):
+        scenario = self.build_double_msd_scenario(1.0, 1.0)
+        msd1 = next(f for f in scenario.fmus if f.instanceName == "msd1")
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "results.bin")
+            results = JacobiRunner().run_cosim(scenario, lambda t: None, StreamingResults(path, buffer_rows=8))
+            reference = JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0), lambda t: None)
+
+            self.assertIsInstance(results.data, np.memmap)
+            self.assertTrue(np.array_equal(results.timestamps, reference.timestamps))
+            self.assertTrue(np.array_equal(results.out_signals[msd1.instanceName][msd1.x],
+                                           reference.out_signals[msd1.instanceName][msd1.x]))
+
+            reopened = StreamingResults.open(path)
+            self.assertEqual(reopened.size, results.size)
+            self.assertTrue(np.array_equal(reopened.out_signals[msd1.instanceName][msd1.x],
+                                           reference.out_signals[msd1.instanceName][msd1.x]))
+            del results, reopened
+
+            # The snapshots can be read during the run, and none is lost when the run fails.
+            crashing = StreamingResults(os.path.join(d, "crashed.bin"), buffer_rows=16)
+
+            def status(t):
+                self.assertTrue(np.array_equal(crashing.timestamps, reference.timestamps[:crashing.size]))
+                if t > 3.0:
+                    raise RuntimeError("crash")
+
+            with self.assertRaises(RuntimeError):
+                JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0), status, crashing)
+            self.assertEqual(crashing.size, 31)
+            reopened = StreamingResults.open(os.path.join(d, "crashed.bin"))
+            self.assertTrue(np.array_equal(reopened.timestamps, reference.timestamps[:31]))
+            del crashing, reopened
+
+    def test_propagation_plan_batches(self):
+        msd1 = MSD1("msd1")
+        msd2 = MSD2("msd2")
+        msd2b = MSD2("msd2b")
+        connections = [
+            Connection(value_type=VarType.REAL, source_fmu=msd1, target_fmu=msd2,
+                       source_vr=[msd1.x], target_vr=[msd2.xe]),
+            Connection(value_type=VarType.REAL, source_fmu=msd2b, target_fmu=msd2,
+                       source_vr=[msd2b.v], target_vr=[msd2.ve]),
+            Connection(value_type=VarType.REAL, source_fmu=msd1, target_fmu=msd2b,
+                       source_vr=[msd1.v, msd1.x], target_vr=[msd2b.ve, msd2b.xe]),
+        ]
+        msd1.setReal([msd1.x, msd1.v], [3.0, 4.0])
+        msd2b.setReal([msd2b.v], [5.0])
+
+        plan = PropagationPlan(connections)
+        plan.execute()
+
+        self.assertEqual(len(plan.reads), 2)
+        self.assertEqual(len(plan.writes), 2)
+        self.assertEqual(msd2.getReal([msd2.xe, msd2.ve]), [3.0, 5.0])
+        self.assertEqual(msd2b.getReal([msd2b.xe, msd2b.ve]), [3.0, 4.0])
+
+    def test_schedule(self):
+        (a, b, c) = (MSD1("a"), MSD1("b"), MSD1("c"))
+        chain = [Connection(value_type=VarType.REAL, source_fmu=a, target_fmu=b, source_vr=[a.x], target_vr=[b.fe]),
+                 Connection(value_type=VarType.REAL, source_fmu=b, target_fmu=c, source_vr=[b.x], target_vr=[c.fe])]
+        schedule = compute_schedule(CosimScenario(fmus=[c, b, a], connections=chain, outputs=[]))
+        self.assertEqual(schedule.order, [a, b, c])
+        self.assertEqual(schedule.loops, [])
+        self.assertEqual(schedule.delayed_connections, [])
+
+        scenario = self.build_double_msd_scenario(1.0, 1.0)
+        schedule = compute_schedule(scenario)
+        self.assertEqual(len(schedule.loops), 1)
+        self.assertEqual(len(schedule.delayed_connections), 1)
+
+    def test_run_parallel_jacobi(self):
+        reference = JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0), lambda t: None)
+
+        runner = ParallelJacobiRunner(max_workers=2)
+        results = runner.run_cosim(self.build_double_msd_scenario(1.0, 1.0), lambda t: None)
+        self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+
+        fmus = (RemoteFMU("msd1", functools.partial(MSD1, "msd1")), RemoteFMU("msd2", functools.partial(MSD2, "msd2")))
+        try:
+            results = runner.run_cosim(self.build_double_msd_scenario(1.0, 1.0, fmus), lambda t: None)
+        finally:
+            runner.shutdown()
+            for f in fmus:
+                f.freeInstance()
+        self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+
+    def test_run_remote_fmus(self):
+        reference = JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0), lambda t: None)
+
+        fmus = (RemoteFMU("msd1", functools.partial(MSD1, "msd1")), RemoteFMU("msd2", functools.partial(MSD2, "msd2")))
+        try:
+            scenario = self.build_double_msd_scenario(1.0, 1.0, fmus)
+            results = JacobiIterativeRunner(100, 1e-4).run_cosim(scenario, lambda t: None)
+            for f in fmus:
+                f.reset()
+            jacobi_results = JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0, fmus), lambda t: None)
+        finally:
+            for f in fmus:
+                f.freeInstance()
+
+        self.assertTrue(results.timestamps[-1] > 6.0)
+        self.assertTrue(np.array_equal(jacobi_results.data[:jacobi_results.size], reference.data[:reference.size]))
+
+        class CountingRemoteFMU(RemoteFMU):
+            def __init__(self, *args):
+                super().__init__(*args)
+                self.gets = 0
+
+            def _command(self, code, key=0):
+                if code in CASTS:
+                    self.gets += 1
+                super()._command(code, key)
+
+        fmus = (CountingRemoteFMU("msd1", functools.partial(MSD1, "msd1")),
+                CountingRemoteFMU("msd2", functools.partial(MSD2, "msd2")))
+        try:
+            results = JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0, fmus), lambda t: None)
+        finally:
+            for f in fmus:
+                f.freeInstance()
+
+        self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+        # The outputs read to propagate them (700 steps) are read along with each doStep,
+        # only the snapshots (read after setting the inputs) need a round trip.
+        for f in fmus:
+            self.assertLess(f.gets, 2 * results.size)
+
+    def test_run_ensemble(self):
+        msd2 = MSD2("msd2")
+        members = parameter_grid({("msd2", msd2.ce): [0.5, 2.0], ("msd2", msd2.cef): [1.0, 3.0]})
+        self.assertEqual(len(members), 4)
+
+        references = []
+        for member in members:
+            scenario = double_msd_scenario()
+            (vrs, vals) = member["msd2"]
+            scenario.real_parameters = {scenario.fmus[1]: (vrs, vals)}
+            results = JacobiRunner().run_cosim(scenario, None)
+            references.append(results.data[:results.size])
+
+        for processes in [0, 2]:
+            ensemble = EnsembleRunner(double_msd_scenario, JacobiRunner, processes=processes).run(members)
+            self.assertEqual(ensemble.data.shape[0], 4)
+            for (i, reference) in enumerate(references):
+                self.assertTrue(np.array_equal(ensemble.data[i], reference))
+        self.assertFalse(np.array_equal(references[0], references[3]))
+
+    def test_array_virtual_fmu(self):
+        lanes = Decay("lanes", lanes=3)
+        lanes.setReal([lanes.x], [1.0])
+        lanes.setReal([lanes.k], np.array([[0.5], [1.0], [2.0]]))
+        state = lanes.getFMUstate()
+        lanes.doStep(0.0, 1.0)
+        self.assertTrue(np.allclose(lanes.getReal([lanes.x])[:, 0], np.exp([-0.5, -1.0, -2.0])))
+
+        lanes.setFMUstate(state)
+        lanes.freeFMUstate(state)
+        self.assertTrue(np.array_equal(lanes.getReal([lanes.x, lanes.k]), [[1.0, 0.5], [1.0, 1.0], [1.0, 2.0]]))
+        self.assertIs(lanes.getFMUstate(), state)
+
+        # The runners only co-simulate FMUs with one lane.
+        single = Decay("single")
+        connection = Connection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS, source_fmu=lanes,
+                                target_fmu=single, source_vr=[lanes.x], target_vr=[single.k])
+        scenario = CosimScenario(fmus=[lanes, single], connections=[connection], outputs=[], step_size=0.1,
+                                 print_interval=0.1, stop_time=1.0)
+        with self.assertRaises(ValueError):
+            JacobiRunner().run_cosim(scenario, None)
+
+        single = Decay("single")
+        single.setReal([single.x, single.k], [1.0, 2.0])
+        single.doStep(0.0, 1.0)
+        self.assertEqual(single.getReal([single.k, single.x]), [2.0, np.exp(-2.0)])
+        self.assertEqual(single.getBoolean([single.k]), [True])
+
+    def test_run_lag_ring(self):
+        reference = None
+        for runner in [JacobiRunner(), GaussSeidelRunner(), JacobiIterativeRunner(100, 1e-8)]:
+            scenario = lag_chain(3, 2, ring=True, stop_time=0.5)
+            results = runner.run_cosim(scenario, None)
+            last = results.out_signals["lag2"][scenario.fmus[2].y[0]][-1]
+            self.assertTrue(0.0 < last < 1.0)
+            if reference is not None:
+                self.assertAlmostEqual(last, reference, places=2)
+            reference = last
+
+    def test_benchmark(self):
+        cases = run_benchmarks([2], [1], 10, ["jacobi"])
+        self.assertEqual(len(cases), 2)
+        self.assertTrue(all(c["steps_per_second"] > 0 for c in cases))
+        slower = [dict(c, steps_per_second=c["steps_per_second"] / 2) for c in cases]
+        self.assertEqual(len(compare(slower, cases, 0.2)), 2)
+        self.assertEqual(len(compare(cases, slower, 0.2)), 0)
+
+    def test_instrumentation(self):
+        runner = JacobiIterativeRunner(100, 1e-8)
+        runner.instrumentation = Instrumentation(trace=True)
+        scenario = lag_chain(3, 2, ring=True, stop_time=0.1)
+        runner.run_cosim(scenario, None)
+
+        stats = {row["name"]: row for row in runner.instrumentation.summary()}
+        self.assertEqual(stats["run_cosim_step"]["calls"], 100)
+        self.assertEqual(stats["iterations"]["calls"], 100)
+        self.assertEqual(stats["doStep[lag0]"]["calls"], stats["iterations"]["total"])
+        self.assertGreater(runner.instrumentation.counters["rollbacks"], 0)
+        self.assertIn("plan.read", runner.instrumentation.summary_table())
+        self.assertEqual(len(runner.instrumentation.chrome_trace()["traceEvents"]), len(runner.instrumentation.events))
+
+        # The timed methods are removed after the run.
+        self.assertNotIn("doStep", scenario.fmus[0].__dict__)
+        self.assertNotIn("run_cosim_step", runner.__dict__)
+
+        # Every phase is measured by the usual runners.
+        for runner in [JacobiRunner(), GaussSeidelRunner()]:
+            runner.instrumentation = Instrumentation()
+            runner.run_cosim(lag_chain(3, 2, stop_time=0.1), None)
+            names = {row["name"] for row in runner.instrumentation.summary()}
+            self.assertTrue(all(phase in names for phase in Instrumentation.RUNNER_PHASES
+                                if hasattr(runner, phase)))
+
+        histogram = Histogram()
+        values = np.random.default_rng(0).lognormal(-9.0, 1.0, 10000)
+        for v in values:
+            histogram.add(v)
+        self.assertAlmostEqual(histogram.total, values.sum())
+        self.assertEqual(histogram.maximum, values.max())
+        for q in [50, 90, 99]:
+            self.assertLess(abs(histogram.percentile(q) / np.percentile(values, q) - 1.0), 0.07)
+
+    def test_fmu_cache(self):
+        model_description = """<?xml version="1.0" encoding="UTF-8"?>
+<fmiModelDescription fmiVersion="2.0" modelName="{0}" guid="{{{0}}}">
+  <CoSimulation modelIdentifier="{0}"/>
+  <ModelVariables>
+    <ScalarVariable name="x" valueReference="0" causality="output"><Real/></ScalarVariable>
+  </ModelVariables>
+  <ModelStructure><Outputs><Unknown index="1"/></Outputs></ModelStructure>
+</fmiModelDescription>"""
+        with tempfile.TemporaryDirectory() as d:
+            paths = []
+            for name in ["a", "b", "c"]:
+                paths.append(os.path.join(d, f"{name}.fmu"))
+                with zipfile.ZipFile(paths[-1], "w") as z:
+                    z.writestr("modelDescription.xml", model_description.format(name))
+
+            cache = FMUCache(os.path.join(d, "cache"), max_entries=2)
+            first = cache.acquire(paths[0])
+            self.assertIs(cache.acquire(paths[0]), first)
+            self.assertEqual(first.model_description.guid, "{a}")
+            self.assertTrue(os.path.exists(os.path.join(first.dir, "modelDescription.xml")))
+
+            # Another process finds the extraction on disk.
+            other_cache = FMUCache(os.path.join(d, "cache"), max_entries=2)
+            other = other_cache.acquire(paths[0])
+            self.assertEqual(other.dir, first.dir)
+            self.assertEqual(other.model_description.modelName, "a")
+
+            def entries():
+                return sorted(p for p in os.listdir(os.path.join(d, "cache")) if "." not in p)
+
+            for _ in range(2):
+                cache.release(first)
+            # Still held by the other process.
+            cache.release(cache.acquire(paths[1]))
+            cache.release(cache.acquire(paths[2]))
+            self.assertIn(cache.key(Path(paths[0])), entries())
+            self.assertTrue(os.path.exists(os.path.join(other.dir, "modelDescription.xml")))
+
+            other_cache.release(other)
+            cache.release(cache.acquire(paths[1]))
+            self.assertEqual(entries(), sorted([cache.key(Path(p)) for p in paths[1:]]))
+
+            # An entry in use is never evicted, even beyond max_entries.
+            (a, b) = (FMUCache(os.path.join(d, "small"), max_entries=1), FMUCache(os.path.join(d, "small"), 1))
+            held = b.acquire(paths[0])
+            a.acquire(paths[1])
+            self.assertTrue(os.path.isdir(held.dir))
+            self.assertIs(b.acquire(paths[0]), held)
+
+    def test_variable_names(self):
+        def build(names: bool):
+            (lag0, lag1) = (Lag("lag0", 2), Lag("lag1", 2))
+            for f in [lag0, lag1]:
+                f.instantiate()
+            ref = (lambda name, vr: name) if names else (lambda name, vr: vr)
+            connection = Connection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                    source_fmu=lag0, target_fmu=lag1,
+                                    source_vr=[ref("y[1]", lag0.y[1])], target_vr=[ref("u[0]", lag1.u[0])])
+            output = OutputConnection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS, source_fmu=lag1,
+                                      source_vr=[ref("y[0]", lag1.y[0]), ref("tau", lag1.tau)])
+            return CosimScenario(fmus=[lag0, lag1], connections=[connection], outputs=[output], stop_time=0.1,
+                                 real_parameters={lag1: ([ref("tau", lag1.tau)], [0.5])},
+                                 variables={lag0: lag0.variables(), lag1: lag1.variables()})
+
+        scenario = build(True)
+        self.assertEqual(scenario.connections[0].target_vr, [0])
+        self.assertEqual(scenario.real_parameters[scenario.fmus[1]][0], [5])
+        results = JacobiRunner().run_cosim(scenario, None)
+        reference = JacobiRunner().run_cosim(build(False), None)
+        self.assertTrue(np.array_equal(results.signal("lag1.y[0]"), reference.out_signals["lag1"][2]))
+        self.assertTrue(np.all(results.signal("lag1.tau") == 0.5))
+
+        lag = Lag("lag", 1)
+        for (refs, value_type, causalities) in [(["y[1]"], VarType.REAL, None), (["y[0]"], VarType.BOOL, None),
+                                                (["y[0]"], VarType.REAL, ("input",))]:
+            with self.assertRaises(ValueError):
+                lag.variables().resolve("lag", refs, value_type, causalities)
+
+    def test_run_mixed_types(self):
+        for runner in [JacobiRunner(), GaussSeidelRunner(), JacobiIterativeRunner(10, 1e-8)]:
+            (a, b) = (Counter("a"), Counter("b"))
+            connections = [Connection(value_type=value_type, signal_type=SignalType.DISCONTINUOUS,
+                                      source_fmu=src, target_fmu=trg, source_vr=[src_vr], target_vr=[trg_vr])
+                           for (src, trg) in [(a, b), (b, a)]
+                           for (value_type, src_vr, trg_vr) in [(VarType.INTEGER, a.count, a.count_in),
+                                                                (VarType.BOOL, a.even, a.even_in),
+                                                                (VarType.STRING, a.label, a.label_in)]]
+            outputs = [OutputConnection(value_type=VarType.INTEGER, signal_type=SignalType.DISCONTINUOUS,
+                                        source_fmu=b, source_vr=[b.count_in]),
+                       OutputConnection(value_type=VarType.BOOL, signal_type=SignalType.DISCONTINUOUS,
+                                        source_fmu=a, source_vr=[a.even_in])]
+            scenario = CosimScenario(fmus=[a, b], connections=connections, outputs=outputs, step_size=0.01,
+                                     print_interval=0.01, stop_time=0.1)
+            results = runner.run_cosim(scenario, None)
+
+            self.assertEqual(results.out_signals["b"][b.count_in].tolist(), list(range(11)))
+            self.assertEqual(results.out_signals["a"][a.even_in].tolist(), [i % 2 == 0 and i > 0 for i in range(11)])
+            self.assertEqual(b.getString([b.label_in]), ["step 10"])
+
+    def test_raw_transfers(self):
+        (a, b) = (CompiledCounter("a"), CompiledCounter("b"))
+        a.state[:2] = [3.0, 1.0]
+        # The write to a picks non contiguous values, which go through a staging array.
+        plan = PropagationPlan([Connection(value_type=VarType.REAL, source_fmu=a, target_fmu=b,
+                                           source_vr=[a.count, a.even], target_vr=[b.count_in, b.even_in]),
+                                Connection(value_type=VarType.REAL, source_fmu=a, target_fmu=a,
+                                           source_vr=[a.even, a.count], target_vr=[a.count_in, a.even_in]),
+                                Connection(value_type=VarType.BOOL, source_fmu=b, target_fmu=a,
+                                           source_vr=[b.count_in], target_vr=[a.even])])
+        self.assertEqual((len(plan._reads), len(plan._writes)), (0, 0))
+        plan.execute()
+        self.assertTrue(np.array_equal(plan.buffers[VarType.REAL], [3.0, 1.0]))
+        self.assertTrue(np.array_equal(plan.buffers[VarType.BOOL], [False]))
+        self.assertEqual(b.state[b.count_in:b.even_in + 1], [3.0, 1.0])
+        self.assertEqual(a.state[a.count_in:a.even_in + 1], [1.0, 3.0])
+        self.assertEqual(a.state[a.even], 0.0)
+
+        reference = None
+        for compiled in [False, True]:
+            (a, b) = (CompiledCounter("a"), CompiledCounter("b")) if compiled else (Counter("a"), Counter("b"))
+            connections = [Connection(value_type=value_type, signal_type=SignalType.DISCONTINUOUS,
+                                      source_fmu=src, target_fmu=trg, source_vr=[src_vr], target_vr=[trg_vr])
+                           for (src, trg) in [(a, b), (b, a)]
+                           for (value_type, src_vr, trg_vr) in [(VarType.INTEGER, a.count, a.count_in),
+                                                                (VarType.BOOL, a.even, a.even_in),
+                                                                (VarType.STRING, a.label, a.label_in)]]
+            outputs = [OutputConnection(value_type=VarType.INTEGER, signal_type=SignalType.DISCONTINUOUS,
+                                        source_fmu=f, source_vr=[f.count_in, f.count]) for f in [a, b]]
+            scenario = CosimScenario(fmus=[a, b], connections=connections, outputs=outputs, step_size=0.01,
+                                     print_interval=0.01, stop_time=0.1)
+            results = GaussSeidelRunner().run_cosim(scenario, None)
+            if compiled:
+                self.assertGreater(a.raw_calls, 0)
+                self.assertTrue(np.array_equal(results.data[:results.size], reference))
+                self.assertEqual(b.getString([b.label_in]), ["step 10"])
+            reference = results.data[:results.size].copy()
+
+    def test_mode_tracker(self):
+        timestamps = np.arange(6) * 0.5
+        tracker = ModeTracker([1, 2], [1e-3, 0.5])
+        for (x, y) in [(0.0, 1.0), (0.0, 1.2), (1.0, 1.4), (1.0, 2.1), (0.0, 2.0), (0.0, 2.0)]:
+            tracker.update(np.array([0.0, x, y]))
+        self.assertEqual(tracker.events[:tracker.size].tolist(),
+                         [(0, 1, 0.0), (0, 2, 1.0), (2, 1, 1.0), (3, 2, 2.1), (4, 1, 0.0)])
+        self.assertEqual(tracker.mode_at(1, timestamps, 1.2), 1.0)
+        self.assertEqual(tracker.mode_at(2, timestamps, 1.2), 1.0)
+        (modes, durations) = tracker.durations(1, timestamps)
+        self.assertEqual(modes.tolist(), [0.0, 1.0, 0.0])
+        self.assertTrue(np.allclose(durations, [1.0, 1.0, 0.5]))
+
+        (a, b) = (Counter("a"), Counter("b"))
+        output = OutputConnection(value_type=VarType.BOOL, signal_type=SignalType.DISCONTINUOUS,
+                                  source_fmu=a, source_vr=[a.even])
+        scenario = CosimScenario(fmus=[a, b], connections=[], outputs=[output], step_size=0.01,
+                                 print_interval=0.02, stop_time=0.1)
+        results = JacobiRunner().run_cosim(scenario, None)
+        self.assertEqual(results.abstract_modes, {"a": {a.even: [0.0, 1.0]}})
+        self.assertEqual(results.mode_at("a", a.even, 0.01), 0.0)
+        self.assertTrue(np.allclose(results.mode_durations("a", a.even)[1], [0.02, 0.08]))
+
+    def test_recording_policies(self):
+        (a, b) = (Counter("a"), Counter("b"))
+        outputs = [OutputConnection(value_type=VarType.BOOL, signal_type=SignalType.DISCONTINUOUS,
+                                    source_fmu=a, source_vr=[a.even]),
+                   OutputConnection(value_type=VarType.INTEGER, signal_type=SignalType.DISCONTINUOUS,
+                                    source_fmu=a, source_vr=[a.count],
+                                    recording=RecordingPolicy(decimation=3, aggregates=["min", "max", "mean"])),
+                   OutputConnection(value_type=VarType.INTEGER, signal_type=SignalType.DISCONTINUOUS,
+                                    source_fmu=b, source_vr=[b.count], recording=RecordingPolicy(deadband=1.5)),
+                   OutputConnection(value_type=VarType.BOOL, signal_type=SignalType.DISCONTINUOUS,
+                                    source_fmu=b, source_vr=[b.even], recording=RecordingPolicy(decimation=4))]
+        scenario = CosimScenario(fmus=[a, b], connections=[], outputs=outputs, step_size=0.01,
+                                 print_interval=0.01, stop_time=0.1)
+        results = JacobiRunner().run_cosim(scenario, None)
+
+        self.assertEqual(results.data.shape[1], 2)
+        self.assertEqual(len(results.timestamps), 11)
+        # The last window (0.09 and 0.1) is incomplete, and recorded at the end of the run.
+        (times, minimum) = results.recorded("a", a.count, "min")
+        self.assertTrue(np.allclose(times, [0.02, 0.05, 0.08, 0.1]))
+        self.assertEqual(minimum.tolist(), [0, 3, 6, 9])
+        self.assertEqual(results.recorded("a", a.count, "max")[1].tolist(), [2, 5, 8, 10])
+        self.assertEqual(results.recorded("a", a.count, "mean")[1].tolist(), [1, 4, 7, 9.5])
+        (times, count) = results.recorded("b", b.count)
+        self.assertEqual(count.tolist(), [0, 2, 4, 6, 8, 10])
+        self.assertTrue(np.allclose(times, [0.0, 0.02, 0.04, 0.06, 0.08, 0.1]))
+        # b counts like a, whose even output is in column 1.
+        (times, even) = results.recorded("b", b.even)
+        self.assertTrue(np.allclose(times, [0.03, 0.07, 0.1]))
+        self.assertEqual(even.tolist(), [results.data[i, 1] for i in [3, 7, 10]])
+
+    def test_checkpoint_resume(self):
+        reference = JacobiRunner().run_cosim(self.build_double_msd_scenario(1.0, 1.0), None)
+
+        def preempted(t):
+            if t > 3.0:
+                raise KeyboardInterrupt()
+
+        with tempfile.TemporaryDirectory() as d:
+            for results_factory in [lambda: None, lambda: StreamingResults(os.path.join(d, "results.bin"))]:
+                runner = JacobiRunner()
+                runner.checkpointer = Checkpointer(os.path.join(d, "checkpoint"), interval=0.0)
+                with self.assertRaises(KeyboardInterrupt):
+                    runner.run_cosim(self.build_double_msd_scenario(1.0, 1.0), preempted, results_factory())
+
+                self.assertEqual(Checkpointer.read(os.path.join(d, "checkpoint"))["tick"], 300)
+                with open(os.path.join(d, "checkpoint"), "rb") as f:
+                    # The snapshots are not in the checkpoint: in-memory results append them to the rows file.
+                    self.assertNotIn("data", pickle.load(f)["results"])
+                results = JacobiRunner().resume_cosim(self.build_double_msd_scenario(1.0, 1.0), None,
+                                                      os.path.join(d, "checkpoint"), results_factory())
+                self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+                del results
+
+    def test_run_multirate(self):
+        for (runner, gauss_seidel) in [(JacobiRunner(), False), (GaussSeidelRunner(), True)]:
+            reference = runner.run_cosim(self.build_double_msd_scenario(1.0, 1.0), None)
+            results = MultirateRunner({}, gauss_seidel).run_cosim(self.build_double_msd_scenario(1.0, 1.0), None)
+            self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+
+        errors = {}
+        for reconstruction in ["hold", "interpolate"]:
+            scenario = self.build_double_msd_scenario(1.0, 1.0)
+            runner = MultirateRunner({scenario.fmus[1]: 0.05}, gauss_seidel=True, reconstruction=reconstruction)
+            runner.instrumentation = Instrumentation()
+            results = runner.run_cosim(scenario, None)
+            calls = {row["name"]: row["calls"] for row in runner.instrumentation.summary()}
+            self.assertEqual((calls["doStep[msd1]"], calls["doStep[msd2]"]), (700, 140))
+            # Error in the outputs of the fast FMU (msd1), compared with both FMUs stepped at the base step size.
+            errors[reconstruction] = np.abs(results.data[:results.size, 1:3] -
+                                            reference.data[:reference.size, 1:3]).max()
+        self.assertLess(errors["interpolate"], errors["hold"])
+        self.assertLess(errors["interpolate"], 0.02)
+
+        for step_size in [0.025, 0.07]:
+            with self.assertRaises(ValueError):
+                scenario = self.build_double_msd_scenario(1.0, 1.0)
+                MultirateRunner({scenario.fmus[1]: step_size}).run_cosim(scenario, None)
+
+        # The last step of the slow FMU is shortened to end at stop_time.
+        scenario = self.build_double_msd_scenario(1.0, 1.0)
+        scenario.stop_time = 7.03
+        msd2 = scenario.fmus[1]
+        steps = []
+        do_step = msd2.doStep
+        msd2.doStep = lambda time, step_size, *args: steps.append((time, step_size)) or do_step(time, step_size)
+        MultirateRunner({msd2: 0.05}).run_cosim(scenario, None)
+        self.assertTrue(np.allclose(steps[-1], (7.0, 0.03)))
+
+        # The histories interpolated by the fast FMU after resuming are kept in the checkpoint.
+        def preempted(t):
+            if t > 3.0:
+                raise KeyboardInterrupt()
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "checkpoint")
+            for step_size in [0.05, 0.1]:
+                def run(status=None, resume=False):
+                    scenario = self.build_double_msd_scenario(1.0, 1.0)
+                    runner = MultirateRunner({scenario.fmus[1]: step_size}, gauss_seidel=True,
+                                             reconstruction="interpolate")
+                    if resume:
+                        return runner.resume_cosim(scenario, None, path)
+                    if status is not None:
+                        runner.checkpointer = Checkpointer(path, interval=0.0)
+                    return runner.run_cosim(scenario, status)
+
+                reference = run()
+                with self.assertRaises(KeyboardInterrupt):
+                    run(preempted)
+                results = run(resume=True)
+                self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+
+    def test_reconstruction(self):
+        errors = {}
+        for (name, reconstruction) in [("hold", None), ("extrapolate", Reconstruction(order=1)),
+                                       ("derivatives", Reconstruction(method="derivatives", order=1))]:
+            for runner in [JacobiRunner(), GaussSeidelRunner()]:
+                (sine, integrator) = (Sine("sine"), Integrator("integrator"))
+                connection = Connection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                        source_fmu=sine, target_fmu=integrator, source_vr=[sine.y],
+                                        target_vr=[integrator.u], reconstruction=reconstruction)
+                output = OutputConnection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                          source_fmu=integrator, source_vr=[integrator.x])
+                scenario = CosimScenario(fmus=[sine, integrator], connections=[connection], outputs=[output],
+                                         step_size=0.1, print_interval=0.1, stop_time=5.0)
+                results = runner.run_cosim(scenario, None)
+                exact = 1.0 - np.cos(results.timestamps)
+                errors[(name, type(runner))] = np.abs(results.out_signals["integrator"][integrator.x] - exact).max()
+
+        for runner in [JacobiRunner, GaussSeidelRunner]:
+            self.assertLess(errors[("extrapolate", runner)], errors[("hold", runner)] / 5)
+            self.assertLess(errors[("derivatives", runner)], errors[("hold", runner)] / 5)
+
+        # Resuming from a checkpoint restores the histories.
+        def preempted(t):
+            if t > 2.0:
+                raise KeyboardInterrupt()
+
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "checkpoint")
+            for runner_class in [JacobiRunner, GaussSeidelRunner]:
+                for status in [None, preempted, None]:
+                    (sine, integrator) = (Sine("sine"), Integrator("integrator"))
+                    connection = Connection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                            source_fmu=sine, target_fmu=integrator, source_vr=[sine.y],
+                                            target_vr=[integrator.u], reconstruction=Reconstruction(order=2))
+                    output = OutputConnection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                              source_fmu=integrator, source_vr=[integrator.x])
+                    scenario = CosimScenario(fmus=[sine, integrator], connections=[connection], outputs=[output],
+                                             step_size=0.1, print_interval=0.1, stop_time=5.0)
+                    runner = runner_class()
+                    if status is None and os.path.exists(path):
+                        results = runner.resume_cosim(scenario, None, path)
+                        self.assertTrue(np.array_equal(results.data[:results.size], reference))
+                        os.remove(path)
+                    elif status is None:
+                        results = runner.run_cosim(scenario, None)
+                        reference = results.data[:results.size].copy()
+                    else:
+                        runner.checkpointer = Checkpointer(path, interval=0.0)
+                        with self.assertRaises(KeyboardInterrupt):
+                            runner.run_cosim(scenario, status)
+
+                for runner in [JacobiIterativeRunner(10, 1e-8), MultirateRunner({})]:
+                    with self.assertRaises(ValueError):
+                        runner.run_cosim(scenario, None)
+
+        history = SignalHistory(1, 3)
+        for t in [0.0, 1.0, 2.0]:
+            history.push(t, [t * t])
+        self.assertAlmostEqual(history.extrapolate(3.0, 2)[0], 9.0)
+        self.assertTrue(np.allclose([d[0] for d in history.derivatives(3.0, 2)], [9.0, 6.0, 2.0]))
+        self.assertEqual(history.hold(1.5)[0], 1.0)
+        self.assertEqual(history.interpolate(1.5)[0], 2.5)
+
+    def test_fixed_point_initialization(self):
+        def loop_scenario(k1, k2):
+            # source -> g1 <-> g2: y1 = k1 * (3 + y2) + 1, y2 = k2 * y1 - 1
+            (source, g1, g2) = (Gain("source", b=3.0), Gain("g1", inputs=2, k=k1, b=1.0), Gain("g2", k=k2, b=-1.0))
+            connections = [Connection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                      source_fmu=src, target_fmu=trg, source_vr=[src.y], target_vr=[u])
+                           for (src, trg, u) in [(source, g1, g1.u[0]), (g2, g1, g1.u[1]), (g1, g2, g2.u[0])]]
+            outputs = [OutputConnection(value_type=VarType.REAL, signal_type=SignalType.CONTINUOUS,
+                                        source_fmu=g, source_vr=[g.y]) for g in [g1, g2]]
+            scenario = CosimScenario(fmus=[g2, g1, source], connections=connections, outputs=outputs,
+                                     step_size=0.1, print_interval=0.1, stop_time=0.1)
+            y1 = (3.0 * k1 + 1.0 - k1) / (1.0 - k1 * k2)
+            return scenario, y1, k2 * y1 - 1.0
+
+        for (method, k1, k2, max_iterations) in [("fixed_point", 0.5, 0.5, 40), ("broyden", 0.5, 0.5, 5),
+                                                 ("newton", 0.5, 0.5, 2), ("broyden", 2.0, 0.9, 5),
+                                                 ("newton", 2.0, 0.9, 2)]:
+            (scenario, y1, y2) = loop_scenario(k1, k2)
+            runner = JacobiRunner()
+            runner.initialization = FixedPointInitialization(method=method)
+            results = runner.run_cosim(scenario, None)
+            self.assertAlmostEqual(results.out_signals["g1"][scenario.fmus[1].y][0], y1, places=6)
+            self.assertAlmostEqual(results.out_signals["g2"][scenario.fmus[0].y][0], y2, places=6)
+            self.assertEqual(len(runner.initialization.iterations), 1)
+            self.assertLessEqual(runner.initialization.iterations[0], max_iterations)
+
+        # Without initialization, the inputs only see the outputs of a single propagation.
+        (scenario, y1, _) = loop_scenario(0.5, 0.5)
+        results = JacobiRunner().run_cosim(scenario, None)
+        self.assertNotAlmostEqual(results.out_signals["g1"][scenario.fmus[1].y][0], y1, places=3)
+
+        # The fixed point iteration diverges when the loop gain is above 1.
+        (scenario, y1, _) = loop_scenario(2.0, 0.9)
+        initialization = FixedPointInitialization(max_iterations=20)
+        for f in scenario.fmus:
+            f.instantiate()
+        initialization.initialize(scenario)
+        self.assertEqual(initialization.iterations, [20])
+
+    def test_run_async(self):
+        reference = JacobiRunner().run_cosim(lag_chain(2, 2, stop_time=0.5), None)
+
+        async def consume(cosim: AsyncCosim, received: list, delay: float = 0.0):
+            async for (time, row) in cosim:
+                # The run never gets ahead of the consumer by more than the queue and a batch.
+                self.assertLessEqual(cosim.results.size,
+                                     len(received) + 1 + cosim.queue_size + cosim.snapshots_per_batch)
+                received.append((time, row))
+                await asyncio.sleep(delay)
+            return cosim.results
+
+        async def main():
+            cosims = [AsyncCosim(JacobiRunner(), lag_chain(2, 2, stop_time=0.5), snapshots_per_batch=batch,
+                                 queue_size=2) for batch in [1, 3, 100]]
+            received = [[] for _ in cosims]
+            all_results = await asyncio.gather(*[consume(c, r, 1e-3) for (c, r) in zip(cosims, received)])
+            for (results, snapshots) in zip(all_results, received):
+                self.assertEqual(len(snapshots), reference.size)
+                self.assertTrue(np.array_equal(np.array([row for (_, row) in snapshots]),
+                                               reference.data[:reference.size]))
+                self.assertTrue(np.array_equal(results.data[:results.size], reference.data[:reference.size]))
+
+            self.assertEqual((await AsyncCosim(JacobiRunner(), lag_chain(2, 2, stop_time=0.5)).run()).size,
+                             reference.size)
+
+            # Cancelling the consumer stops the run, and terminates it.
+            runner = JacobiRunner()
+            terminated = []
+            runner.terminate_cosim = lambda scenario: terminated.append(True)
+            cosim = AsyncCosim(runner, lag_chain(2, 2, stop_time=100.0), queue_size=1)
+            stalled = asyncio.Event()
+
+            async def stall():
+                async with cosim:
+                    async for _ in cosim:
+                        if cosim.queue.empty() and not stalled.is_set():
+                            stalled.set()
+                            await asyncio.Event().wait()
+
+            task = asyncio.ensure_future(stall())
+            await stalled.wait()
+            for _ in range(100):
+                if cosim.queue.full():
+                    break
+                await asyncio.sleep(1e-3)
+            # The run waits for the consumer: one snapshot in the queue, and one waiting to be put in it.
+            size = cosim.results.size
+            await asyncio.sleep(0.05)
+            self.assertEqual(cosim.results.size, size)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertTrue(cosim.task.cancelled())
+            self.assertEqual(terminated, [True])
+            self.assertEqual(cosim.results.size, size)
+
+        asyncio.run(main())
+
 
 if __name__ == '__main__':
     unittest.main()